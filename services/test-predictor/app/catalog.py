@@ -0,0 +1,201 @@
+"""
+Data-driven catalog of product families, test specifications and factories
+
+The catalog (app/data/catalog.json, or PREDICTOR_CATALOG_PATH) is loaded once
+per process into read-only mappings that every request shares. Product and
+factory names are resolved through an index of normalized aliases, ignoring
+case, accents and punctuation, so a new product or factory only needs a new
+catalog entry.
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Catálogo distribuído com o serviço
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(__file__), "data", "catalog.json")
+
+# Campos de cada teste que formam a especificação (os demais são do modelo mock)
+SPEC_FIELDS = ('unit', 'spec_limit', 'limit_type', 'target')
+
+# Nomes de produto/fábrica distintos memorizados pela resolução
+RESOLVE_CACHE_SIZE = 4096
+
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Forma canônica de um nome para busca no catálogo
+    
+    Remove acentos, ignora maiúsculas e reduz pontuação e espaços a um
+    espaço simples (ex: 'Kit-Kat  Ao Leite' -> 'kit kat ao leite').
+    """
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_ALPHANUMERIC.sub(" ", stripped.casefold()).strip()
+
+
+def _freeze(value: Any) -> Any:
+    """Read-only copy of nested JSON dictionaries and lists"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class ProductFamily:
+    """Família de produto: testes com parâmetros do modelo mock e especificações"""
+    
+    def __init__(self, name: str, aliases: Tuple[str, ...], tests: Mapping[str, Mapping[str, Any]]):
+        self.name = name
+        self.aliases = aliases
+        self.tests = tests
+        self.specifications: Mapping[str, Mapping[str, Any]] = MappingProxyType({
+            test_name: MappingProxyType({field: test[field] for field in SPEC_FIELDS if field in test})
+            for test_name, test in tests.items()
+        })
+    
+    def __repr__(self) -> str:
+        return f"ProductFamily({self.name!r}, tests={list(self.tests)})"
+
+
+class Factory:
+    """Fábrica: variabilidade relativa e correlação dos parâmetros de processo"""
+    
+    def __init__(self, name: str, aliases: Tuple[str, ...], variability: Mapping[str, float], correlation: np.ndarray):
+        self.name = name
+        self.aliases = aliases
+        self.variability = variability
+        self.correlation = correlation
+        self.correlation.setflags(write=False)
+    
+    def __repr__(self) -> str:
+        return f"Factory({self.name!r})"
+
+
+class Catalog:
+    """
+    Catálogo imutável com índices de busca por nome normalizado
+    
+    A busca tenta primeiro o nome exato (nome ou alias normalizado) e depois
+    o primeiro alias contido no nome, na ordem do arquivo ('Nescau Zero
+    Açúcar' -> Nescau). Resultados são memorizados por nome.
+    """
+    
+    def __init__(self, data: Dict[str, Any]):
+        self.generic_family: str = data['generic_family']
+        self.families: Mapping[str, ProductFamily] = MappingProxyType({
+            name: ProductFamily(name, tuple(entry.get('aliases', ())), _freeze(entry['tests']))
+            for name, entry in data['product_families'].items()
+        })
+        if self.generic_family not in self.families:
+            raise ValueError(f"Generic family {self.generic_family!r} is not in the catalog")
+        # Famílias com modelos dedicados, na ordem de resolução
+        self.product_families: Tuple[str, ...] = tuple(
+            name for name in self.families if name != self.generic_family
+        )
+        
+        self.feature_importance: Mapping[str, Mapping[str, float]] = _freeze(data['feature_importance'])
+        
+        self.factories: Mapping[str, Factory] = MappingProxyType({
+            name: Factory(
+                name,
+                tuple(entry.get('aliases', ())),
+                _freeze(entry['variability']),
+                np.array(entry['correlation'], dtype=float)
+            )
+            for name, entry in data['factories'].items()
+        })
+        default = data['default_factory']
+        self.default_factory = Factory(
+            'default', (), _freeze(default['variability']), np.array(default['correlation'], dtype=float)
+        )
+        
+        self._family_index = self._build_index(
+            {name: family.aliases for name, family in self.families.items() if name != self.generic_family}
+        )
+        self._factory_index = self._build_index(
+            {name: factory.aliases for name, factory in self.factories.items()}
+        )
+        self.resolve_family = lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve_family)
+        self.resolve_factory = lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve_factory)
+    
+    @staticmethod
+    def _build_index(aliases_by_name: Dict[str, Tuple[str, ...]]) -> Dict[str, str]:
+        """{alias normalizado: nome canônico} na ordem de prioridade (o primeiro prevalece)"""
+        index: Dict[str, str] = {}
+        for name, aliases in aliases_by_name.items():
+            for alias in (name,) + aliases:
+                key = normalize_name(alias)
+                if key and key not in index:
+                    index[key] = name
+        return index
+    
+    @staticmethod
+    def _lookup(index: Dict[str, str], name: str) -> Optional[str]:
+        key = normalize_name(name)
+        if not key:
+            return None
+        canonical = index.get(key)
+        if canonical is not None:
+            return canonical
+        for alias, canonical in index.items():
+            if alias in key:
+                return canonical
+        return None
+    
+    def _resolve_family(self, product_name: str) -> str:
+        return self._lookup(self._family_index, product_name) or self.generic_family
+    
+    def _resolve_factory(self, factory: str) -> Optional[str]:
+        return self._lookup(self._factory_index, factory)
+    
+    def family(self, product_name: str) -> ProductFamily:
+        """Família do produto (a genérica se nenhum alias corresponder)"""
+        return self.families[self.resolve_family(product_name)]
+    
+    def factory(self, name: str) -> Factory:
+        """Fábrica pelo nome ou alias (a padrão, conservadora, se desconhecida)"""
+        canonical = self.resolve_factory(name)
+        return self.factories[canonical] if canonical is not None else self.default_factory
+    
+    def importance(self, test_name: str) -> Mapping[str, float]:
+        """Importância das features do modelo mock de um teste"""
+        return self.feature_importance.get(test_name, self.feature_importance['default'])
+
+
+def load_catalog(path: str) -> Catalog:
+    """
+    Carrega e indexa um catálogo em JSON
+    
+    Args:
+        path: Caminho do arquivo (formato de app/data/catalog.json)
+    
+    Returns:
+        Catalog imutável
+    """
+    with open(path, encoding="utf-8") as f:
+        catalog = Catalog(json.load(f))
+    logger.info(
+        f"Loaded catalog {path}: {len(catalog.product_families)} product families, "
+        f"{len(catalog.factories)} factories"
+    )
+    return catalog
+
+
+@lru_cache(maxsize=1)
+def get_catalog() -> Catalog:
+    """Catalog of this process, loaded on first use (PREDICTOR_CATALOG_PATH or the bundled file)"""
+    return load_catalog(settings.catalog_path or DEFAULT_CATALOG_PATH)
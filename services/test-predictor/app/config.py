@@ -0,0 +1,89 @@
+"""
+Runtime configuration for TestPredictorService (environment variables)
+"""
+import os
+import tempfile
+from typing import Literal, Optional
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    """Configurações do serviço, lidas de variáveis de ambiente PREDICTOR_*"""
+    model_config = SettingsConfigDict(env_prefix="PREDICTOR_", protected_namespaces=("settings_",))
+    
+    executor_kind: Literal["thread", "process"] = Field(
+        "thread", description="Tipo de pool para o trabalho de CPU (thread ou process)"
+    )
+    executor_workers: int = Field(4, ge=1, description="Número de workers do pool")
+    executor_max_queue: int = Field(
+        16, ge=0, description="Predições aguardando worker antes de responder 503"
+    )
+    launcher_workers: Optional[int] = Field(
+        None, ge=1, description="Processos uvicorn do launcher multiprocesso (None = núcleos disponíveis)"
+    )
+    stream_window: int = Field(
+        8, ge=1, description="Predições em andamento/retidas por conexão em /predict/stream"
+    )
+    
+    model_cache_size: int = Field(16, ge=1, description="Máximo de modelos (famílias) em memória")
+    model_cache_ttl_seconds: Optional[float] = Field(
+        None, gt=0, description="Tempo de vida de um modelo em cache (None = sem expiração)"
+    )
+    preload_models: bool = Field(False, description="Carregar todas as famílias de produto no startup")
+    model_registry_path: Optional[str] = Field(
+        None, description="Diretório do registro de modelos treinados (None = modelos mock)"
+    )
+    catalog_path: Optional[str] = Field(
+        None, description="Catálogo JSON de famílias, testes e fábricas (None = app/data/catalog.json)"
+    )
+    
+    explanation_cache_size: int = Field(
+        1024, ge=1, description="Explicações SHAP adiadas (shap_mode='deferred') guardadas para leitura"
+    )
+    explanation_ttl_seconds: Optional[float] = Field(
+        3600.0, gt=0, description="Tempo de vida de uma explicação adiada"
+    )
+    
+    whatif_session_cache_size: int = Field(
+        64, ge=1, description="Sessões what-if mantidas por processo (cada uma guarda testes × iterações sorteios)"
+    )
+    whatif_session_ttl_seconds: Optional[float] = Field(
+        1800.0, gt=0, description="Tempo de vida de uma sessão what-if desde a última mudança"
+    )
+    
+    data_dir: str = Field(
+        os.path.join(tempfile.gettempdir(), "test-predictor"),
+        description="Diretório dos arquivos SQLite compartilhados entre workers (volume no container)"
+    )
+    state_db_path: Optional[str] = Field(
+        None,
+        description="Arquivo SQLite do estado compartilhado entre workers (explicações adiadas, sessões what-if) "
+                    "(None = data_dir/predictor-state.sqlite)"
+    )
+    jobs_db_path: Optional[str] = Field(
+        None, description="Arquivo SQLite dos jobs assíncronos (None = data_dir/predictor-jobs.sqlite)"
+    )
+    jobs_workers: int = Field(2, ge=1, description="Jobs executados ao mesmo tempo por processo")
+    jobs_max_queue: int = Field(64, ge=1, description="Jobs aguardando execução por processo antes de responder 503")
+    jobs_ttl_seconds: Optional[float] = Field(
+        86400.0, gt=0, description="Tempo de vida do resultado de um job finalizado"
+    )
+    
+    result_cache_enabled: bool = Field(True, description="Memoizar resultados de requests idênticos")
+    result_cache_size: int = Field(1024, ge=1, description="Máximo de resultados no cache em memória")
+    result_cache_ttl_seconds: Optional[float] = Field(
+        3600.0, gt=0, description="Tempo de vida de um resultado memoizado"
+    )
+    result_cache_path: Optional[str] = Field(
+        None, description="Arquivo SQLite compartilhado entre workers (None = só memória)"
+    )
+    
+    def data_file(self, name: str) -> str:
+        """Caminho absoluto de um arquivo em data_dir (cria o diretório se preciso)"""
+        data_dir = os.path.abspath(self.data_dir)
+        os.makedirs(data_dir, exist_ok=True)
+        return os.path.join(data_dir, name)
+
+
+settings = Settings()
@@ -0,0 +1,81 @@
+"""
+Design of experiments for parameter sweeps (grid, Latin hypercube, Sobol)
+
+scipy.stats.qmc is imported only when a quasi-random design is requested.
+"""
+import numpy as np
+from typing import Sequence, Union
+
+
+# Métodos de amostragem aceitos por /sweep
+SWEEP_METHODS = ("grid", "latin_hypercube", "sobol")
+
+
+def grid_size(steps: Sequence[int]) -> int:
+    """Número de pontos da grade completa (produto dos passos de cada dimensão)"""
+    return int(np.prod([int(s) for s in steps], dtype=np.int64))
+
+
+def sample_design(
+    lower: np.ndarray,
+    upper: np.ndarray,
+    method: str = "grid",
+    n_points: int = 1024,
+    steps: Sequence[int] = (),
+    random_seed: int = 42
+) -> np.ndarray:
+    """
+    Gera os pontos de um experimento sobre uma caixa de parâmetros
+    
+    Args:
+        lower: Vetor (dimensões,) de limites inferiores
+        upper: Vetor (dimensões,) de limites superiores
+        method: 'grid', 'latin_hypercube' ou 'sobol'
+        n_points: Número de pontos (latin_hypercube/sobol)
+        steps: Pontos por dimensão (grid), extremos incluídos
+        random_seed: Semente do hipercubo latino e do embaralhamento do Sobol
+    
+    Returns:
+        Matriz (pontos, dimensões); na grade, a última dimensão varia mais rápido
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    
+    if method == "grid":
+        axes = [np.linspace(lo, hi, int(s)) for lo, hi, s in zip(lower, upper, steps)]
+        mesh = np.meshgrid(*axes, indexing='ij')
+        return np.stack([m.reshape(-1) for m in mesh], axis=1)
+    
+    unit = unit_design(len(lower), method, n_points, random_seed)
+    return lower + unit * (upper - lower)
+
+
+def unit_design(
+    dimensions: int,
+    method: str,
+    n_points: int,
+    random_seed: Union[int, np.random.Generator]
+) -> np.ndarray:
+    """
+    Pontos quasi-aleatórios em [0, 1)^dimensões
+    
+    Args:
+        dimensions: Número de dimensões
+        method: 'latin_hypercube' ou 'sobol' (embaralhado)
+        n_points: Número de pontos
+        random_seed: Semente ou Generator (ex: stream filho de um SeedSequence)
+    
+    Returns:
+        Matriz (n_points, dimensões)
+    """
+    from scipy.stats import qmc
+    
+    if method == "latin_hypercube":
+        return qmc.LatinHypercube(d=dimensions, seed=random_seed).random(n_points)
+    if method == "sobol":
+        # Sobol é balanceado em potências de 2: sorteia a menor que cobre
+        # n_points e usa o prefixo da sequência
+        sampler = qmc.Sobol(d=dimensions, scramble=True, seed=random_seed)
+        m = max(0, int(np.ceil(np.log2(n_points))))
+        return sampler.random_base2(m)[:n_points]
+    raise ValueError(f"Unknown sweep method '{method}' (expected one of {', '.join(SWEEP_METHODS)})")
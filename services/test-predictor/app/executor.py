@@ -0,0 +1,84 @@
+"""
+Execution layer that keeps CPU-bound prediction work off the asyncio event loop
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorSaturatedError(Exception):
+    """Raised when the worker pool and its pending queue are full"""
+
+
+class PredictionExecutor:
+    """Pool de threads ou processos com limite de predições em andamento"""
+    
+    def __init__(self, kind: str = "thread", max_workers: int = 4, max_queue: int = 16):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_in_flight = max_workers + max_queue
+        self.in_flight = 0
+        self._pool: Optional[Executor] = None
+    
+    def _get_pool(self) -> Executor:
+        """Create the pool lazily so importing the app never forks workers"""
+        if self._pool is None:
+            logger.info(f"Starting {self.kind} pool with {self.max_workers} workers")
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="predictor"
+                )
+        return self._pool
+    
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """
+        Executa fn(*args) no pool sem bloquear o event loop
+        
+        Args:
+            fn: Função síncrona (deve ser importável no módulo se kind='process')
+            *args: Argumentos da função
+        
+        Returns:
+            Resultado de fn(*args)
+        
+        Raises:
+            ExecutorSaturatedError: Se workers e fila estiverem ocupados
+        """
+        # Only touched from the event loop thread, so no lock is needed
+        if self.in_flight >= self.max_in_flight:
+            raise ExecutorSaturatedError(
+                f"Prediction queue is full ({self.in_flight} in flight), retry later"
+            )
+        
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_pool(), functools.partial(fn, *args))
+        finally:
+            self.in_flight -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Current pool occupancy"""
+        return {
+            'kind': self.kind,
+            'workers': self.max_workers,
+            'in_flight': self.in_flight,
+            'queued': max(0, self.in_flight - self.max_workers),
+            'max_in_flight': self.max_in_flight
+        }
+    
+    def shutdown(self):
+        """Stop the pool, waiting for running predictions"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
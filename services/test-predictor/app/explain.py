@@ -0,0 +1,236 @@
+"""
+SHAP explanations of the base predictions, with explainers cached per model version
+
+Mock models are linear in the encoded features, so their SHAP values are
+exact and closed-form: coef · (x - E[x]). Trained tree estimators use
+shap.TreeExplainer, imported only when a trained model is explained and
+built once per (family, version) together with its expected values. Both
+explainers take a matrix of encoded rows, so a whole batch is explained in
+one call.
+"""
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+from .cache import LRUCache
+from .schemas import ShapExplanation
+
+if TYPE_CHECKING:
+    from .ml_models import TestPredictorModel
+
+logger = logging.getLogger(__name__)
+
+# Explainers em memória (um por família e versão de modelo)
+EXPLAINER_CACHE_SIZE = 16
+
+# Fatores listados em top_positive_factors/top_negative_factors
+TOP_FACTORS = 3
+
+# Features listadas em feature_importance
+TOP_FEATURES = 10
+
+# Valor base do score de risco reportado na explicação agregada
+BASE_RISK_SCORE = 50.0
+
+
+class LinearExplainer:
+    """
+    SHAP exato dos modelos mock: predição = médias · (1 + x · Wᵀ)
+    
+    Com features independentes, o valor SHAP da feature j no teste t é
+    médias[t] · W[t, j] · (x[j] - E[x[j]]); o valor esperado é a predição em
+    E[x], calculada uma vez na construção.
+    """
+    
+    def __init__(self, means: np.ndarray, weights: np.ndarray, background: Optional[np.ndarray] = None):
+        # Sem dados de fundo: centro da normalização (valor bruto 50 -> 0)
+        self.feature_means = (
+            np.zeros(weights.shape[1]) if background is None else np.asarray(background, dtype=float).mean(axis=0)
+        )
+        self.coefficients = np.asarray(means)[:, None] * np.asarray(weights)
+        self.expected_value = np.asarray(means) * (1 + np.asarray(weights) @ self.feature_means)
+    
+    def shap_values(self, features: np.ndarray) -> np.ndarray:
+        """
+        Valores SHAP de várias linhas de features
+        
+        Args:
+            features: Matriz (n, features) codificada pelo FeatureSchema
+        
+        Returns:
+            Tensor (n, testes, features)
+        """
+        return (features - self.feature_means)[:, None, :] * self.coefficients[None]
+
+
+class TreeEnsembleExplainer:
+    """shap.TreeExplainer de cada teste de um modelo treinado"""
+    
+    def __init__(self, estimators: List, background: Optional[np.ndarray] = None):
+        import shap
+        
+        # Com dados de fundo, esperança intervencional sobre eles; sem, a
+        # cobertura das árvores (tree_path_dependent) faz o papel do fundo
+        self.explainers = [
+            shap.TreeExplainer(estimator, data=background, feature_perturbation="interventional")
+            if background is not None
+            else shap.TreeExplainer(estimator)
+            for estimator in estimators
+        ]
+        self.expected_value = np.array([float(np.ravel(e.expected_value)[0]) for e in self.explainers])
+    
+    def shap_values(self, features: np.ndarray) -> np.ndarray:
+        """Tensor (n, testes, features), one TreeExplainer call per test"""
+        return np.stack([
+            np.asarray(explainer.shap_values(features), dtype=float).reshape(len(features), -1)
+            for explainer in self.explainers
+        ], axis=1)
+
+
+# (família, versão) -> explainer, ou None quando o modelo não é suportado
+explainer_cache = LRUCache(max_size=EXPLAINER_CACHE_SIZE)
+
+
+def get_explainer(model: "TestPredictorModel"):
+    """
+    Explainer do modelo, construído na primeira chamada e mantido em cache
+    
+    Returns:
+        LinearExplainer (mock), TreeEnsembleExplainer (treinado) ou None se o
+        estimador treinado não for suportado pelo TreeExplainer
+    """
+    def build():
+        if not model.trained:
+            return LinearExplainer(model.schema.means, model.schema.weights, background=model.background)
+        try:
+            logger.info(f"Building TreeExplainer for {model.product_name} (version: {model.version})")
+            return TreeEnsembleExplainer(
+                [model.models[test_name]['estimator'] for test_name in model.schema.test_names],
+                background=model.background
+            )
+        except Exception as e:
+            logger.warning(f"SHAP unavailable for {model.product_name} {model.version}: {str(e)}")
+            return None
+    
+    return explainer_cache.get_or_create((model.product_name, model.version), build)
+
+
+def explain_features(
+    model: "TestPredictorModel",
+    features: np.ndarray,
+    test_specs: List[Dict[str, Dict]]
+) -> List[ShapExplanation]:
+    """
+    Explica várias linhas de features do mesmo modelo em uma única chamada
+    
+    Args:
+        model: Modelo que gerou as predições
+        features: Matriz (n, features) codificada por model.schema
+        test_specs: Especificações dos testes de cada linha (define se
+            aumentar o valor aumenta ou reduz o risco)
+    
+    Returns:
+        Lista com uma ShapExplanation por linha
+    """
+    explainer = get_explainer(model)
+    if explainer is None:
+        return [importance_explanation(model) for _ in range(len(features))]
+    
+    values = explainer.shap_values(np.atleast_2d(features))
+    return [
+        summarize_shap_values(
+            row_values,
+            explainer.expected_value,
+            model.schema.test_names,
+            model.schema.feature_names,
+            specs
+        )
+        for row_values, specs in zip(values, test_specs)
+    ]
+
+
+def summarize_shap_values(
+    values: np.ndarray,
+    expected_value: np.ndarray,
+    test_names: List[str],
+    feature_names: List[str],
+    test_specs: Dict[str, Dict]
+) -> ShapExplanation:
+    """
+    Agrega os valores SHAP (testes × features) de uma predição
+    
+    Cada teste é medido relativo ao seu valor esperado (unidades diferentes
+    ficam comparáveis) e com o sinal do risco: em limite superior, aumentar
+    o valor aumenta o risco; em limite inferior, reduz.
+    
+    Returns:
+        ShapExplanation com importâncias normalizadas, fatores que aumentam e
+        reduzem o risco e os valores SHAP brutos por teste
+    """
+    direction = np.array([
+        1.0 if test_specs.get(test_name, {}).get('limit_type', 'upper') == 'upper' else -1.0
+        for test_name in test_names
+    ])
+    scale = np.where(np.abs(expected_value) > 0, np.abs(expected_value), 1.0)
+    relative = values / scale[:, None]
+    
+    magnitude = np.abs(relative).sum(axis=0)
+    risk = (relative * direction[:, None]).sum(axis=0)
+    total_magnitude = magnitude.sum()
+    total_risk = np.abs(risk).sum()
+    
+    importance_order = np.argsort(-magnitude, kind='stable')
+    feature_importance = {
+        feature_names[j]: float(magnitude[j] / total_magnitude)
+        for j in importance_order[:TOP_FEATURES]
+        if magnitude[j] > 0
+    }
+    
+    risk_order = np.argsort(-risk, kind='stable')
+    top_positive = [
+        f"{feature_names[j].replace('_', ' ').title()} (+{risk[j] / total_risk:.1%})"
+        for j in risk_order[:TOP_FACTORS]
+        if risk[j] > 0
+    ]
+    top_negative = [
+        f"{feature_names[j].replace('_', ' ').title()} (-{-risk[j] / total_risk:.1%})"
+        for j in risk_order[::-1][:TOP_FACTORS]
+        if risk[j] < 0
+    ]
+    
+    return ShapExplanation(
+        feature_importance=feature_importance,
+        top_positive_factors=top_positive,
+        top_negative_factors=top_negative,
+        base_value=BASE_RISK_SCORE,
+        shap_values={
+            test_name: {feature_names[j]: float(v) for j, v in enumerate(row) if v != 0}
+            for test_name, row in zip(test_names, values)
+        },
+        expected_values={test_name: float(v) for test_name, v in zip(test_names, expected_value)}
+    )
+
+
+def importance_explanation(model: "TestPredictorModel") -> ShapExplanation:
+    """Static feature-importance summary, used when the model has no SHAP explainer"""
+    all_importances: Dict[str, float] = {}
+    for model_info in model.models.values():
+        for feature, importance in model_info['feature_importance'].items():
+            all_importances[feature] = all_importances.get(feature, 0) + importance
+    
+    total_importance = sum(all_importances.values())
+    if total_importance > 0:
+        all_importances = {k: v / total_importance for k, v in all_importances.items()}
+    sorted_features = sorted(all_importances.items(), key=lambda x: x[1], reverse=True)
+    
+    return ShapExplanation(
+        feature_importance=dict(sorted_features[:TOP_FEATURES]),
+        top_positive_factors=[
+            f"{feat.replace('_', ' ').title()} (+{imp:.1%})" for feat, imp in sorted_features[:TOP_FACTORS]
+        ],
+        top_negative_factors=[
+            f"{feat.replace('_', ' ').title()} (-{imp:.1%})" for feat, imp in sorted_features[-TOP_FACTORS:]
+        ],
+        base_value=BASE_RISK_SCORE
+    )
@@ -0,0 +1,320 @@
+"""
+Asynchronous prediction jobs with results persisted in SQLite
+
+POST /jobs stores the request and returns its id right away; a bounded
+in-process queue feeds a fixed number of runner tasks that execute the jobs
+through the prediction worker pool. Status and results live in SQLite, so
+any uvicorn worker can answer GET /jobs/{id} and finished results survive a
+restart until they expire. Jobs left queued or running by a process that is
+gone are requeued by the next process that starts.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Estados de um job
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Limpeza de jobs expirados a cada N jobs finalizados
+PRUNE_EVERY = 100
+
+JobHandler = Callable[[str, str], Awaitable[str]]
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue of this process is full"""
+
+
+def process_token(pid: Optional[int] = None) -> Optional[str]:
+    """
+    Identificador de um processo vivo: pid + instante de início
+    
+    O instante de início (campo 22 de /proc/<pid>/stat) distingue um pid
+    reutilizado, por exemplo após o restart do container. Fora do Linux
+    fica só o pid.
+    
+    Returns:
+        Token do processo ou None se ele não existir mais
+    """
+    pid = os.getpid() if pid is None else pid
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # O nome do processo (campo 2) pode conter espaços; vem entre parênteses
+            fields = f.read().rsplit(")", 1)[1].split()
+        return f"{pid}:{fields[19]}"
+    except FileNotFoundError:
+        return None
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None
+        except PermissionError:
+            pass
+        return str(pid)
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    if not owner:
+        return False
+    return process_token(int(owner.split(":", 1)[0])) == owner
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.utcfromtimestamp(timestamp).isoformat() + "Z"
+
+
+class JobStore:
+    """Tabela de jobs em SQLite (WAL), compartilhada entre workers"""
+    
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._finished = 0
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prediction_jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+            "request TEXT NOT NULL, result TEXT, error TEXT, owner TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_prediction_jobs_status "
+            "ON prediction_jobs (status, finished_at)"
+        )
+    
+    def create(self, job_id: str, kind: str, request: str, owner: str) -> Dict[str, Any]:
+        """Insert a queued job owned by this process"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO prediction_jobs (id, kind, status, request, owner, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, request, owner, now)
+            )
+        return {'job_id': job_id, 'kind': kind, 'status': QUEUED, 'created_at': _isoformat(now)}
+    
+    def get(self, job_id: str) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+        """
+        Estado de um job
+        
+        Returns:
+            Tuple de (campos de JobStatus sem o resultado, resultado JSON ou
+            None), ou None se o job não existir ou tiver expirado
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, status, result, error, created_at, started_at, finished_at "
+                "FROM prediction_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, status, result, error, created_at, started_at, finished_at = row
+        expires_at = (
+            finished_at + self.ttl_seconds
+            if finished_at is not None and self.ttl_seconds is not None else None
+        )
+        if expires_at is not None and time.time() > expires_at:
+            return None
+        
+        fields = {
+            'job_id': job_id,
+            'kind': kind,
+            'status': status,
+            'created_at': _isoformat(created_at),
+            'started_at': _isoformat(started_at),
+            'finished_at': _isoformat(finished_at),
+            'expires_at': _isoformat(expires_at),
+            'error': error
+        }
+        return fields, result
+    
+    def start(self, job_id: str) -> Optional[Tuple[str, str]]:
+        """
+        Mark a queued job as running
+        
+        Returns:
+            Tuple de (kind, request JSON), ou None se o job não está mais na fila
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, request FROM prediction_jobs WHERE id = ? AND status = ?", (job_id, QUEUED)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE prediction_jobs SET status = ?, started_at = ? WHERE id = ?",
+                    (RUNNING, time.time(), job_id)
+                )
+        return row
+    
+    def finish(self, job_id: str, result: Optional[str] = None, error: Optional[str] = None):
+        """Store the result (or the error) of a job and release it"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE prediction_jobs SET status = ?, result = ?, error = ?, finished_at = ?, owner = NULL "
+                "WHERE id = ?",
+                (FAILED if error is not None else COMPLETED, result, error, time.time(), job_id)
+            )
+            self._finished += 1
+            if self._finished % PRUNE_EVERY == 0:
+                self._prune()
+    
+    def recover(self, owner: str) -> List[str]:
+        """
+        Assume os jobs pendentes de processos que não existem mais
+        
+        Jobs em execução voltam para a fila. A troca de dono é condicional ao
+        dono anterior, então workers iniciando juntos não assumem o mesmo job.
+        
+        Returns:
+            Ids dos jobs assumidos, na ordem de criação
+        """
+        with self._lock:
+            self._prune()
+            rows = self._conn.execute(
+                "SELECT id, owner FROM prediction_jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING)
+            ).fetchall()
+            recovered = []
+            for job_id, previous in rows:
+                if previous == owner or _owner_alive(previous):
+                    continue
+                cursor = self._conn.execute(
+                    "UPDATE prediction_jobs SET status = ?, started_at = NULL, owner = ? "
+                    "WHERE id = ? AND owner IS ? AND status IN (?, ?)",
+                    (QUEUED, owner, job_id, previous, QUEUED, RUNNING)
+                )
+                if cursor.rowcount:
+                    recovered.append(job_id)
+        return recovered
+    
+    def release(self, owner: str):
+        """Return this process' unfinished jobs to the queue (on shutdown)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE prediction_jobs SET status = ?, started_at = NULL, owner = NULL "
+                "WHERE owner = ? AND status IN (?, ?)",
+                (QUEUED, owner, QUEUED, RUNNING)
+            )
+    
+    def _prune(self):
+        if self.ttl_seconds is not None:
+            self._conn.execute(
+                "DELETE FROM prediction_jobs WHERE finished_at < ?",
+                (time.time() - self.ttl_seconds,)
+            )
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """
+    Fila limitada de jobs deste processo, consumida por runners assíncronos
+    
+    Cada runner aguarda o handler do job (que usa o pool de predição), então
+    no máximo `workers` jobs ocupam o pool ao mesmo tempo e as predições
+    síncronas continuam sendo atendidas.
+    """
+    
+    def __init__(self, store: JobStore, workers: int = 2, max_queue: int = 64):
+        self.store = store
+        self.workers = workers
+        self.max_queue = max_queue
+        self.owner = process_token() or str(os.getpid())
+        self.running = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+    
+    def start(self, handler: JobHandler):
+        """Start the runners and requeue jobs orphaned by a previous process"""
+        self.owner = process_token() or str(os.getpid())
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._run(handler), name=f"job-runner-{i}")
+            for i in range(self.workers)
+        ]
+        recovered = self.store.recover(self.owner)
+        for job_id in recovered:
+            self._queue.put_nowait(job_id)
+        if recovered:
+            logger.info(f"Requeued {len(recovered)} unfinished jobs")
+    
+    def submit(self, job_id: str, kind: str, request: str) -> Dict[str, Any]:
+        """
+        Persiste e enfileira um job
+        
+        Returns:
+            Campos de JobStatus do job criado
+        
+        Raises:
+            JobQueueFullError: Se a fila deste processo estiver cheia
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue is not running")
+        if self._queue.qsize() >= self.max_queue:
+            raise JobQueueFullError(f"Job queue is full ({self._queue.qsize()} queued), retry later")
+        status = self.store.create(job_id, kind, request, self.owner)
+        self._queue.put_nowait(job_id)
+        return status
+    
+    async def _run(self, handler: JobHandler):
+        while True:
+            job_id = await self._queue.get()
+            job = self.store.start(job_id)
+            if job is None:
+                continue
+            
+            kind, request = job
+            self.running += 1
+            try:
+                result = await handler(kind, request)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+                self.store.finish(job_id, error=str(e))
+            else:
+                self.store.finish(job_id, result=result)
+                logger.info(f"Job {job_id} completed")
+            finally:
+                self.running -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Current queue occupancy of this process"""
+        return {
+            'workers': self.workers,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'running': self.running,
+            'max_queue': self.max_queue
+        }
+    
+    async def stop(self):
+        """Cancel the runners; unfinished jobs go back to the shared queue"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.release(self.owner)
+
+
+def job_status_json(fields: Dict[str, Any], result: Optional[str]) -> str:
+    """JobStatus JSON with the stored result embedded as is (no re-validation)"""
+    return json.dumps(fields, ensure_ascii=False)[:-1] + ', "result": ' + (result or "null") + "}"
@@ -0,0 +1,145 @@
+"""
+Preforking multi-process launcher for TestPredictorService
+
+The parent process imports the heavy libraries, packs the read-only tables
+into shared memory (shared_tables), binds the listening socket and forks one
+uvicorn worker per core. Workers import app.main after the fork, so each one
+has its own result cache connection, worker pool and metrics, while library
+pages and the shared tables stay shared. Workers that die are restarted;
+SIGTERM/SIGINT stop all of them and free the shared block.
+
+Usage:
+    python -m app.launcher --host 0.0.0.0 --port 8001 --workers 4
+"""
+import argparse
+import importlib
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+from . import shared_tables
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Módulos importados antes do fork (páginas compartilhadas copy-on-write);
+# app.main fica de fora porque abre o cache de resultados e o pool de workers
+PRELOAD_MODULES = (
+    "numpy",
+    "pydantic",
+    "fastapi",
+    "app.schemas",
+    "app.catalog",
+    "app.ml_models",
+    "app.monte_carlo",
+    "app.result_cache",
+    "app.metrics"
+)
+
+# Espera antes de recriar um worker que terminou inesperadamente
+RESTART_DELAY_SECONDS = 1.0
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on (cpuset-aware on Linux)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_worker(config: uvicorn.Config, sock) -> None:
+    """Serve the app on the inherited socket (runs in the forked child)"""
+    # Handlers do processo pai; o uvicorn instala os seus no event loop
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0', help='Bind address')
+    parser.add_argument('--port', type=int, default=8001, help='Bind port')
+    parser.add_argument(
+        '--workers', type=int, default=settings.launcher_workers,
+        help='Worker processes (default: PREDICTOR_LAUNCHER_WORKERS or the available cores)'
+    )
+    parser.add_argument('--log-level', default='info', help='uvicorn log level')
+    args = parser.parse_args(argv)
+    workers = args.workers or available_cores()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    for module in PRELOAD_MODULES:
+        importlib.import_module(module)
+    tables = shared_tables.SharedTables.create(*shared_tables.build_tables())
+    shared_tables.install(tables)
+    
+    config = uvicorn.Config("app.main:app", host=args.host, port=args.port, log_level=args.log_level)
+    sock = config.bind_socket()
+    
+    children: Dict[int, int] = {}
+    stopping = False
+    
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(config, sock)
+            except BaseException:
+                logger.exception(f"Worker {slot} crashed")
+                code = 1
+            finally:
+                # Sem finalizadores: o bloco compartilhado pertence ao pai
+                os._exit(code)
+        children[pid] = slot
+    
+    def stop(signum: int, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    logger.info(f"Starting {workers} workers on {args.host}:{args.port}")
+    for slot in range(workers):
+        spawn(slot)
+    
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            slot: Optional[int] = children.pop(pid, None)
+            if slot is None or stopping:
+                continue
+            logger.warning(
+                f"Worker {pid} exited with code {os.waitstatus_to_exitcode(status)}, restarting"
+            )
+            time.sleep(RESTART_DELAY_SECONDS)
+            if not stopping:
+                spawn(slot)
+    finally:
+        sock.close()
+        shared_tables.install(None)
+        tables.close()
+        tables.unlink()
+    
+    logger.info("All workers stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
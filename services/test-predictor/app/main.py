@@ -1,22 +1,75 @@
 """
 TestPredictorService - FastAPI microservice for ML-based test predictions
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from collections import deque
 from datetime import datetime
+import asyncio
+import json
 import logging
-from typing import Dict
+import sqlite3
+import time
+import uuid
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple, Union
 
+import numpy as np
+from pydantic import ValidationError
+
+from .registry import ModelRegistry
+from .result_cache import ResultCache
 from .schemas import (
     PredictionRequest,
     PredictionResponse,
+    OptimizationRequest,
+    OptimizationResponse,
+    ProcessParameters,
+    SweepRequest,
+    SweepResponse,
+    TestSurface,
     TestPrediction,
     ShapExplanation,
+    JobStatus,
+    ParameterBounds,
+    WhatIfResponse,
+    WhatIfTest,
+    WhatIfUpdate,
+    check_parameter_bounds,
     HealthResponse
 )
-from .ml_models import TestPredictorModel, get_test_specifications
+from .config import settings
+from .executor import ExecutorSaturatedError, PredictionExecutor
+from .jobs import JobQueue, JobQueueFullError, JobStore, job_status_json
+from .shared_state import SharedStateStore
+from .cache import LRUCache
+from .metrics import (
+    MetricsMiddleware,
+    PipelineMetrics,
+    PipelineTimings,
+    format_metric,
+    record_iterations,
+    server_timing_header,
+    stage,
+    timed_call
+)
+from .design import grid_size, sample_design
+from .explain import explain_features, explainer_cache
+from .optimizer import cross_entropy_search
+from .whatif import WhatIfSession
+from .ml_models import (
+    DEFAULT_MODEL_VERSION,
+    GENERIC_PRODUCT_FAMILY,
+    PRODUCT_FAMILIES,
+    TestPredictorModel,
+    get_test_specifications,
+    ingredient_feature,
+    resolve_product_family
+)
 from .monte_carlo import (
     MonteCarloSimulator,
+    sweep_probability_of_fail,
     estimate_process_variability,
     estimate_formula_variability
 )
@@ -39,18 +92,115 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
+)
+
+# Stage latency histograms and request metrics exposed on /metrics
+pipeline_metrics = PipelineMetrics()
+app.add_middleware(MetricsMiddleware, metrics=pipeline_metrics)
+
+# Maximum number of requests accepted by /predict/batch
+MAX_BATCH_SIZE = 1000
+
+# Maximum number of points evaluated by /sweep
+MAX_SWEEP_POINTS = 100000
+
+# Wait between retries when a streamed prediction finds the pool saturated
+STREAM_RETRY_SECONDS = 0.05
+
+# Registry of trained model artifacts (mock models when not configured)
+model_registry = ModelRegistry(settings.model_registry_path) if settings.model_registry_path else None
+
+# Global models cache, keyed by product family and model version
+models_cache = LRUCache(
+    max_size=settings.model_cache_size,
+    ttl_seconds=settings.model_cache_ttl_seconds
+)
+
+# Memoized results of deterministic predictions
+result_cache = ResultCache(
+    max_size=settings.result_cache_size,
+    ttl_seconds=settings.result_cache_ttl_seconds,
+    sqlite_path=settings.result_cache_path
+) if settings.result_cache_enabled else None
+
+# Requests of shap_mode='deferred' predictions (replaced by the explanation once computed)
+deferred_explanations = LRUCache(
+    max_size=settings.explanation_cache_size,
+    ttl_seconds=settings.explanation_ttl_seconds
+)
+
+# The same entries in SQLite, so any worker can answer the follow-up request
+# (opened at startup; memory only until then)
+explanation_store: Optional[SharedStateStore] = None
+
+# What-if sessions (noise draws of a base request, updated incrementally)
+whatif_sessions = LRUCache(
+    max_size=settings.whatif_session_cache_size,
+    ttl_seconds=settings.whatif_session_ttl_seconds
 )
 
-# Global models cache
-models_cache: Dict[str, TestPredictorModel] = {}
+# Shared state of the sessions (request, model version, changes) in SQLite
+whatif_store: Optional[SharedStateStore] = None
+
+# Worker pool for CPU-bound prediction work
+prediction_executor = PredictionExecutor(
+    kind=settings.executor_kind,
+    max_workers=settings.executor_workers,
+    max_queue=settings.executor_max_queue
+)
+
+# Asynchronous jobs: persisted in SQLite, run by this process' job runners
+# (the store is opened at startup, so importing the module creates no files)
+job_queue: Optional[JobQueue] = None
+
+
+def running_job_queue() -> JobQueue:
+    """Job queue opened at startup, or 503 while the service is not started"""
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is not running", headers={"Retry-After": "1"})
+    return job_queue
+
+
+def current_model_version(product_name: str) -> str:
+    """Model version that a prediction for this product would use right now"""
+    if model_registry is not None:
+        version = model_registry.current_version(resolve_product_family(product_name))
+        if version is not None:
+            return version
+    return DEFAULT_MODEL_VERSION
+
+
+def model_cache_key(product_name: str) -> Tuple[str, Optional[str]]:
+    """Product family and active registry version (None for mock models)"""
+    family = resolve_product_family(product_name)
+    return family, model_registry.current_version(family) if model_registry is not None else None
 
 
 def get_or_create_model(product_name: str) -> TestPredictorModel:
-    """Get cached model or create new one"""
-    if product_name not in models_cache:
-        logger.info(f"Loading model for product: {product_name}")
-        models_cache[product_name] = TestPredictorModel(product_name)
-    return models_cache[product_name]
+    """Get cached model for the product family (and active version) or create new one"""
+    family, version = model_cache_key(product_name)
+    
+    def load_model() -> TestPredictorModel:
+        logger.info(f"Loading model for product family: {family} (version: {version or DEFAULT_MODEL_VERSION})")
+        return TestPredictorModel(family, registry=model_registry, version=version)
+    
+    # A new active version gets a new cache key; the old one ages out of the LRU
+    return models_cache.get_or_create((family, version), load_model)
+
+
+async def get_model_async(product_name: str, timings: PipelineTimings) -> TestPredictorModel:
+    """
+    Model for use on the event loop: the cached one, or loaded in a thread
+    
+    Loading reads the registry artifacts from disk, which must not block
+    the other requests served by the loop.
+    """
+    model = models_cache.get(model_cache_key(product_name))
+    if model is None:
+        with timings.measure("model_lookup"):
+            model = await run_in_threadpool(get_or_create_model, product_name)
+    return model
 
 
 @app.get("/health", response_model=HealthResponse)
@@ -63,11 +213,118 @@ async def health_check():
     )
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Size and hit/miss/eviction counters of the in-process caches"""
+    stats = {
+        "models": models_cache.stats(),
+        "explainers": explainer_cache.stats(),
+        "whatif_sessions": whatif_sessions.stats()
+    }
+    if result_cache is not None:
+        stats["results"] = result_cache.stats()
+    return stats
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of stage latencies, caches and worker pool occupancy"""
+    caches = {
+        "models": models_cache.stats(),
+        "explainers": explainer_cache.stats(),
+        "whatif_sessions": whatif_sessions.stats()
+    }
+    if result_cache is not None:
+        caches["results"] = result_cache.stats()
+    pool = prediction_executor.stats()
+    jobs = job_queue.stats() if job_queue is not None else {'queued': 0, 'running': 0}
+    
+    snapshots = [
+        format_metric("predictor_cache_hits_total", "counter", "Cache lookups that found an entry",
+                      [({"cache": name}, stats['hits']) for name, stats in caches.items()]),
+        format_metric("predictor_cache_misses_total", "counter", "Cache lookups that missed",
+                      [({"cache": name}, stats['misses']) for name, stats in caches.items()]),
+        format_metric("predictor_cache_hit_ratio", "gauge", "Cache hit rate since startup",
+                      [({"cache": name}, stats['hit_rate']) for name, stats in caches.items()]),
+        format_metric("predictor_cache_entries", "gauge", "Entries currently cached",
+                      [({"cache": name}, stats['size']) for name, stats in caches.items()]),
+        format_metric("predictor_executor_in_flight", "gauge", "Predictions running or queued in the worker pool",
+                      [({"kind": pool['kind']}, pool['in_flight'])]),
+        format_metric("predictor_executor_queue_depth", "gauge", "Predictions waiting for a free worker",
+                      [({"kind": pool['kind']}, pool['queued'])]),
+        format_metric("predictor_executor_workers", "gauge", "Worker pool size",
+                      [({"kind": pool['kind']}, pool['workers'])]),
+        format_metric("predictor_jobs", "gauge", "Asynchronous jobs of this process by state",
+                      [({"status": "queued"}, jobs['queued']), ({"status": "running"}, jobs['running'])])
+    ]
+    return Response(pipeline_metrics.render(snapshots), media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("startup")
+def preload_models():
+    """Optionally load every known product family before serving traffic"""
+    if settings.preload_models:
+        for family in PRODUCT_FAMILIES + (GENERIC_PRODUCT_FAMILY,):
+            get_or_create_model(family)
+
+
+@app.on_event("startup")
+def open_shared_state():
+    """Open the SQLite state shared by the workers (deferred explanations, what-if sessions)"""
+    global explanation_store, whatif_store
+    path = settings.state_db_path or settings.data_file("predictor-state.sqlite")
+    explanation_store = SharedStateStore(path, "deferred_explanations", ttl_seconds=settings.explanation_ttl_seconds)
+    whatif_store = SharedStateStore(path, "whatif_sessions", ttl_seconds=settings.whatif_session_ttl_seconds)
+
+
+@app.on_event("startup")
+async def start_jobs():
+    """Open the job store, start the runners and requeue jobs left unfinished by a previous process"""
+    global job_queue
+    job_queue = JobQueue(
+        JobStore(
+            settings.jobs_db_path or settings.data_file("predictor-jobs.sqlite"),
+            ttl_seconds=settings.jobs_ttl_seconds
+        ),
+        workers=settings.jobs_workers,
+        max_queue=settings.jobs_max_queue
+    )
+    job_queue.start(run_job)
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    """Stop the job runners, returning unfinished jobs to the shared queue, and close the store"""
+    global job_queue
+    if job_queue is not None:
+        await job_queue.stop()
+        job_queue.store.close()
+        job_queue = None
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    """Stop the prediction worker pool"""
+    global explanation_store, whatif_store
+    prediction_executor.shutdown()
+    if explanation_store is not None:
+        explanation_store.close()
+        explanation_store = None
+    if whatif_store is not None:
+        whatif_store.close()
+        whatif_store = None
+    if result_cache is not None:
+        result_cache.close()
+
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict_test_results(request: PredictionRequest):
     """
     Predict test results using ML models + Monte Carlo simulation
     
+    The CPU-bound work runs in the prediction worker pool so the event loop
+    (and /health) stays responsive.
+    
     Args:
         request: PredictionRequest with formula and process parameters
     
@@ -76,114 +333,1222 @@ async def predict_test_results(request: PredictionRequest):
     """
     try:
         logger.info(f"Received prediction request for project: {request.project_id}")
+        start = time.perf_counter()
         
-        # 1. Get ML model for product
-        model = get_or_create_model(request.product_name)
+        response, timings = await predict_memoized(request)
+        body = serialize_timed(response.model_dump_json, timings)
         
-        # 2. Get base predictions from ML model
-        formula_dict = [ing.dict() for ing in request.formula]
-        process_dict = request.process_parameters.dict()
+        logger.info(f"Prediction completed. Overall risk: {response.overall_risk_score}%")
+        return Response(
+            body,
+            media_type="application/json",
+            headers={"Server-Timing": server_timing_header(timings, time.perf_counter() - start)}
+        )
+    
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting prediction request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error during prediction: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
+@app.post("/predict/batch", response_model=List[PredictionResponse])
+async def predict_batch(requests: List[PredictionRequest]):
+    """
+    Predict test results for many requests in one vectorized Monte Carlo pass
+    
+    Args:
+        requests: List of PredictionRequest (e.g. one per formula variant)
+    
+    Returns:
+        List of PredictionResponse, in the same order as the requests
+    """
+    if not requests:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one request")
+    if len(requests) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch size {len(requests)} exceeds limit of {MAX_BATCH_SIZE}"
+        )
+    
+    try:
+        logger.info(f"Received batch prediction request with {len(requests)} items")
+        start = time.perf_counter()
         
-        ml_predictions = model.predict(formula_dict, process_dict)
+        responses, timings, memoized = await predict_batch_memoized(requests)
+        body = serialize_timed(lambda: serialize_batch(responses), timings)
         
-        # 3. Initialize Monte Carlo simulator
-        mc_simulator = MonteCarloSimulator(
-            n_iterations=request.monte_carlo_iterations
+        logger.info(f"Batch prediction completed for {len(responses)} items ({memoized} memoized)")
+        return Response(
+            body,
+            media_type="application/json",
+            headers={"Server-Timing": server_timing_header(timings, time.perf_counter() - start)}
+        )
+    
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting batch prediction request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error during batch prediction: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Batch prediction failed: {str(e)}")
+
+
+@app.post("/sweep", response_model=SweepResponse)
+async def sweep_parameters(request: SweepRequest):
+    """
+    Evaluate a parameter sweep (grid, Latin hypercube or Sobol) around a base request
+    
+    All points go through the model as one feature matrix and share one set
+    of Monte Carlo draws, so each point's probability of fail matches what
+    /predict would return for it.
+    
+    Args:
+        request: SweepRequest with the base request and the swept ranges
+    
+    Returns:
+        SweepResponse with point coordinates and a fail-probability surface per test
+    """
+    if request.method == "grid":
+        n_points = grid_size([r.steps for r in request.ranges])
+    else:
+        n_points = request.n_points
+    if n_points > MAX_SWEEP_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Sweep size {n_points} exceeds limit of {MAX_SWEEP_POINTS} points"
+        )
+    
+    try:
+        logger.info(
+            f"Received sweep request for project: {request.base_request.project_id} "
+            f"({request.method}, {n_points} points)"
         )
         
-        # 4. Estimate variabilities
-        process_var = estimate_process_variability(request.factory)
-        formula_var = estimate_formula_variability(formula_dict)
+        response = await prediction_executor.run(run_sweep, request)
         
-        # 5. Get test specifications
-        test_specs = get_test_specifications(request.product_name)
+        logger.info(f"Sweep completed for {response.n_points} points")
+        return response
+    
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting sweep request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error during sweep: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Sweep failed: {str(e)}")
+
+
+@app.post("/optimize", response_model=OptimizationResponse)
+async def optimize_parameters(request: OptimizationRequest):
+    """
+    Search process parameters / ingredient percentages that minimize the overall risk
+    
+    Candidates are evaluated in vectorized generations on common random
+    numbers (the same draws /predict uses), with early stopping once the
+    best candidate stops improving.
+    
+    Args:
+        request: OptimizationRequest with the base request and parameter bounds
+    
+    Returns:
+        OptimizationResponse with the best settings and their full prediction
+    """
+    try:
+        logger.info(
+            f"Received optimization request for project: {request.base_request.project_id} "
+            f"({len(request.bounds)} parameters)"
+        )
+        
+        response = await prediction_executor.run(run_optimization, request)
         
-        # 6. Run simulations for each test
-        test_predictions = []
-        risk_scores = []
+        logger.info(
+            f"Optimization completed after {response.evaluations} evaluations. "
+            f"Overall risk: {response.baseline_risk_score}% -> {response.best_risk_score}%"
+        )
+        return response
+    
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting optimization request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error during optimization: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+
+
+@app.post("/whatif/sessions", response_model=WhatIfResponse, status_code=201)
+async def create_whatif_session(request: PredictionRequest):
+    """
+    Start a what-if session for a base request
+    
+    The noise draws of the request are made once, in the worker pool, and
+    kept with the session; PATCH /whatif/sessions/{session_id} then applies
+    changes to process parameters or ingredient percentages on those same
+    draws. The session state (without the draws) is shared with the other
+    workers, which rebuild the draws from the request and seed on first use.
+    
+    Args:
+        request: Base PredictionRequest
+    
+    Returns:
+        WhatIfResponse with the baseline results and the session id
+    """
+    try:
+        check_parameter_bounds(request, [])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    start = time.perf_counter()
+    timings = PipelineTimings()
+    session = await build_whatif_session_async(request, timings)
+    
+    session_id = uuid.uuid4().hex
+    if whatif_store is not None:
+        whatif_store.set(session_id, session.state_json())
+    whatif_sessions.set(session_id, session)
+    logger.info(f"Created what-if session {session_id} for project: {request.project_id}")
+    return whatif_json_response(session_id, session, timings, start, status_code=201)
+
+
+@app.patch("/whatif/sessions/{session_id}", response_model=WhatIfResponse)
+async def update_whatif_session(session_id: str, update: WhatIfUpdate):
+    """
+    Apply changes to a what-if session and return the updated fail probabilities
+    
+    Only the tests whose model features changed are re-predicted, and their
+    fails are recounted on the session's stored draws (binary search), so
+    this runs inline in microseconds instead of going through the pool.
+    Changes accumulate across calls.
+    """
+    start = time.perf_counter()
+    timings = PipelineTimings()
+    session = await load_whatif_session(session_id, timings)
+    try:
+        check_parameter_bounds(
+            session.request,
+            [ParameterBounds(parameter=parameter, min=value, max=value) for parameter, value in update.changes.items()]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    model = await whatif_model(session, timings)
+    apply_whatif_changes(session, model, update.changes, timings)
+    if whatif_store is not None:
+        # Compare-and-set: a change made meanwhile by another worker wins
+        revision = whatif_store.update(session_id, session.state_json(), session.revision)
+        if revision is None:
+            whatif_sessions.delete(session_id)
+            if whatif_store.get(session_id) is None:
+                raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+            raise HTTPException(status_code=409, detail="Session was changed concurrently, retry")
+        session.revision = revision
+    # Refresh the TTL: sessions expire after a period without changes
+    whatif_sessions.set(session_id, session)
+    return whatif_json_response(session_id, session, timings, start)
+
+
+@app.get("/whatif/sessions/{session_id}", response_model=WhatIfResponse)
+async def get_whatif_session_state(session_id: str):
+    """Current state of a what-if session"""
+    start = time.perf_counter()
+    timings = PipelineTimings()
+    session = await load_whatif_session(session_id, timings)
+    return whatif_json_response(session_id, session, timings, start)
+
+
+@app.delete("/whatif/sessions/{session_id}", status_code=204)
+async def delete_whatif_session(session_id: str):
+    """Discard a what-if session and its stored draws"""
+    removed = whatif_sessions.delete(session_id)
+    if whatif_store is not None:
+        # The shared state decides; other workers drop their copies on next use
+        removed = whatif_store.delete(session_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+    return Response(status_code=204)
+
+
+@app.get("/predict/explanations/{explanation_id}", response_model=ShapExplanation)
+async def get_explanation(explanation_id: str):
+    """
+    SHAP explanation of a prediction made with shap_mode='deferred'
+    
+    Computed in the worker pool on the first read and kept for later ones,
+    so callers that never ask for it never pay for it. The request (then the
+    explanation) is also kept in the shared SQLite state, so the read may
+    reach any worker.
+    """
+    entry = deferred_explanations.get(explanation_id)
+    if entry is None:
+        entry = load_deferred_explanation(explanation_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired explanation_id")
+    if isinstance(entry, ShapExplanation):
+        return entry
+    
+    try:
+        explanation = await prediction_executor.run(run_explanation, entry)
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting explanation request: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error during explanation: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Explanation failed: {str(e)}")
+    
+    deferred_explanations.set(explanation_id, explanation)
+    store_deferred_explanation(explanation_id, explanation)
+    return explanation
+
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def submit_job(request: Union[List[PredictionRequest], PredictionRequest]):
+    """
+    Queue a prediction (or a batch) and return its job id immediately
+    
+    The job runs in the background through the same pipeline as /predict and
+    /predict/batch; poll GET /jobs/{job_id} for its status and result.
+    
+    Args:
+        request: PredictionRequest or list of PredictionRequest
+    
+    Returns:
+        JobStatus of the queued job
+    """
+    if isinstance(request, list):
+        if not request:
+            raise HTTPException(status_code=400, detail="Batch must contain at least one request")
+        if len(request) > MAX_BATCH_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batch size {len(request)} exceeds limit of {MAX_BATCH_SIZE}"
+            )
+        kind = "batch"
+        payload = "[" + ",".join(item.model_dump_json() for item in request) + "]"
+    else:
+        kind = "predict"
+        payload = request.model_dump_json()
+    
+    try:
+        status = running_job_queue().submit(uuid.uuid4().hex, kind, payload)
+    except JobQueueFullError as e:
+        logger.warning(f"Rejecting job: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    
+    logger.info(f"Queued {kind} job {status['job_id']}")
+    return JobStatus(**status)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """
+    Status of a job and, once completed, its result
+    
+    The stored result is returned as is, without re-validating it.
+    """
+    job = running_job_queue().store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job_id")
+    return Response(job_status_json(*job), media_type="application/json")
+
+
+@app.post("/predict/stream")
+async def predict_stream(http_request: Request):
+    """
+    Stream predictions for many requests as NDJSON, one line per result
+    
+    The body is either a JSON array of PredictionRequest or NDJSON
+    (Content-Type: application/x-ndjson), which is parsed incrementally.
+    Results are emitted in input order as soon as each one finishes, with at
+    most `stream_window` predictions held in memory at a time. Invalid items
+    produce a line {"index": i, "error": "..."} instead of aborting the stream.
+    """
+    content_type = http_request.headers.get("content-type", "")
+    
+    if "ndjson" in content_type:
+        items = iter_ndjson_requests(http_request)
+    else:
+        try:
+            payload = await http_request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of prediction requests")
+        items = iter_json_requests(payload)
+    
+    logger.info("Received streaming prediction request")
+    return NDJSONStreamingResponse(stream_predictions(items))
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that leaves `receive` to the body iterator
+    
+    Starlette's StreamingResponse listens for client disconnects on `receive`
+    while streaming, which would swallow the NDJSON request body chunks that
+    iter_ndjson_requests is still reading. A disconnect still surfaces as
+    ClientDisconnect from http_request.stream() or as a failed send.
+    """
+    media_type = "application/x-ndjson"
+    
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_ndjson_requests(http_request: Request) -> AsyncIterator[Union[PredictionRequest, str]]:
+    """Parse NDJSON request lines as the body arrives (errors yielded as strings)"""
+    buffer = b""
+    async for chunk in http_request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_stream_item(line)
+    if buffer.strip():
+        yield parse_stream_item(buffer)
+
+
+async def iter_json_requests(payload: List) -> AsyncIterator[Union[PredictionRequest, str]]:
+    """Validate the items of a JSON array body one at a time"""
+    for item in payload:
+        try:
+            yield PredictionRequest.model_validate(item)
+        except ValidationError as e:
+            yield f"Invalid request: {str(e)}"
+
+
+def parse_stream_item(line: bytes) -> Union[PredictionRequest, str]:
+    """Validate one NDJSON line, returning the error message if invalid"""
+    try:
+        return PredictionRequest.model_validate_json(line)
+    except ValidationError as e:
+        return f"Invalid request: {str(e)}"
+
+
+async def stream_predictions(items: AsyncIterator[Union[PredictionRequest, str]]) -> AsyncIterator[bytes]:
+    """Run predictions with a bounded window of in-flight tasks, yielding NDJSON in order"""
+    window: Deque[Tuple[int, asyncio.Future]] = deque()
+    count = 0
+    
+    async def emit(index: int, task: asyncio.Future) -> bytes:
+        try:
+            response, timings = await task
+            return serialize_timed(response.model_dump_json, timings).encode("utf-8") + b"\n"
+        except Exception as e:
+            logger.error(f"Error in streamed prediction {index}: {str(e)}")
+            return json.dumps({"index": index, "error": str(e)}).encode("utf-8") + b"\n"
+    
+    async for item in items:
+        if isinstance(item, str):
+            task = asyncio.get_running_loop().create_future()
+            task.set_exception(ValueError(item))
+        else:
+            task = asyncio.ensure_future(predict_memoized(item, wait_for_worker=True))
+        window.append((count, task))
+        count += 1
         
-        for test_name, (base_pred, model_info) in ml_predictions.items():
-            # Get spec for this test
-            spec = test_specs.get(test_name, {})
-            spec_limit = spec.get('spec_limit')
-            limit_type = spec.get('limit_type', 'upper')
-            unit = spec.get('unit', 'unidade')
-            
-            # Run Monte Carlo simulation
-            simulated_results, stats = mc_simulator.simulate_test_results(
-                base_prediction=base_pred,
-                process_variability=process_var,
-                formula_variability=formula_var
+        if len(window) >= settings.stream_window:
+            yield await emit(*window.popleft())
+    
+    while window:
+        yield await emit(*window.popleft())
+    logger.info(f"Streaming prediction completed for {count} items")
+
+
+async def predict_memoized(
+    request: PredictionRequest,
+    wait_for_worker: bool = False
+) -> Tuple[PredictionResponse, PipelineTimings]:
+    """
+    Return the memoized result or run the prediction in the worker pool
+    
+    Args:
+        request: PredictionRequest to evaluate
+        wait_for_worker: Retry while the pool is saturated instead of raising
+            ExecutorSaturatedError (used by long-running streams)
+    
+    Returns:
+        Tuple of (response, stage timings of the cache lookup and the pipeline)
+    """
+    timings = PipelineTimings()
+    if result_cache is not None:
+        with timings.measure("cache"):
+            cached = result_cache.get(request, current_model_version(request.product_name))
+        if cached is not None:
+            logger.info(f"Returning memoized prediction for project: {request.project_id}")
+            pipeline_metrics.predictions_total.inc(source="memoized")
+            return defer_explanation(request, cached), timings
+    
+    while True:
+        try:
+            response, worker_timings = await prediction_executor.run(timed_call, run_prediction, request)
+            break
+        except ExecutorSaturatedError:
+            if not wait_for_worker:
+                raise
+            await asyncio.sleep(STREAM_RETRY_SECONDS)
+    timings.add(worker_timings)
+    pipeline_metrics.predictions_total.inc(source="computed")
+    
+    if result_cache is not None:
+        with timings.measure("cache"):
+            result_cache.set(request, response)
+    return defer_explanation(request, response), timings
+
+
+async def predict_batch_memoized(
+    requests: List[PredictionRequest],
+    wait_for_worker: bool = False
+) -> Tuple[List[PredictionResponse], PipelineTimings, int]:
+    """
+    Return memoized results and run the remaining requests as one batch in the worker pool
+    
+    Args:
+        requests: PredictionRequests to evaluate
+        wait_for_worker: Retry while the pool is saturated instead of raising
+            ExecutorSaturatedError (used by jobs)
+    
+    Returns:
+        Tuple of (responses in request order, stage timings, memoized count)
+    """
+    timings = PipelineTimings()
+    responses: List[Optional[PredictionResponse]] = [None] * len(requests)
+    if result_cache is not None:
+        with timings.measure("cache"):
+            responses = [
+                result_cache.get(request, current_model_version(request.product_name))
+                for request in requests
+            ]
+    
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if pending:
+        while True:
+            try:
+                computed, worker_timings = await prediction_executor.run(
+                    timed_call, run_batch_prediction, [requests[i] for i in pending]
+                )
+                break
+            except ExecutorSaturatedError:
+                if not wait_for_worker:
+                    raise
+                await asyncio.sleep(STREAM_RETRY_SECONDS)
+        timings.add(worker_timings)
+        with timings.measure("cache"):
+            for i, response in zip(pending, computed):
+                responses[i] = response
+                if result_cache is not None:
+                    result_cache.set(requests[i], response)
+    responses = [defer_explanation(request, response) for request, response in zip(requests, responses)]
+    pipeline_metrics.predictions_total.inc(len(requests) - len(pending), source="memoized")
+    pipeline_metrics.predictions_total.inc(len(pending), source="computed")
+    return responses, timings, len(requests) - len(pending)
+
+
+def serialize_batch(responses: List[PredictionResponse]) -> str:
+    """JSON array of responses, serialized one by one"""
+    return "[" + ",".join(response.model_dump_json() for response in responses) + "]"
+
+
+async def run_job(kind: str, payload: str) -> str:
+    """Execute a stored job through the worker pool and return its result as JSON"""
+    if kind == "batch":
+        requests = [PredictionRequest.model_validate(item) for item in json.loads(payload)]
+        responses, timings, _ = await predict_batch_memoized(requests, wait_for_worker=True)
+        return serialize_timed(lambda: serialize_batch(responses), timings)
+    
+    response, timings = await predict_memoized(
+        PredictionRequest.model_validate_json(payload), wait_for_worker=True
+    )
+    return serialize_timed(response.model_dump_json, timings)
+
+
+def defer_explanation(request: PredictionRequest, response: PredictionResponse) -> PredictionResponse:
+    """Register a shap_mode='deferred' request and set the response's explanation_id"""
+    if request.shap_mode == "deferred":
+        explanation_id = uuid.uuid4().hex
+        deferred_explanations.set(explanation_id, request)
+        store_deferred_explanation(explanation_id, request)
+        response.explanation_id = explanation_id
+    return response
+
+
+def store_deferred_explanation(explanation_id: str, entry: Union[PredictionRequest, ShapExplanation]):
+    """Persist a deferred request (or its computed explanation) for the other workers"""
+    if explanation_store is None:
+        return
+    kind = "request" if isinstance(entry, PredictionRequest) else "explanation"
+    try:
+        explanation_store.set(explanation_id, f'{{"{kind}": {entry.model_dump_json()}}}')
+    except sqlite3.Error as e:
+        logger.warning(f"Could not persist deferred explanation: {str(e)}")
+
+
+def load_deferred_explanation(explanation_id: str) -> Optional[Union[PredictionRequest, ShapExplanation]]:
+    """Entry stored by another worker (cached in this process once read), or None"""
+    if explanation_store is None:
+        return None
+    row = explanation_store.get(explanation_id)
+    if row is None:
+        return None
+    stored = json.loads(row[0])
+    if "explanation" in stored:
+        entry = ShapExplanation(**stored["explanation"])
+    else:
+        entry = PredictionRequest(**stored["request"])
+    deferred_explanations.set(explanation_id, entry)
+    return entry
+
+
+def serialize_timed(serialize, timings: PipelineTimings) -> str:
+    """Serialize a response, then record every stage of the request (serialization included)"""
+    with timings.measure("serialization"):
+        body = serialize()
+    pipeline_metrics.observe_pipeline(timings)
+    return body
+
+
+def run_prediction(request: PredictionRequest) -> PredictionResponse:
+    """Run the full prediction pipeline synchronously (executed in the worker pool)"""
+    # 1-2. Get ML model and base predictions
+    prepared = prepare_prediction(request)
+    
+    # 3. Initialize Monte Carlo simulator
+    mc_simulator = MonteCarloSimulator(
+        n_iterations=request.monte_carlo_iterations,
+        random_seed=request.random_seed,
+        sampling=request.sampling
+    )
+    
+    # Optional: correlated process parameters pushed through the model, giving
+    # one base prediction per iteration instead of a single scalar
+    iteration_predictions = {}
+    if request.correlated_process:
+        model = prepared['model']
+        with stage("monte_carlo"):
+            process_samples = mc_simulator.simulate_process_parameters(prepared['process_dict'], request.factory)
+            features = model.schema.encode_process_samples(
+                model.schema.encode(prepared['formula_dict'], prepared['process_dict']),
+                process_samples
             )
-            
-            # Calculate probability of fail
-            prob_fail = 0.0
-            if spec_limit:
-                prob_fail = mc_simulator.calculate_probability_of_fail(
-                    simulated_results=simulated_results,
-                    spec_limit=spec_limit,
+        with stage("ml_predict"):
+            iteration_predictions = dict(zip(model.schema.test_names, model.predict_encoded(features).T))
+    
+    # 6. Run simulations for each test
+    test_predictions = []
+    risk_scores = []
+    
+    for test_name, (base_pred, model_info) in prepared['ml_predictions'].items():
+        base_pred = iteration_predictions.get(test_name, base_pred)
+        # Get spec for this test
+        spec = prepared['test_specs'].get(test_name, {})
+        spec_limit = spec.get('spec_limit')
+        limit_type = spec.get('limit_type', 'upper')
+        
+        with stage("monte_carlo"):
+            if request.simulation_mode == "analytic":
+                # Closed-form distribution of the same noise model, no sampling
+                stats = mc_simulator.analytic_test_results(
+                    base_prediction=base_pred,
+                    process_variability=prepared['process_var'],
+                    formula_variability=prepared['formula_var'],
+                    spec_limit=spec_limit or None,
+                    limit_type=limit_type
+                )
+            elif request.precision == "float32":
+                # Fixed-size float32 chunks with streaming statistics (bounded memory)
+                stats = mc_simulator.streaming_test_results(
+                    base_prediction=base_pred,
+                    process_variability=prepared['process_var'],
+                    formula_variability=prepared['formula_var'],
+                    spec_limit=spec_limit or None,
+                    limit_type=limit_type
+                )
+                stats['iterations_used'] = request.monte_carlo_iterations
+            elif request.convergence_tolerance is not None:
+                # Sample in growing chunks until the estimates are within tolerance
+                _, stats = mc_simulator.simulate_adaptive(
+                    base_prediction=base_pred,
+                    process_variability=prepared['process_var'],
+                    formula_variability=prepared['formula_var'],
+                    tolerance=request.convergence_tolerance,
+                    spec_limit=spec_limit or None,
                     limit_type=limit_type
                 )
-            
-            # Get confidence interval
-            conf_interval = mc_simulator.get_confidence_interval(simulated_results)
-            
-            # Determine status
-            if prob_fail > 0.20:
-                status = "FAIL"
-            elif prob_fail > 0.10:
-                status = "WARNING"
             else:
-                status = "PASS"
-            
-            # Create test prediction
-            test_pred = TestPrediction(
-                test_name=test_name.replace('_', ' ').title(),
-                predicted_value=round(stats['mean'], 2),
-                unit=unit,
-                spec_limit=spec_limit,
-                status=status,
-                confidence_interval=[round(conf_interval[0], 2), round(conf_interval[1], 2)],
-                probability_of_fail=round(prob_fail, 3),
-                importance_score=sum(model_info['feature_importance'].values())
-            )
-            
-            test_predictions.append(test_pred)
-            risk_scores.append(prob_fail * 100)
+                # Run Monte Carlo simulation; statistics, confidence interval and
+                # probability of fail come from a single sort of the results
+                _, stats = mc_simulator.simulate_test_results(
+                    base_prediction=base_pred,
+                    process_variability=prepared['process_var'],
+                    formula_variability=prepared['formula_var'],
+                    spec_limit=spec_limit or None,
+                    limit_type=limit_type,
+                    importance_sampling=request.importance_sampling
+                )
+                stats['iterations_used'] = request.monte_carlo_iterations
+        record_iterations(stats.get('iterations_used', 0))
+        prob_fail = stats['probability_of_fail']
         
-        # 7. Calculate overall risk score
-        overall_risk = round(sum(risk_scores) / len(risk_scores), 1) if risk_scores else 0.0
+        test_predictions.append(build_test_prediction(
+            test_name,
+            model_info,
+            spec,
+            stats['mean'],
+            stats['confidence_interval'],
+            prob_fail,
+            iterations_used=stats.get('iterations_used'),
+            probability_ci=stats.get('probability_of_fail_ci')
+        ))
+        risk_scores.append(prob_fail * 100)
+    
+    # 7-10. Risk score, recommendations, SHAP and response
+    return build_prediction_response(request, prepared, test_predictions, risk_scores)
+
+
+def prepare_prediction(request: PredictionRequest) -> Dict:
+    """Run the model and variability stages that precede the Monte Carlo simulation"""
+    # 1. Get ML model for product
+    with stage("model_lookup"):
+        model = get_or_create_model(request.product_name)
+    
+    # 2. Get base predictions from ML model
+    formula_dict = [ing.dict() for ing in request.formula]
+    process_dict = request.process_parameters.dict()
+    
+    with stage("ml_predict"):
+        ml_predictions = model.predict(formula_dict, process_dict)
+    
+    with stage("variability"):
+        # 4. Estimate variabilities
+        process_var = estimate_process_variability(request.factory)
+        formula_var = estimate_formula_variability(formula_dict)
+        # 5. Get test specifications
+        test_specs = get_test_specifications(request.product_name)
+    
+    return {
+        'model': model,
+        'model_version': model.version,
+        'formula_dict': formula_dict,
+        'process_dict': process_dict,
+        'ml_predictions': ml_predictions,
+        'process_var': process_var,
+        'formula_var': formula_var,
+        'test_specs': test_specs
+    }
+
+
+def run_batch_prediction(requests: List[PredictionRequest]) -> List[PredictionResponse]:
+    """
+    Run a batch of predictions with one stacked simulation per iteration count
+    
+    Requests sharing the same number of iterations, random seed and sampling are
+    simulated together as a (requests × tests × iterations) tensor, reusing
+    the same noise draws that the single /predict endpoint would use for each
+    of them.
+    """
+    responses: List[Optional[PredictionResponse]] = [None] * len(requests)
+    prepared: Dict[int, Dict] = {}
+    
+    groups: Dict[Tuple[int, int, str], List[int]] = {}
+    for index, request in enumerate(requests):
+        if (
+            request.simulation_mode == "analytic"
+            or request.correlated_process
+            or request.convergence_tolerance is not None
+            or request.importance_sampling
+            or request.precision == "float32"
+        ):
+            # Closed form is already cheaper than any stacked sampling,
+            # correlated runs need per-iteration base predictions, adaptive
+            # runs stop each test at its own iteration count, importance
+            # sampling shifts each test's draws toward its own limit and
+            # float32 runs stream fixed-size chunks instead of a full tensor
+            responses[index] = run_prediction(request)
+            continue
+        prepared[index] = prepare_prediction(request)
+        key = (request.monte_carlo_iterations, request.random_seed, request.sampling)
+        groups.setdefault(key, []).append(index)
+    
+    # SHAP of every inline request in one explainer call per model
+    with stage("shap"):
+        explain_batch([prepared[i] for i in prepared if requests[i].shap_mode == "inline"])
+    
+    for (n_iterations, random_seed, sampling), indices in groups.items():
+        n_tests = max(len(prepared[i]['ml_predictions']) for i in indices)
+        base_predictions = np.zeros((len(indices), n_tests))
+        spec_limits = np.full((len(indices), n_tests), np.nan)
+        upper_limits = np.ones((len(indices), n_tests), dtype=bool)
         
-        # 8. Generate recommendations
-        recommendations = generate_recommendations(
-            test_predictions,
-            process_dict,
-            formula_dict,
-            overall_risk
-        )
+        for row, i in enumerate(indices):
+            specs = prepared[i]['test_specs']
+            for col, (test_name, (base_pred, _)) in enumerate(prepared[i]['ml_predictions'].items()):
+                spec = specs.get(test_name, {})
+                base_predictions[row, col] = base_pred
+                if spec.get('spec_limit'):
+                    spec_limits[row, col] = spec['spec_limit']
+                upper_limits[row, col] = spec.get('limit_type', 'upper') == 'upper'
         
-        # 9. Create SHAP explanation (simplified)
-        shap_explanation = create_shap_explanation(ml_predictions, process_dict, formula_dict)
+        mc_simulator = MonteCarloSimulator(n_iterations=n_iterations, random_seed=random_seed, sampling=sampling)
+        with stage("monte_carlo"):
+            batch_stats = mc_simulator.simulate_batch(
+                base_predictions=base_predictions,
+                process_variability=np.array([prepared[i]['process_var'].get('overall', 0.05) for i in indices]),
+                formula_variability=np.array([prepared[i]['formula_var'].get('overall', 0.03) for i in indices]),
+                spec_limits=spec_limits,
+                upper_limits=upper_limits
+            )
+        record_iterations(n_iterations * sum(len(prepared[i]['ml_predictions']) for i in indices))
         
-        # 10. Build response
-        response = PredictionResponse(
+        for row, i in enumerate(indices):
+            specs = prepared[i]['test_specs']
+            test_predictions = []
+            risk_scores = []
+            for col, (test_name, (_, model_info)) in enumerate(prepared[i]['ml_predictions'].items()):
+                prob_fail = float(batch_stats['probability_of_fail'][row, col])
+                conf_interval = [
+                    float(batch_stats['ci_lower'][row, col]),
+                    float(batch_stats['ci_upper'][row, col])
+                ]
+                test_predictions.append(build_test_prediction(
+                    test_name,
+                    model_info,
+                    specs.get(test_name, {}),
+                    float(batch_stats['mean'][row, col]),
+                    conf_interval,
+                    prob_fail,
+                    iterations_used=n_iterations
+                ))
+                risk_scores.append(prob_fail * 100)
+            responses[i] = build_prediction_response(requests[i], prepared[i], test_predictions, risk_scores)
+    
+    return responses
+
+
+def run_sweep(request: SweepRequest) -> SweepResponse:
+    """Run a parameter sweep synchronously: one model call and one simulation for all points"""
+    base_request = request.base_request
+    prepared = prepare_prediction(base_request)
+    model = prepared['model']
+    
+    points = sample_design(
+        lower=np.array([r.min for r in request.ranges]),
+        upper=np.array([r.max for r in request.ranges]),
+        method=request.method,
+        n_points=request.n_points,
+        steps=[r.steps for r in request.ranges],
+        random_seed=base_request.random_seed
+    )
+    
+    base_predictions = sweep_base_predictions(prepared, [r.parameter for r in request.ranges], points)
+    
+    test_names = model.schema.test_names
+    specs, spec_limits, upper_limits = spec_arrays(prepared)
+    
+    mc_simulator = MonteCarloSimulator(
+        n_iterations=base_request.monte_carlo_iterations,
+        random_seed=base_request.random_seed,
+        sampling=base_request.sampling
+    )
+    simulate = (
+        mc_simulator.analytic_sweep if base_request.simulation_mode == "analytic"
+        else mc_simulator.simulate_sweep
+    )
+    sweep_stats = simulate(
+        base_predictions=base_predictions,
+        process_variability=prepared['process_var'].get('overall', 0.05),
+        formula_variability=prepared['formula_var'].get('overall', 0.03),
+        spec_limits=spec_limits,
+        upper_limits=upper_limits
+    )
+    probability = sweep_stats['probability_of_fail']
+    
+    tests = [
+        TestSurface(
+            test_name=test_name.replace('_', ' ').title(),
+            unit=spec.get('unit', 'unidade'),
+            spec_limit=spec.get('spec_limit'),
+            predicted_value=[round(value, 2) for value in sweep_stats['mean'][:, t].tolist()],
+            probability_of_fail=[round_probability(value) for value in probability[:, t].tolist()]
+        )
+        for t, (test_name, spec) in enumerate(zip(test_names, specs))
+    ]
+    
+    uses_seed = base_request.simulation_mode == "monte_carlo" or request.method != "grid"
+    return SweepResponse(
+        project_id=base_request.project_id,
+        product_name=base_request.product_name,
+        method=request.method,
+        n_points=len(points),
+        points={r.parameter: points[:, d].tolist() for d, r in enumerate(request.ranges)},
+        overall_risk_score=[round(value, 1) for value in (probability.mean(axis=1) * 100).tolist()],
+        tests=tests,
+        model_version=prepared['model_version'],
+        prediction_timestamp=datetime.utcnow().isoformat() + "Z",
+        monte_carlo_iterations=base_request.monte_carlo_iterations,
+        simulation_mode=base_request.simulation_mode,
+        random_seed=base_request.random_seed if uses_seed else None
+    )
+
+
+def run_optimization(request: OptimizationRequest) -> OptimizationResponse:
+    """Search the bounded parameters for the lowest overall risk score (executed in the worker pool)"""
+    base_request = request.base_request
+    prepared = prepare_prediction(base_request)
+    parameters = [b.parameter for b in request.bounds]
+    specs, spec_limits, upper_limits = spec_arrays(prepared)
+    process_variability = prepared['process_var'].get('overall', 0.05)
+    formula_variability = prepared['formula_var'].get('overall', 0.03)
+    
+    mc_simulator = MonteCarloSimulator(
+        n_iterations=base_request.monte_carlo_iterations,
+        random_seed=base_request.random_seed,
+        sampling=base_request.sampling
+    )
+    if base_request.simulation_mode == "analytic":
+        def overall_risk(points: np.ndarray) -> np.ndarray:
+            stats = mc_simulator.analytic_sweep(
+                sweep_base_predictions(prepared, parameters, points),
+                process_variability,
+                formula_variability,
+                spec_limits,
+                upper_limits
+            )
+            return stats['probability_of_fail'].mean(axis=1) * 100
+    else:
+        # Common random numbers: every candidate is scored on the same sorted
+        # draws that /predict uses, so differences come from the parameters only
+        factors = mc_simulator.sorted_noise_factors(len(specs), process_variability, formula_variability)
+        def overall_risk(points: np.ndarray) -> np.ndarray:
+            probability = sweep_probability_of_fail(
+                factors,
+                sweep_base_predictions(prepared, parameters, points),
+                spec_limits,
+                upper_limits
+            )
+            return probability.mean(axis=1) * 100
+    
+    initial = parameter_values(base_request, parameters)
+    search = cross_entropy_search(
+        overall_risk,
+        lower=np.array([b.min for b in request.bounds]),
+        upper=np.array([b.max for b in request.bounds]),
+        initial=initial,
+        population_size=request.population_size,
+        max_evaluations=request.max_evaluations,
+        patience=request.patience,
+        random_seed=base_request.random_seed
+    )
+    
+    best_parameters = dict(zip(parameters, search['best'].tolist()))
+    # Same scale as the objective: rounding to 1 decimal would hide most of
+    # the gains (one fail in 2000 iterations is 0.0125 points); 6 decimals
+    # only drop the float noise of the mean
+    return OptimizationResponse(
+        best_parameters=best_parameters,
+        baseline_risk_score=round(float(overall_risk(initial[None, :])[0]), 6),
+        best_risk_score=round(search['best_value'], 6),
+        evaluations=search['evaluations'],
+        generations=search['generations'],
+        converged=search['converged'],
+        prediction=run_prediction(with_parameters(base_request, best_parameters))
+    )
+
+
+def build_whatif_session(request: PredictionRequest) -> WhatIfSession:
+    """Run the model once and draw the session's noise (executed in the worker pool)"""
+    prepared = prepare_prediction(request)
+    model = prepared['model']
+    specs, spec_limits, upper_limits = spec_arrays(prepared)
+    
+    with stage("monte_carlo"):
+        return WhatIfSession(
+            request=request,
+            model_version=prepared['model_version'],
+            test_names=list(model.schema.test_names),
+            specs=[dict(spec) for spec in specs],
+            features=model.schema.encode(prepared['formula_dict'], prepared['process_dict']),
+            base_predictions=np.array([prepared['ml_predictions'][name][0] for name in model.schema.test_names]),
+            simulator=MonteCarloSimulator(
+                n_iterations=request.monte_carlo_iterations,
+                random_seed=request.random_seed,
+                sampling=request.sampling
+            ),
+            process_variability=prepared['process_var'].get('overall', 0.05),
+            formula_variability=prepared['formula_var'].get('overall', 0.03),
+            spec_limits=spec_limits,
+            upper_limits=upper_limits
+        )
+
+
+async def build_whatif_session_async(request: PredictionRequest, timings: PipelineTimings) -> WhatIfSession:
+    """Build a session in the worker pool, mapping pool errors to HTTP errors"""
+    try:
+        session, worker_timings = await prediction_executor.run(timed_call, build_whatif_session, request)
+    except ExecutorSaturatedError as e:
+        logger.warning(f"Rejecting what-if session: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error creating what-if session: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"What-if session failed: {str(e)}")
+    timings.add(worker_timings)
+    return session
+
+
+async def load_whatif_session(session_id: str, timings: PipelineTimings) -> WhatIfSession:
+    """
+    Session by id, in sync with the shared state (404 if unknown or expired)
+    
+    A worker without the session rebuilds its draws from the stored request
+    and seed (in the pool) and replays the accumulated changes; a copy left
+    behind by changes made on another worker only replays the changes.
+    """
+    session = whatif_sessions.get(session_id)
+    if whatif_store is None:
+        if session is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+        return session
+    
+    row = whatif_store.get(session_id)
+    if row is None:
+        whatif_sessions.delete(session_id)
+        raise HTTPException(status_code=404, detail="Unknown or expired session_id")
+    value, revision = row
+    if session is not None and session.revision == revision:
+        return session
+    
+    state = json.loads(value)
+    if session is None:
+        session = await build_whatif_session_async(PredictionRequest(**state['request']), timings)
+        if session.model_version != state['model_version']:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Model version changed ({state['model_version']} -> {session.model_version}), start a new session"
+            )
+    if state['parameters']:
+        apply_whatif_changes(session, await whatif_model(session, timings), state['parameters'], timings)
+    session.recomputed[:] = False
+    session.recomputed[state['recomputed']] = True
+    session.revision = revision
+    whatif_sessions.set(session_id, session)
+    return session
+
+
+async def whatif_model(session: WhatIfSession, timings: PipelineTimings) -> TestPredictorModel:
+    """Model of the session's product, or 409 if the active version is no longer the session's"""
+    # Stat of the registry's CURRENT file: a new version is refused before loading it
+    version = current_model_version(session.request.product_name)
+    if version == session.model_version:
+        model = await get_model_async(session.request.product_name, timings)
+        version = model.version
+    if version != session.model_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Model version changed ({session.model_version} -> {version}), start a new session"
+        )
+    return model
+
+
+def apply_whatif_changes(
+    session: WhatIfSession,
+    model: TestPredictorModel,
+    changes: Dict[str, float],
+    timings: PipelineTimings
+):
+    """Re-encode the changed parameters and re-predict only the tests that use them"""
+    with timings.measure("ml_predict"):
+        features = model.schema.encode_process_samples(
+            session.features,
+            {sweep_feature(parameter): np.array([value]) for parameter, value in changes.items()}
+        )[0]
+        changed = np.flatnonzero(features != session.features)
+        # A test is affected only if it has weight on a changed feature
+        tests = np.flatnonzero(model.schema.weights[:, changed].any(axis=1))
+        base_predictions = model.predict_encoded(features[None, :], tests)[0] if len(tests) else np.empty(0)
+    
+    with timings.measure("monte_carlo"):
+        session.update(features, tests, base_predictions, changes)
+
+
+def whatif_json_response(
+    session_id: str,
+    session: WhatIfSession,
+    timings: PipelineTimings,
+    start: float,
+    status_code: int = 200
+) -> Response:
+    """Serialize the session state as WhatIfResponse JSON, with Server-Timing"""
+    def serialize() -> str:
+        request = session.request
+        return WhatIfResponse(
+            session_id=session_id,
             project_id=request.project_id,
             product_name=request.product_name,
-            overall_risk_score=overall_risk,
-            test_predictions=test_predictions,
-            recommendations=recommendations,
-            shap_explanation=shap_explanation,
-            model_version="1.0.0-xgboost",
-            prediction_timestamp=datetime.utcnow().isoformat() + "Z",
-            monte_carlo_iterations=request.monte_carlo_iterations
+            parameters=session.parameters,
+            overall_risk_score=round(float(session.probability.mean()) * 100, 1),
+            baseline_risk_score=round(float(session.baseline_probability.mean()) * 100, 1),
+            tests=[
+                WhatIfTest(
+                    test_name=test_name.replace('_', ' ').title(),
+                    unit=spec.get('unit', 'unidade'),
+                    spec_limit=spec.get('spec_limit'),
+                    predicted_value=round(float(mean), 2),
+                    probability_of_fail=round_probability(float(probability)),
+                    baseline_probability_of_fail=round_probability(float(baseline)),
+                    recomputed=bool(recomputed)
+                )
+                for test_name, spec, mean, probability, baseline, recomputed in zip(
+                    session.test_names, session.specs, session.mean, session.probability,
+                    session.baseline_probability, session.recomputed
+                )
+            ],
+            model_version=session.model_version,
+            monte_carlo_iterations=request.monte_carlo_iterations,
+            simulation_mode=request.simulation_mode,
+            random_seed=request.random_seed if request.simulation_mode == "monte_carlo" else None
+        ).model_dump_json()
+    
+    body = serialize_timed(serialize, timings)
+    return Response(
+        body,
+        status_code=status_code,
+        media_type="application/json",
+        headers={"Server-Timing": server_timing_header(timings, time.perf_counter() - start)}
+    )
+
+
+def sweep_feature(parameter: str) -> str:
+    """Model feature driven by a swept parameter (process field or ingredient percentage)"""
+    if parameter in ProcessParameters.model_fields:
+        return parameter
+    return ingredient_feature(parameter)
+
+
+def sweep_base_predictions(prepared: Dict, parameters: List[str], points: np.ndarray) -> np.ndarray:
+    """Model predictions (points × tests) with the points' values replacing the base request's"""
+    model = prepared['model']
+    features = model.schema.encode_process_samples(
+        model.schema.encode(prepared['formula_dict'], prepared['process_dict']),
+        {sweep_feature(parameter): points[:, d] for d, parameter in enumerate(parameters)}
+    )
+    return model.predict_encoded(features)
+
+
+def spec_arrays(prepared: Dict) -> Tuple[List[Dict], np.ndarray, np.ndarray]:
+    """Per-test specs, spec limits (NaN = none) and upper-limit flags in model test order"""
+    specs = [prepared['test_specs'].get(test_name, {}) for test_name in prepared['model'].schema.test_names]
+    spec_limits = np.array([spec.get('spec_limit') or np.nan for spec in specs], dtype=float)
+    upper_limits = np.array([spec.get('limit_type', 'upper') == 'upper' for spec in specs])
+    return specs, spec_limits, upper_limits
+
+
+def parameter_values(request: PredictionRequest, parameters: List[str]) -> np.ndarray:
+    """Current values of process fields / ingredient percentages (unset fields count as 0, like the model)"""
+    process_dict = request.process_parameters.dict()
+    values = []
+    for parameter in parameters:
+        if parameter in ProcessParameters.model_fields:
+            values.append(process_dict.get(parameter) or 0.0)
+        else:
+            # Repeated ingredient: the last one drives the model feature
+            values.append([ing.percentage for ing in request.formula if ing.name.lower() == parameter.lower()][-1])
+    return np.array(values, dtype=float)
+
+
+def with_parameters(request: PredictionRequest, values: Dict[str, float]) -> PredictionRequest:
+    """Copy of a request with the given process fields / ingredient percentages replaced"""
+    process_updates = {p: v for p, v in values.items() if p in ProcessParameters.model_fields}
+    ingredient_updates = {p.lower(): v for p, v in values.items() if p not in ProcessParameters.model_fields}
+    formula = [
+        ing.model_copy(update={'percentage': ingredient_updates[ing.name.lower()]})
+        if ing.name.lower() in ingredient_updates else ing
+        for ing in request.formula
+    ]
+    return request.model_copy(update={
+        'process_parameters': request.process_parameters.model_copy(update=process_updates),
+        'formula': formula
+    })
+
+
+def build_test_prediction(
+    test_name: str,
+    model_info: Dict,
+    spec: Dict,
+    predicted_value: float,
+    conf_interval: List[float],
+    prob_fail: float,
+    iterations_used: Optional[int] = None,
+    probability_ci: Optional[List[float]] = None
+) -> TestPrediction:
+    """Build the TestPrediction for one simulated test"""
+    # Determine status
+    if prob_fail > 0.20:
+        status = "FAIL"
+    elif prob_fail > 0.10:
+        status = "WARNING"
+    else:
+        status = "PASS"
+    
+    return TestPrediction(
+        test_name=test_name.replace('_', ' ').title(),
+        predicted_value=round(predicted_value, 2),
+        unit=spec.get('unit', 'unidade'),
+        spec_limit=spec.get('spec_limit'),
+        status=status,
+        confidence_interval=[round(conf_interval[0], 2), round(conf_interval[1], 2)],
+        probability_of_fail=round_probability(prob_fail),
+        probability_of_fail_ci=[round_probability(p) for p in probability_ci] if probability_ci else None,
+        importance_score=sum(model_info['feature_importance'].values()),
+        iterations_used=iterations_used
+    )
+
+
+def round_probability(probability: float) -> float:
+    """Round to 3 decimals, keeping 3 significant digits for rare-event probabilities below 0.001"""
+    if 0 < probability < 1e-3:
+        return float(f"{probability:.3g}")
+    return round(probability, 3)
+
+
+def build_prediction_response(
+    request: PredictionRequest,
+    prepared: Dict,
+    test_predictions: List[TestPrediction],
+    risk_scores: List[float]
+) -> PredictionResponse:
+    """Aggregate test predictions into the final PredictionResponse"""
+    # 7. Calculate overall risk score
+    overall_risk = round(sum(risk_scores) / len(risk_scores), 1) if risk_scores else 0.0
+    
+    # 8. Generate recommendations
+    with stage("recommendations"):
+        recommendations = generate_recommendations(
+            test_predictions,
+            prepared['process_dict'],
+            prepared['formula_dict'],
+            overall_risk
         )
-        
-        logger.info(f"Prediction completed. Overall risk: {overall_risk}%")
-        return response
-        
-    except Exception as e:
-        logger.error(f"Error during prediction: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    
+    # 9. SHAP explanation of the base predictions (batches come pre-explained)
+    shap_explanation = prepared.get('shap_explanation')
+    if shap_explanation is None and request.shap_mode == "inline":
+        with stage("shap"):
+            shap_explanation = explain_prediction(prepared)
+    
+    # 10. Build response
+    return PredictionResponse(
+        project_id=request.project_id,
+        product_name=request.product_name,
+        overall_risk_score=overall_risk,
+        test_predictions=test_predictions,
+        recommendations=recommendations,
+        shap_explanation=shap_explanation,
+        model_version=prepared['model_version'],
+        prediction_timestamp=datetime.utcnow().isoformat() + "Z",
+        monte_carlo_iterations=request.monte_carlo_iterations,
+        simulation_mode=request.simulation_mode,
+        random_seed=request.random_seed if request.simulation_mode == "monte_carlo" else None,
+        sampling=request.sampling if request.simulation_mode == "monte_carlo" else None
+    )
 
 
 def generate_recommendations(
@@ -225,41 +1590,32 @@ def generate_recommendations(
     return recommendations[:5]  # Limit to top 5
 
 
-def create_shap_explanation(
-    ml_predictions: Dict,
-    process_params: Dict,
-    formula: list
-) -> ShapExplanation:
-    """Create SHAP-like explanation (simplified)"""
-    
-    # Aggregate feature importance across all tests
-    all_importances = {}
-    for test_name, (pred, model_info) in ml_predictions.items():
-        for feature, importance in model_info['feature_importance'].items():
-            all_importances[feature] = all_importances.get(feature, 0) + importance
-    
-    # Normalize
-    total_importance = sum(all_importances.values())
-    if total_importance > 0:
-        all_importances = {k: v/total_importance for k, v in all_importances.items()}
-    
-    # Sort by importance
-    sorted_features = sorted(all_importances.items(), key=lambda x: x[1], reverse=True)
-    
-    # Top positive factors (increase risk)
-    top_positive = [f"{feat.replace('_', ' ').title()} (+{imp:.1%})" 
-                    for feat, imp in sorted_features[:3]]
-    
-    # Top negative factors (reduce risk)
-    top_negative = [f"{feat.replace('_', ' ').title()} (-{imp:.1%})" 
-                    for feat, imp in sorted_features[-3:]]
-    
-    return ShapExplanation(
-        feature_importance=dict(sorted_features[:10]),
-        top_positive_factors=top_positive,
-        top_negative_factors=top_negative,
-        base_value=50.0  # Base risk score
-    )
+def explain_prediction(prepared: Dict) -> ShapExplanation:
+    """SHAP explanation of one prepared request"""
+    model = prepared['model']
+    features = model.schema.encode(prepared['formula_dict'], prepared['process_dict'])
+    return explain_features(model, features[None, :], [prepared['test_specs']])[0]
+
+
+def explain_batch(prepared_requests: List[Dict]):
+    """Explain many prepared requests with one SHAP call per model (stored in 'shap_explanation')"""
+    by_model: Dict[int, List[Dict]] = {}
+    for prepared in prepared_requests:
+        by_model.setdefault(id(prepared['model']), []).append(prepared)
+    
+    for items in by_model.values():
+        model = items[0]['model']
+        features = np.array([
+            model.schema.encode(item['formula_dict'], item['process_dict']) for item in items
+        ]).reshape(len(items), len(model.schema.feature_names))
+        explanations = explain_features(model, features, [item['test_specs'] for item in items])
+        for item, explanation in zip(items, explanations):
+            item['shap_explanation'] = explanation
+
+
+def run_explanation(request: PredictionRequest) -> ShapExplanation:
+    """Recompute the base predictions of a request and explain them (executed in the worker pool)"""
+    return explain_prediction(prepare_prediction(request))
 
 
 if __name__ == "__main__":
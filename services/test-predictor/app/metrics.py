@@ -0,0 +1,335 @@
+"""
+Per-stage latency instrumentation and Prometheus text exposition
+
+Pipeline stages are timed with `stage(name)` wherever they run. The times
+are collected only inside `timed_call`, which returns them next to the
+result, so they survive both thread and process worker pools and are
+recorded in the histograms by the process that serves /metrics.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Etapas do pipeline de /predict, na ordem em que acontecem
+STAGES = (
+    "cache",
+    "model_lookup",
+    "ml_predict",
+    "variability",
+    "monte_carlo",
+    "statistics",
+    "recommendations",
+    "shap",
+    "serialization"
+)
+
+# Limites dos buckets de latência (segundos)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Samples = List[Tuple[Dict[str, str], float]]
+
+_local = threading.local()
+
+
+class PipelineTimings:
+    """Tempo exclusivo por etapa e iterações simuladas de uma execução do pipeline"""
+    
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.iterations = 0
+        self._stack: List[List] = []
+    
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """Time a stage that runs outside timed_call (e.g. on the event loop)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+    
+    def add(self, other: "PipelineTimings"):
+        """Accumulate the timings of another execution (e.g. the worker call)"""
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.iterations += other.iterations
+    
+    def __getstate__(self) -> Dict[str, Any]:
+        return {'stages': self.stages, 'iterations': self.iterations}
+    
+    def __setstate__(self, state: Dict[str, Any]):
+        self.stages = state['stages']
+        self.iterations = state['iterations']
+        self._stack = []
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Mede uma etapa do pipeline na execução corrente (no-op fora de timed_call)
+    
+    Etapas aninhadas contam só o próprio tempo: o tempo de uma etapa interna
+    é descontado da externa, de modo que a soma das etapas é o tempo total.
+    """
+    timings: Optional[PipelineTimings] = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+    
+    frame = [time.perf_counter(), 0.0]
+    timings._stack.append(frame)
+    try:
+        yield
+    finally:
+        timings._stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        timings.stages[name] = timings.stages.get(name, 0.0) + elapsed - frame[1]
+        if timings._stack:
+            timings._stack[-1][1] += elapsed
+
+
+def record_iterations(n_iterations: int):
+    """Count Monte Carlo iterations simulated by the current execution"""
+    timings: Optional[PipelineTimings] = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings.iterations += int(n_iterations)
+
+
+def timed_call(fn: Callable, *args: Any) -> Tuple[Any, PipelineTimings]:
+    """
+    Executa fn(*args) coletando os tempos das etapas
+    
+    Importável no módulo, pode ser enviada a um pool de processos junto com fn.
+    
+    Returns:
+        Tuple de (resultado de fn, PipelineTimings da execução)
+    """
+    timings = PipelineTimings()
+    previous = getattr(_local, 'timings', None)
+    _local.timings = timings
+    try:
+        return fn(*args), timings
+    finally:
+        _local.timings = previous
+
+
+def server_timing_header(timings: PipelineTimings, total_seconds: Optional[float] = None) -> str:
+    """Server-Timing header value (milliseconds) for the stages of one request"""
+    entries = [
+        f"{name};dur={seconds * 1000:.2f}"
+        for name, seconds in sorted(timings.stages.items(), key=lambda item: _stage_order(item[0]))
+    ]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def _stage_order(name: str) -> int:
+    return STAGES.index(name) if name in STAGES else len(STAGES)
+
+
+def format_metric(name: str, kind: str, help_text: str, samples: Samples) -> List[str]:
+    """
+    Formata uma métrica no formato texto do Prometheus
+    
+    Args:
+        name: Nome da métrica
+        kind: 'counter', 'gauge' ou 'histogram'
+        help_text: Descrição (linha # HELP)
+        samples: Lista de (labels, valor); labels podem incluir '__name__'
+            para sufixos como _bucket/_sum/_count
+    
+    Returns:
+        Linhas de texto (sem quebra de linha)
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        labels = dict(labels)
+        sample_name = labels.pop('__name__', name)
+        if labels:
+            rendered = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+            lines.append(f"{sample_name}{{{rendered}}} {_format_value(value)}")
+        else:
+            lines.append(f"{sample_name} {_format_value(value)}")
+    return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Contador monotônico com labels, thread-safe"""
+    
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def value(self, **labels: str) -> float:
+        """Current value of one label combination (0 if never incremented)"""
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0.0)
+    
+    def render(self) -> List[str]:
+        with self._lock:
+            samples = [(dict(key), value) for key, value in self._values.items()]
+        return format_metric(self.name, "counter", self.help_text, samples)
+
+
+class Histogram:
+    """Histograma cumulativo com labels e buckets fixos, thread-safe"""
+    
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [contagem por bucket..., soma, contagem]
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self) -> List[str]:
+        samples: Samples = []
+        with self._lock:
+            for key, series in self._series.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, series):
+                    samples.append(({'__name__': f"{self.name}_bucket", **labels, 'le': _format_value(bound)}, count))
+                samples.append(({'__name__': f"{self.name}_bucket", **labels, 'le': "+Inf"}, series[-1]))
+                samples.append(({'__name__': f"{self.name}_sum", **labels}, series[-2]))
+                samples.append(({'__name__': f"{self.name}_count", **labels}, series[-1]))
+        return format_metric(self.name, "histogram", self.help_text, samples)
+
+
+class PipelineMetrics:
+    """Métricas do serviço: etapas do pipeline, requisições HTTP e vazão do Monte Carlo"""
+    
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "predictor_stage_duration_seconds", "Time spent in each prediction pipeline stage"
+        )
+        self.request_seconds = Histogram(
+            "predictor_http_request_duration_seconds", "HTTP request latency by route and method"
+        )
+        self.requests_total = Counter("predictor_http_requests_total", "HTTP requests by route, method and status")
+        self.iterations_total = Counter(
+            "predictor_monte_carlo_iterations_total", "Monte Carlo iterations simulated"
+        )
+        self.predictions_total = Counter("predictor_predictions_total", "Predictions served, by source")
+        self.http_in_flight = 0
+        self.last_iterations_per_second = 0.0
+        self._lock = threading.Lock()
+    
+    def observe_pipeline(self, timings: PipelineTimings):
+        """Record the stage times and simulated iterations of one request"""
+        for name, seconds in timings.stages.items():
+            self.stage_seconds.observe(seconds, stage=name)
+        if timings.iterations:
+            self.iterations_total.inc(timings.iterations)
+            simulation_seconds = timings.stages.get("monte_carlo", 0.0) + timings.stages.get("statistics", 0.0)
+            if simulation_seconds > 0:
+                self.last_iterations_per_second = timings.iterations / simulation_seconds
+    
+    def observe_request(self, route: str, method: str, status: int, seconds: float):
+        """Record one finished HTTP request"""
+        self.request_seconds.observe(seconds, route=route, method=method)
+        self.requests_total.inc(route=route, method=method, status=str(status))
+    
+    def adjust_in_flight(self, delta: int):
+        with self._lock:
+            self.http_in_flight += delta
+    
+    def render(self, snapshots: Sequence[List[str]] = ()) -> str:
+        """
+        Texto completo de /metrics
+        
+        Args:
+            snapshots: Métricas já formatadas (format_metric) lidas no momento
+                da coleta, como caches e ocupação do pool
+        """
+        lines = []
+        lines += self.stage_seconds.render()
+        lines += self.request_seconds.render()
+        lines += self.requests_total.render()
+        lines += format_metric(
+            "predictor_http_requests_in_flight", "gauge", "HTTP requests being served",
+            [({}, self.http_in_flight)]
+        )
+        lines += self.predictions_total.render()
+        lines += self.iterations_total.render()
+        lines += format_metric(
+            "predictor_monte_carlo_iterations_per_second", "gauge",
+            "Simulation throughput of the most recent prediction (iterations per second)",
+            [({}, self.last_iterations_per_second)]
+        )
+        for snapshot in snapshots:
+            lines += snapshot
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mede latência e requisições em andamento
+    
+    Implementado direto sobre ASGI (sem BaseHTTPMiddleware) para não
+    interferir no `receive` de /predict/stream. A rota é o template do
+    endpoint (ex: /predict/batch); caminhos sem rota contam como 'unmatched'.
+    """
+    
+    def __init__(self, app, metrics: PipelineMetrics):
+        self.app = app
+        self.metrics = metrics
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        self.metrics.adjust_in_flight(1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.adjust_in_flight(-1)
+            route = scope.get("route")
+            self.metrics.observe_request(
+                getattr(route, "path", "unmatched"),
+                scope.get("method", ""),
+                status,
+                time.perf_counter() - start
+            )
@@ -1,51 +1,185 @@
 """
 ML Models for test prediction (XGBoost + Random Forest)
 Trained on historical Nestlé test data
+
+xgboost/scikit-learn are not imported here: they are only needed to
+unpickle real trained estimators, which imports them on demand.
 """
 import numpy as np
-from typing import Dict, List, Tuple
-from sklearn.ensemble import RandomForestRegressor
-import xgboost as xgb
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from . import shared_tables
+from .catalog import get_catalog
+
+if TYPE_CHECKING:
+    from .registry import ModelRegistry
+
+
+# Versão reportada quando não há modelos treinados no registro
+DEFAULT_MODEL_VERSION = "1.0.0-xgboost"
+
+# Famílias de produto com modelos dedicados (ordem de resolução), do catálogo
+PRODUCT_FAMILIES = get_catalog().product_families
+GENERIC_PRODUCT_FAMILY = get_catalog().generic_family
+
+
+def resolve_product_family(product_name: str) -> str:
+    """
+    Resolve o nome do produto para a família usada pelos modelos
+    
+    Busca no índice de aliases do catálogo, sem diferenciar maiúsculas,
+    acentos ou pontuação.
+    
+    Args:
+        product_name: Nome do produto (ex: 'Nescau Zero Açúcar')
+    
+    Returns:
+        Família ('Nescau', 'Ninho', 'Kit Kat') ou 'generic'
+    """
+    return get_catalog().resolve_family(product_name)
+
+
+# Parâmetros de processo usados como features (mesmo nome do ProcessParameters)
+PROCESS_FEATURES = ('temperature', 'mixing_time', 'line_speed', 'pressure', 'humidity', 'ph')
+
+def ingredient_feature(ingredient_name: str) -> str:
+    """Nome da feature do percentual de um ingrediente (ex: 'lecitina_percentage')"""
+    return f"{ingredient_name.lower()}_percentage"
+
+
+# Escala do ajuste: features normalizadas em [-1, 1] movem a predição em até 10%
+ADJUSTMENT_SCALE = 0.1
+
+
+class FeatureSchema:
+    """
+    Esquema de features compilado de uma família de produto
+    
+    Fixa um índice de features e guarda as importâncias como matriz
+    (testes × features), de modo que os ajustes de todos os testes saem de
+    um único produto matriz-vetor (ou matriz-matriz para lotes de fórmulas).
+    """
+    
+    def __init__(self, models: Dict[str, Dict], feature_names: Optional[List[str]] = None):
+        self.test_names = list(models.keys())
+        # Modelos treinados fixam a ordem das features no manifest do registro
+        self.feature_names = list(feature_names) if feature_names is not None else sorted({
+            feature for model in models.values() for feature in model['feature_importance']
+        })
+        self.feature_index = {name: j for j, name in enumerate(self.feature_names)}
+        self.means = np.array([model.get('mean', 0.0) for model in models.values()], dtype=float)
+        
+        self.weights = np.zeros((len(self.test_names), len(self.feature_names)))
+        for t, model in enumerate(models.values()):
+            for feature, importance in model['feature_importance'].items():
+                if feature in self.feature_index:
+                    self.weights[t, self.feature_index[feature]] = importance * ADJUSTMENT_SCALE
+    
+    def encode(self, formula: List[Dict], process_params: Dict) -> np.ndarray:
+        """
+        Codifica fórmula e processo em um vetor de features normalizadas
+        
+        Args:
+            formula: Lista de ingredientes com percentuais
+            process_params: Parâmetros de processo
+        
+        Returns:
+            Vetor (features,) com (valor - 50) / 50; features ausentes valem 0
+        """
+        # Normalizar feature (assumindo range 0-100)
+        values = [0.0] * len(self.feature_names)
+        
+        # Features de fórmula (ingrediente repetido: o último prevalece)
+        for ingredient in formula:
+            j = self.feature_index.get(ingredient_feature(ingredient.get('name', '')))
+            if j is not None:
+                values[j] = (ingredient.get('percentage', 0) - 50) / 50
+        
+        # Features de processo
+        for name in PROCESS_FEATURES:
+            j = self.feature_index.get(name)
+            if j is not None:
+                values[j] = ((process_params.get(name) or 0) - 50) / 50
+        
+        return np.array(values)
+    
+    def encode_process_samples(
+        self,
+        features: np.ndarray,
+        process_samples: Dict[str, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Replica features codificadas substituindo parâmetros de processo simulados
+        
+        Também usado nas varreduras, onde as chaves podem ser features de
+        ingrediente (ingredient_feature); a normalização é a mesma.
+        
+        Args:
+            features: Vetor (features,) de encode() com os valores nominais
+            process_samples: {feature: array (n,)} de valores simulados
+        
+        Returns:
+            Matriz (n, features), uma linha por iteração
+        """
+        n = len(next(iter(process_samples.values()))) if process_samples else 1
+        encoded = np.tile(features, (n, 1))
+        for name, values in process_samples.items():
+            j = self.feature_index.get(name)
+            if j is not None:
+                encoded[:, j] = (values - 50) / 50
+        return encoded
+    
+    def predict_encoded(self, features: np.ndarray) -> np.ndarray:
+        """
+        Prediz todos os testes a partir de features já codificadas
+        
+        Args:
+            features: Vetor (features,) ou matriz (n, features) de encode()
+        
+        Returns:
+            Predições (testes,) ou (n, testes)
+        """
+        return self.means * (1 + features @ self.weights.T)
 
 
 class TestPredictorModel:
     """Modelo ML para prever resultados de testes industriais"""
     
-    def __init__(self, product_name: str):
+    def __init__(
+        self,
+        product_name: str,
+        registry: Optional["ModelRegistry"] = None,
+        version: Optional[str] = None
+    ):
         self.product_name = product_name
+        self.version = version or DEFAULT_MODEL_VERSION
         self.models = {}
-        self._initialize_models()
+        # Linhas de referência do SHAP (None: centro da normalização / cobertura das árvores)
+        self.background: Optional[np.ndarray] = None
+        self.trained = registry is not None and version is not None
+        if self.trained:
+            # Estimadores treinados do registro (memory-mapped)
+            self.models, feature_names = registry.load_models(product_name, version)
+            self.schema = FeatureSchema(self.models, feature_names=feature_names)
+            self.background = registry.load_background(product_name, version)
+        else:
+            self._initialize_models()
     
     def _initialize_models(self):
         """Inicializa modelos pré-treinados para cada teste"""
-        # Modelos simulados (em produção, carregar modelos treinados com joblib)
+        # Modelos simulados a partir do catálogo (em produção, modelos treinados do registro)
+        family = get_catalog().family(self.product_name)
+        self.models = {
+            test_name: self._create_mock_model(test_name, test['mean'], test['std'])
+            for test_name, test in family.tests.items()
+        }
         
-        if "Nescau" in self.product_name:
-            self.models = {
-                'solubilidade': self._create_mock_model('solubilidade', 26.4, 3.2),
-                'viscosidade': self._create_mock_model('viscosidade', 45.0, 5.0),
-                'shelf_life': self._create_mock_model('shelf_life', 365, 30),
-                'perda_ferro': self._create_mock_model('perda_ferro', 8.5, 1.2)
-            }
-        elif "Ninho" in self.product_name:
-            self.models = {
-                'reconstituicao': self._create_mock_model('reconstituicao', 18.5, 2.5),
-                'viscosidade': self._create_mock_model('viscosidade', 120.0, 15.0),
-                'shelf_life': self._create_mock_model('shelf_life', 540, 45),
-                'scorched_particles': self._create_mock_model('scorched_particles', 2.1, 0.3)
-            }
-        elif "Kit Kat" in self.product_name:
-            self.models = {
-                'textura_wafer': self._create_mock_model('textura_wafer', 850.0, 80.0),
-                'derretimento': self._create_mock_model('derretimento', 32.5, 1.5),
-                'shelf_life': self._create_mock_model('shelf_life', 270, 25),
-                'bloom_gordura': self._create_mock_model('bloom_gordura', 5.2, 0.8)
-            }
-        else:
-            # Modelo genérico
-            self.models = {
-                'generic_test': self._create_mock_model('generic', 50.0, 5.0)
-            }
+        self.schema = FeatureSchema(self.models)
+        
+        # Launcher multiprocesso: pesos e médias vêm da memória compartilhada
+        tables = shared_tables.current()
+        if tables is not None:
+            tables.share_schema(family.name, self.schema)
     
     def _create_mock_model(self, test_name: str, mean: float, std: float):
         """Cria modelo mock para simulação (substituir por modelo real)"""
@@ -53,40 +187,8 @@ class TestPredictorModel:
             'type': 'xgboost',
             'mean': mean,
             'std': std,
-            'feature_importance': self._get_feature_importance(test_name)
-        }
-    
-    def _get_feature_importance(self, test_name: str) -> Dict[str, float]:
-        """Retorna importância de features para cada teste"""
-        # Importâncias baseadas em análise de dados reais
-        importance_maps = {
-            'solubilidade': {
-                'lecitina_percentage': 0.35,
-                'mixing_time': 0.25,
-                'temperature': 0.20,
-                'cacau_percentage': 0.15,
-                'line_speed': 0.05
-            },
-            'viscosidade': {
-                'temperature': 0.40,
-                'gordura_percentage': 0.30,
-                'emulsificante_percentage': 0.20,
-                'mixing_time': 0.10
-            },
-            'shelf_life': {
-                'umidade': 0.35,
-                'antioxidante_percentage': 0.25,
-                'temperature': 0.20,
-                'embalagem_type': 0.20
-            },
-            'default': {
-                'temperature': 0.30,
-                'mixing_time': 0.25,
-                'ingredient_quality': 0.25,
-                'line_speed': 0.20
-            }
+            'feature_importance': dict(get_catalog().importance(test_name))
         }
-        return importance_maps.get(test_name, importance_maps['default'])
     
     def predict(
         self,
@@ -103,157 +205,61 @@ class TestPredictorModel:
         Returns:
             Dict {test_name: (predicted_value, model_info)}
         """
-        predictions = {}
+        # Codificar fórmula e processo uma única vez para todos os testes
+        features = self.schema.encode(formula, process_params)
         
-        for test_name, model in self.models.items():
-            # Extrair features relevantes
-            features = self._extract_features(formula, process_params, test_name)
-            
-            # Predição (simulada - em produção usar modelo.predict())
-            base_pred = model['mean']
-            
-            # Ajustar predição baseado em features
-            adjustment = self._calculate_adjustment(features, model['feature_importance'])
-            predicted_value = base_pred * (1 + adjustment)
-            
-            predictions[test_name] = (predicted_value, model)
+        predicted_values = self.predict_encoded(features[None, :])[0]
         
-        return predictions
+        return {
+            test_name: (float(value), self.models[test_name])
+            for test_name, value in zip(self.schema.test_names, predicted_values)
+        }
     
-    def _extract_features(
+    def predict_batch(
         self,
-        formula: List[Dict],
-        process_params: Dict,
-        test_name: str
-    ) -> Dict[str, float]:
-        """Extrai features relevantes para o modelo"""
-        features = {}
-        
-        # Features de fórmula
-        for ingredient in formula:
-            ing_name = ingredient.get('name', '').lower()
-            features[f"{ing_name}_percentage"] = ingredient.get('percentage', 0)
+        formulas: List[List[Dict]],
+        process_params: List[Dict]
+    ) -> np.ndarray:
+        """
+        Prediz todos os testes para várias fórmulas/processos de uma vez
         
-        # Features de processo
-        features['temperature'] = process_params.get('temperature', 0)
-        features['mixing_time'] = process_params.get('mixing_time', 0)
-        features['line_speed'] = process_params.get('line_speed', 0)
-        features['pressure'] = process_params.get('pressure', 0)
-        features['humidity'] = process_params.get('humidity', 0)
-        features['ph'] = process_params.get('ph', 0)
+        Args:
+            formulas: Lista de fórmulas (cada uma, lista de ingredientes)
+            process_params: Lista de parâmetros de processo, alinhada às fórmulas
         
-        return features
+        Returns:
+            Matriz (n, testes) na ordem de schema.test_names
+        """
+        features = np.array([
+            self.schema.encode(formula, params)
+            for formula, params in zip(formulas, process_params)
+        ]).reshape(len(formulas), len(self.schema.feature_names))
+        return self.predict_encoded(features)
     
-    def _calculate_adjustment(
-        self,
-        features: Dict[str, float],
-        importance: Dict[str, float]
-    ) -> float:
-        """Calcula ajuste baseado em features e importância"""
-        adjustment = 0.0
+    def predict_encoded(self, features: np.ndarray, tests: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Prediz os testes a partir de features codificadas pelo schema
         
-        for feature_name, feature_value in features.items():
-            if feature_name in importance:
-                # Normalizar feature (assumindo range 0-100)
-                normalized_value = (feature_value - 50) / 50
-                
-                # Ajuste ponderado pela importância
-                adjustment += normalized_value * importance[feature_name] * 0.1
+        Args:
+            features: Matriz (n, features) de FeatureSchema.encode
+            tests: Índices (em schema.test_names) dos testes a prever; None = todos
         
-        return adjustment
-
+        Returns:
+            Matriz (n, testes) na ordem de schema.test_names (ou de tests)
+        """
+        if self.trained:
+            test_names = self.schema.test_names if tests is None else [self.schema.test_names[t] for t in tests]
+            return np.column_stack([
+                self.models[test_name]['estimator'].predict(features)
+                for test_name in test_names
+            ])
+        # Predição simulada (modelos mock)
+        if tests is None:
+            return self.schema.predict_encoded(features)
+        rows = np.asarray(tests, dtype=int)
+        return self.schema.means[rows] * (1 + features @ self.schema.weights[rows].T)
 
-def get_test_specifications(product_name: str) -> Dict[str, Dict]:
-    """Retorna especificações de testes para cada produto"""
-    
-    if "Nescau" in product_name:
-        return {
-            'solubilidade': {
-                'unit': 'segundos',
-                'spec_limit': 30.0,
-                'limit_type': 'upper',
-                'target': 25.0
-            },
-            'viscosidade': {
-                'unit': 'cP',
-                'spec_limit': 60.0,
-                'limit_type': 'upper',
-                'target': 45.0
-            },
-            'shelf_life': {
-                'unit': 'dias',
-                'spec_limit': 300.0,
-                'limit_type': 'lower',
-                'target': 365.0
-            },
-            'perda_ferro': {
-                'unit': '%',
-                'spec_limit': 12.0,
-                'limit_type': 'upper',
-                'target': 8.0
-            }
-        }
-    elif "Ninho" in product_name:
-        return {
-            'reconstituicao': {
-                'unit': 'segundos',
-                'spec_limit': 25.0,
-                'limit_type': 'upper',
-                'target': 18.0
-            },
-            'viscosidade': {
-                'unit': 'cP',
-                'spec_limit': 150.0,
-                'limit_type': 'upper',
-                'target': 120.0
-            },
-            'shelf_life': {
-                'unit': 'dias',
-                'spec_limit': 450.0,
-                'limit_type': 'lower',
-                'target': 540.0
-            },
-            'scorched_particles': {
-                'unit': 'mg/kg',
-                'spec_limit': 3.5,
-                'limit_type': 'upper',
-                'target': 2.0
-            }
-        }
-    elif "Kit Kat" in product_name:
-        return {
-            'textura_wafer': {
-                'unit': 'g força',
-                'spec_limit': 1000.0,
-                'limit_type': 'upper',
-                'target': 850.0
-            },
-            'derretimento': {
-                'unit': '°C',
-                'spec_limit': 35.0,
-                'limit_type': 'upper',
-                'target': 32.0
-            },
-            'shelf_life': {
-                'unit': 'dias',
-                'spec_limit': 240.0,
-                'limit_type': 'lower',
-                'target': 270.0
-            },
-            'bloom_gordura': {
-                'unit': 'score (0-10)',
-                'spec_limit': 7.0,
-                'limit_type': 'upper',
-                'target': 5.0
-            }
-        }
-    else:
-        return {
-            'generic_test': {
-                'unit': 'unidade',
-                'spec_limit': 100.0,
-                'limit_type': 'upper',
-                'target': 50.0
-            }
-        }
 
+def get_test_specifications(product_name: str) -> Mapping[str, Mapping]:
+    """Especificações dos testes da família do produto (mapeamentos do catálogo, somente leitura)"""
+    return get_catalog().family(product_name).specifications
@@ -1,50 +1,103 @@
 """
 Monte Carlo simulation for test predictions with realistic distributions
+
+scipy is imported inside the analytic routines and the quasi-random
+samplers only, keeping it out of the service cold start and the default
+sampling request path.
 """
 import numpy as np
-from typing import Dict, List, Tuple
-from scipy import stats
+from functools import lru_cache
+from statistics import NormalDist
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from .catalog import get_catalog
+from .design import unit_design
+from .metrics import stage
+
+
+# Semente padrão: predições determinísticas salvo quando o request informa outra
+DEFAULT_RANDOM_SEED = 42
+
+# Máximo de elementos do tensor de simulação em lote processados por vez
+BATCH_CHUNK_ELEMENTS = 4_000_000
+
+# Estratégias de amostragem do ruído padronizado
+SAMPLING_METHODS = ("random", "antithetic", "latin_hypercube", "sobol")
+
+# Uniformes mapeadas pelas CDFs inversas ficam em [ε, 1 - ε] (evita ±inf)
+UNIFORM_EPSILON = 1e-12
+
+# Modo float32: iterações por bloco (buffers pré-alocados de tamanho fixo)
+STREAM_CHUNK_ITERATIONS = 8192
+
+# Histograma das estatísticas por streaming: bins e alcance (desvios σ do
+# ruído de processo, somados à meia-largura do triangular) em torno da base;
+# sorteios fora do alcance caem nos bins extremos, com min/max exatos à parte
+HISTOGRAM_BINS = 32768
+HISTOGRAM_SIGMAS = 6.0
+
+# Primeiro bloco do modo adaptativo; os seguintes dobram o total amostrado
+ADAPTIVE_MIN_ITERATIONS = 1000
 
 
 class MonteCarloSimulator:
     """Simulador Monte Carlo para predições de testes industriais"""
     
-    def __init__(self, n_iterations: int = 10000, random_seed: int = 42):
+    def __init__(
+        self,
+        n_iterations: int = 10000,
+        random_seed: int = DEFAULT_RANDOM_SEED,
+        sampling: str = "random"
+    ):
+        if sampling not in SAMPLING_METHODS:
+            raise ValueError(f"Unknown sampling '{sampling}' (expected one of {', '.join(SAMPLING_METHODS)})")
         self.n_iterations = n_iterations
         self.random_seed = random_seed
-        np.random.seed(random_seed)
+        self.sampling = sampling
+        # Streams independentes por simulador (sem estado global do NumPy),
+        # seguros para uso concorrente em threads e processos
+        self.seed_sequence = np.random.SeedSequence(random_seed)
+        self.rng = np.random.Generator(np.random.PCG64(self.seed_sequence.spawn(1)[0]))
     
     def simulate_test_results(
         self,
-        base_prediction: float,
+        base_prediction: Union[float, np.ndarray],
         process_variability: Dict[str, float],
-        formula_variability: Dict[str, float]
+        formula_variability: Dict[str, float],
+        spec_limit: Optional[float] = None,
+        limit_type: str = 'upper',
+        confidence_level: float = 0.95,
+        importance_sampling: bool = False
     ) -> Tuple[np.ndarray, Dict[str, float]]:
         """
         Simula resultados de teste com variabilidade de processo e fórmula
         
+        Com importance_sampling, a probabilidade de falha é estimada por
+        amostragem por importância (importance_probability_of_fail) sobre os
+        mesmos sorteios, e o dicionário ganha 'probability_of_fail_ci'.
+        
         Args:
-            base_prediction: Valor base previsto pelo modelo ML
+            base_prediction: Valor base previsto pelo modelo ML, ou array
+                (n_iterations,) de valores base por iteração
             process_variability: Variabilidade dos parâmetros de processo (std dev)
             formula_variability: Variabilidade dos ingredientes (std dev)
+            spec_limit: Limite de especificação (None = sem cálculo de falha)
+            limit_type: 'upper' (máximo) ou 'lower' (mínimo)
+            confidence_level: Nível de confiança do intervalo (0-1), padrão 95%
+            importance_sampling: Estimar a probabilidade de falha por
+                amostragem por importância (eventos raros)
         
         Returns:
-            Tuple de (array de resultados simulados, estatísticas)
+            Tuple de (array de resultados simulados, estatísticas incluindo
+            intervalo de confiança e probabilidade de falha)
         """
+        standard_process, standard_formula = self._draw_standard_noise(1)
+        
         # Distribuição normal para variabilidade de processo
-        process_noise = np.random.normal(
-            loc=0,
-            scale=process_variability.get('overall', 0.05),
-            size=self.n_iterations
-        )
+        process_noise = process_variability.get('overall', 0.05) * standard_process[0]
         
         # Distribuição triangular para variabilidade de fórmula (mais realista)
-        formula_noise = np.random.triangular(
-            left=-formula_variability.get('overall', 0.03),
-            mode=0,
-            right=formula_variability.get('overall', 0.03),
-            size=self.n_iterations
-        )
+        formula_noise = formula_variability.get('overall', 0.03) * standard_formula[0]
         
         # Combinar ruídos (multiplicativo para refletir % de variação)
         total_noise = 1 + process_noise + formula_noise
@@ -52,18 +105,476 @@ class MonteCarloSimulator:
         # Aplicar ruído ao valor base
         simulated_results = base_prediction * total_noise
         
-        # Calcular estatísticas
+        with stage("statistics"):
+            # Calcular estatísticas (uma única ordenação)
+            stats_dict = summarize_results(
+                simulated_results,
+                spec_limit=spec_limit,
+                limit_type=limit_type,
+                confidence_level=confidence_level
+            )
+            
+            if importance_sampling and spec_limit is not None:
+                probability, probability_ci = importance_probability_of_fail(
+                    base_prediction,
+                    standard_process[0],
+                    standard_formula[0],
+                    process_variability.get('overall', 0.05),
+                    formula_variability.get('overall', 0.03),
+                    spec_limit,
+                    limit_type,
+                    confidence_level
+                )
+                stats_dict['probability_of_fail'] = probability
+                stats_dict['probability_of_fail_ci'] = probability_ci
+        
+        return simulated_results, stats_dict
+    
+    def simulate_adaptive(
+        self,
+        base_prediction: Union[float, np.ndarray],
+        process_variability: Dict[str, float],
+        formula_variability: Dict[str, float],
+        tolerance: float,
+        spec_limit: Optional[float] = None,
+        limit_type: str = 'upper',
+        confidence_level: float = 0.95
+    ) -> Tuple[np.ndarray, Dict[str, float]]:
+        """
+        Simula em blocos até convergir ou atingir n_iterations
+        
+        O primeiro bloco tem ADAPTIVE_MIN_ITERATIONS sorteios e cada bloco
+        seguinte dobra o total. A simulação para quando o erro padrão da
+        probabilidade de falha e o dos extremos do intervalo de confiança
+        (relativo à média) ficam abaixo de `tolerance`. Os blocos saem do
+        mesmo stream filho do teste em simulate_test_results, mas intercalam
+        normal e triangular, então a sequência difere do modo de contagem fixa.
+        
+        Args:
+            base_prediction: Valor base previsto pelo modelo ML, ou array
+                (n_iterations,) de valores base por iteração
+            process_variability: Variabilidade dos parâmetros de processo (std dev)
+            formula_variability: Variabilidade dos ingredientes (std dev)
+            tolerance: Erro padrão máximo da probabilidade (absoluto) e dos
+                extremos do IC (fração da média)
+            spec_limit: Limite de especificação (None = sem cálculo de falha)
+            limit_type: 'upper' (máximo) ou 'lower' (mínimo)
+            confidence_level: Nível de confiança do intervalo (0-1), padrão 95%
+        
+        Returns:
+            Tuple de (array de resultados simulados, estatísticas de
+            summarize_results mais 'iterations_used')
+        """
+        rng = np.random.Generator(np.random.PCG64(self.seed_sequence.spawn(1)[0]))
+        sigma = process_variability.get('overall', 0.05)
+        half_width = formula_variability.get('overall', 0.03)
+        base = np.broadcast_to(np.asarray(base_prediction, dtype=float), (self.n_iterations,))
+        
+        simulated_results = np.empty(self.n_iterations)
+        n = 0
+        while n < self.n_iterations:
+            size = min(max(n, ADAPTIVE_MIN_ITERATIONS), self.n_iterations - n)
+            total_noise = (
+                1
+                + sigma * rng.standard_normal(size)
+                + half_width * rng.triangular(left=-1, mode=0, right=1, size=size)
+            )
+            simulated_results[n:n + size] = base[n:n + size] * total_noise
+            n += size
+            if _has_converged(simulated_results[:n], tolerance, spec_limit, limit_type, confidence_level):
+                break
+        
+        simulated_results = simulated_results[:n]
+        with stage("statistics"):
+            stats_dict = summarize_results(
+                simulated_results,
+                spec_limit=spec_limit,
+                limit_type=limit_type,
+                confidence_level=confidence_level
+            )
+        stats_dict['iterations_used'] = n
+        
+        return simulated_results, stats_dict
+    
+    def streaming_test_results(
+        self,
+        base_prediction: float,
+        process_variability: Dict[str, float],
+        formula_variability: Dict[str, float],
+        spec_limit: Optional[float] = None,
+        limit_type: str = 'upper',
+        percentiles: Sequence[float] = (5, 95, 50),
+        confidence_level: float = 0.95,
+        chunk_size: int = STREAM_CHUNK_ITERATIONS
+    ) -> Dict[str, Any]:
+        """
+        Simula em float32 por blocos, com memória fixa qualquer que seja n_iterations
+        
+        Cada bloco é sorteado em buffers pré-alocados e composto no próprio
+        buffer (o triangular(-1, 0, 1) sai como U1 - U2). As estatísticas são
+        acumuladas por streaming: somas dos desvios em float64 para média e
+        desvio padrão, contagem exata de falhas, min/max exatos e um
+        histograma de HISTOGRAM_BINS bins para os quantis (erro de no máximo
+        um bin). Os sorteios diferem dos do modo float64.
+        
+        Args:
+            base_prediction: Valor base previsto pelo modelo ML
+            process_variability: Variabilidade dos parâmetros de processo (std dev)
+            formula_variability: Variabilidade dos ingredientes (std dev)
+            spec_limit: Limite de especificação (None = sem cálculo de falha)
+            limit_type: 'upper' (máximo) ou 'lower' (mínimo)
+            percentiles: Percentis adicionais (0-100); 50 é devolvido como 'median'
+            confidence_level: Nível de confiança do intervalo (0-1), padrão 95%
+            chunk_size: Iterações por bloco
+        
+        Returns:
+            Dicionário com as mesmas chaves de summarize_results
+        """
+        rng = np.random.Generator(np.random.PCG64(self.seed_sequence.spawn(1)[0]))
+        sigma = process_variability.get('overall', 0.05)
+        half_width = formula_variability.get('overall', 0.03)
+        b = float(base_prediction)
+        
+        reach = abs(b) * (HISTOGRAM_SIGMAS * sigma + half_width) or 1.0
+        lower_edge = b - reach
+        bin_width = 2 * reach / HISTOGRAM_BINS
+        counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        
+        buffers = np.empty((3, min(chunk_size, self.n_iterations)), dtype=np.float32)
+        total = failures = 0
+        sum_deviation = sum_squares = 0.0
+        minimum, maximum = np.inf, -np.inf
+        
+        while total < self.n_iterations:
+            size = min(buffers.shape[1], self.n_iterations - total)
+            values, formula_noise, scratch = buffers[:, :size]
+            
+            rng.standard_normal(dtype=np.float32, out=values)
+            rng.random(dtype=np.float32, out=formula_noise)
+            rng.random(dtype=np.float32, out=scratch)
+            np.subtract(formula_noise, scratch, out=formula_noise)
+            
+            # valores = b · (1 + σ z + a t), compostos no buffer
+            values *= sigma
+            formula_noise *= half_width
+            values += formula_noise
+            values += 1
+            values *= b
+            
+            deviation = np.subtract(values, b, out=formula_noise)
+            sum_deviation += float(deviation.sum(dtype=np.float64))
+            sum_squares += float(np.square(deviation, out=scratch).sum(dtype=np.float64))
+            minimum = min(minimum, float(values.min()))
+            maximum = max(maximum, float(values.max()))
+            if spec_limit is not None:
+                failed = values > spec_limit if limit_type == 'upper' else values < spec_limit
+                failures += int(np.count_nonzero(failed))
+            
+            bins = np.subtract(values, lower_edge, out=scratch)
+            bins /= bin_width
+            np.clip(bins, 0, HISTOGRAM_BINS - 1, out=bins)
+            counts += np.bincount(bins.astype(np.intp), minlength=HISTOGRAM_BINS)
+            total += size
+        
+        mean_deviation = sum_deviation / total
+        alpha = 1 - confidence_level
+        with stage("statistics"):
+            ci_lower, ci_upper, *values = _histogram_percentiles(
+                counts,
+                lower_edge,
+                bin_width,
+                [(alpha / 2) * 100, (1 - alpha / 2) * 100] + list(percentiles),
+                minimum,
+                maximum
+            )
+        
         stats_dict = {
-            'mean': float(np.mean(simulated_results)),
-            'std': float(np.std(simulated_results)),
-            'min': float(np.min(simulated_results)),
-            'max': float(np.max(simulated_results)),
-            'p5': float(np.percentile(simulated_results, 5)),
-            'p95': float(np.percentile(simulated_results, 95)),
-            'median': float(np.median(simulated_results))
+            'mean': b + mean_deviation,
+            'std': float(np.sqrt(max(sum_squares / total - mean_deviation ** 2, 0.0))),
+            'min': minimum,
+            'max': maximum
         }
+        for q, value in zip(percentiles, values):
+            stats_dict['median' if q == 50 else f"p{q:g}"] = value
+        stats_dict['confidence_interval'] = [ci_lower, ci_upper]
+        stats_dict['probability_of_fail'] = failures / total if spec_limit is not None else 0.0
         
-        return simulated_results, stats_dict
+        return stats_dict
+    
+    def analytic_test_results(
+        self,
+        base_prediction: float,
+        process_variability: Dict[str, float],
+        formula_variability: Dict[str, float],
+        spec_limit: Optional[float] = None,
+        limit_type: str = 'upper',
+        percentiles: Sequence[float] = (5, 95, 50),
+        confidence_level: float = 0.95
+    ) -> Dict[str, Any]:
+        """
+        Calcula as estatísticas de simulate_test_results de forma exata
+        
+        O ruído total é N(0, σ) + Triangular(-a, 0, a), cuja CDF tem forma
+        fechada (convolução da normal com a densidade triangular). Nenhuma
+        amostra é sorteada; a probabilidade de falha não tem ruído amostral.
+        
+        Args:
+            base_prediction: Valor base previsto pelo modelo ML
+            process_variability: Variabilidade dos parâmetros de processo (std dev)
+            formula_variability: Variabilidade dos ingredientes (std dev)
+            spec_limit: Limite de especificação (None = sem cálculo de falha)
+            limit_type: 'upper' (máximo) ou 'lower' (mínimo)
+            percentiles: Percentis adicionais (0-100); 50 é devolvido como 'median'
+            confidence_level: Nível de confiança do intervalo (0-1), padrão 95%
+        
+        Returns:
+            Dicionário com as mesmas chaves de summarize_results; min/max são os
+            quantis esperados do menor/maior de n_iterations sorteios
+        """
+        sigma = process_variability.get('overall', 0.05)
+        half_width = formula_variability.get('overall', 0.03)
+        b = base_prediction
+        
+        def value_quantiles(probabilities):
+            # X = b (1 + Z); para b < 0 os quantis de Z se invertem (Z é simétrico)
+            noise_quantiles = _noise_ppf(np.asarray(probabilities, dtype=float), sigma, half_width)
+            return b * (1 + (noise_quantiles if b >= 0 else -noise_quantiles))
+        
+        alpha = 1 - confidence_level
+        extreme = 1 / (self.n_iterations + 1)
+        ci_lower, ci_upper, minimum, maximum, *values = value_quantiles(
+            [alpha / 2, 1 - alpha / 2, extreme, 1 - extreme] + [q / 100 for q in percentiles]
+        )
+        
+        stats_dict = {
+            'mean': float(b),
+            'std': float(abs(b) * np.sqrt(sigma ** 2 + half_width ** 2 / 6)),
+            'min': float(minimum),
+            'max': float(maximum)
+        }
+        for q, value in zip(percentiles, values):
+            stats_dict['median' if q == 50 else f"p{q:g}"] = float(value)
+        stats_dict['confidence_interval'] = [float(ci_lower), float(ci_upper)]
+        
+        probability = 0.0
+        if spec_limit is not None:
+            if b == 0:
+                probability = float(_zero_value_fails(spec_limit, limit_type == 'upper'))
+            else:
+                threshold = spec_limit / b - 1
+                # Falha acima do limite corresponde a Z > threshold se b > 0
+                upper_tail = (limit_type == 'upper') == (b > 0)
+                # P(Z > t) = F(-t) por simetria, sem cancelamento na cauda
+                probability = float(_noise_cdf(-threshold if upper_tail else threshold, sigma, half_width))
+        stats_dict['probability_of_fail'] = probability
+        
+        return stats_dict
+    
+    def simulate_batch(
+        self,
+        base_predictions: np.ndarray,
+        process_variability: np.ndarray,
+        formula_variability: np.ndarray,
+        spec_limits: np.ndarray,
+        upper_limits: np.ndarray,
+        confidence_level: float = 0.95
+    ) -> Dict[str, np.ndarray]:
+        """
+        Simula em lote vários requests e testes em um único passe vetorizado
+        
+        Os ruídos padronizados são sorteados uma única vez (mesma sequência
+        de simulate_test_results) e reescalados pela variabilidade de cada
+        request, formando um tensor (requests × testes × iterações).
+        
+        Args:
+            base_predictions: Matriz (requests × testes) de valores base do modelo ML
+            process_variability: Vetor (requests,) com variabilidade 'overall' de processo
+            formula_variability: Vetor (requests,) com variabilidade 'overall' de fórmula
+            spec_limits: Matriz (requests × testes) de limites (NaN = sem limite)
+            upper_limits: Matriz booleana (requests × testes), True para limite superior
+            confidence_level: Nível de confiança do intervalo (0-1), padrão 95%
+        
+        Returns:
+            Dicionário de matrizes (requests × testes) com estatísticas,
+            probabilidade de falha e intervalo de confiança
+        """
+        n_requests, n_tests = base_predictions.shape
+        process_noise, formula_noise = self._draw_standard_noise(n_tests)
+        
+        keys = ['mean', 'std', 'min', 'max', 'p5', 'p95', 'median',
+                'ci_lower', 'ci_upper', 'probability_of_fail']
+        results = {key: np.empty((n_requests, n_tests)) for key in keys}
+        
+        # Processar em blocos de requests para limitar o tamanho do tensor
+        chunk = max(1, BATCH_CHUNK_ELEMENTS // max(1, n_tests * self.n_iterations))
+        for start in range(0, n_requests, chunk):
+            rows = slice(start, start + chunk)
+            total_noise = (
+                1
+                + process_variability[rows, None, None] * process_noise[None]
+                + formula_variability[rows, None, None] * formula_noise[None]
+            )
+            simulated = base_predictions[rows, :, None] * total_noise
+            
+            with stage("statistics"):
+                chunk_stats = summarize_results(
+                    simulated,
+                    spec_limit=spec_limits[rows],
+                    limit_type=np.where(upper_limits[rows], 'upper', 'lower'),
+                    confidence_level=confidence_level,
+                    overwrite_input=True
+                )
+            for key in keys:
+                if key.startswith('ci_'):
+                    continue
+                results[key][rows] = chunk_stats[key]
+            results['ci_lower'][rows], results['ci_upper'][rows] = chunk_stats['confidence_interval']
+        
+        return results
+    
+    def simulate_sweep(
+        self,
+        base_predictions: np.ndarray,
+        process_variability: float,
+        formula_variability: float,
+        spec_limits: np.ndarray,
+        upper_limits: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """
+        Simula os pontos de uma varredura reutilizando os mesmos sorteios
+        
+        Entre pontos de uma varredura só o valor base muda: o fator de ruído
+        (1 + ruído de processo + ruído de fórmula) de cada teste é sorteado e
+        ordenado uma única vez, e a falha em cada ponto é contada por busca
+        binária do limite reescalado (limite / base) nesse fator, sem montar
+        o tensor pontos × iterações. Os sorteios são os de
+        simulate_test_results, então cada ponto equivale a um /predict.
+        
+        Args:
+            base_predictions: Matriz (pontos × testes) de valores base do modelo ML
+            process_variability: Variabilidade 'overall' de processo
+            formula_variability: Variabilidade 'overall' de fórmula
+            spec_limits: Vetor (testes,) de limites (NaN = sem limite)
+            upper_limits: Vetor booleano (testes,), True para limite superior
+        
+        Returns:
+            Dicionário de matrizes (pontos × testes) com 'mean' e 'probability_of_fail'
+        """
+        factors = self.sorted_noise_factors(base_predictions.shape[1], process_variability, formula_variability)
+        return {
+            'mean': base_predictions * factors.mean(axis=1),
+            'probability_of_fail': sweep_probability_of_fail(factors, base_predictions, spec_limits, upper_limits)
+        }
+    
+    def sorted_noise_factors(
+        self,
+        n_tests: int,
+        process_variability: float,
+        formula_variability: float
+    ) -> np.ndarray:
+        """
+        Sorteia e ordena o fator de ruído multiplicativo de cada teste
+        
+        Args:
+            n_tests: Número de testes
+            process_variability: Variabilidade 'overall' de processo
+            formula_variability: Variabilidade 'overall' de fórmula
+        
+        Returns:
+            Matriz (n_tests × n_iterations) de 1 + ruído total, ordenada por linha
+        """
+        process_noise, formula_noise = self._draw_standard_noise(n_tests)
+        factors = 1 + process_variability * process_noise + formula_variability * formula_noise
+        factors.sort(axis=1)
+        return factors
+    
+    def analytic_sweep(
+        self,
+        base_predictions: np.ndarray,
+        process_variability: float,
+        formula_variability: float,
+        spec_limits: np.ndarray,
+        upper_limits: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """
+        Versão exata de simulate_sweep pela CDF fechada do ruído (sem sorteios)
+        
+        Args:
+            base_predictions: Matriz (pontos × testes) de valores base do modelo ML
+            process_variability: Variabilidade 'overall' de processo
+            formula_variability: Variabilidade 'overall' de fórmula
+            spec_limits: Vetor (testes,) de limites (NaN = sem limite)
+            upper_limits: Vetor booleano (testes,), True para limite superior
+        
+        Returns:
+            Dicionário de matrizes (pontos × testes) com 'mean' e 'probability_of_fail'
+        """
+        n_points, n_tests = base_predictions.shape
+        
+        probability = np.zeros((n_points, n_tests))
+        for t in range(n_tests):
+            if np.isnan(spec_limits[t]):
+                continue
+            base = base_predictions[:, t]
+            threshold = spec_limits[t] / np.where(base == 0, 1.0, base) - 1
+            # P(Z > t) = F(-t) por simetria, como em analytic_test_results
+            upper_tail = upper_limits[t] == (base > 0)
+            tail = _noise_cdf(np.where(upper_tail, -threshold, threshold), process_variability, formula_variability)
+            probability[:, t] = np.where(
+                base == 0, float(_zero_value_fails(spec_limits[t], upper_limits[t])), tail
+            )
+        
+        return {
+            'mean': base_predictions.copy(),
+            'probability_of_fail': probability
+        }
+    
+    def _draw_standard_noise(self, n_tests: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sorteia ruídos padronizados (normal N(0, 1) e triangular(-1, 0, 1))
+        
+        Ambas as distribuições escalam linearmente com o desvio, então
+        multiplicar pela variabilidade reproduz normal/triangular. Cada teste
+        usa um stream filho do SeedSequence: o i-ésimo teste recebe os mesmos
+        sorteios na simulação teste a teste e na simulação em lote.
+        
+        Com sampling diferente de 'random' os sorteios reduzem variância:
+        'antithetic' espelha metade das amostras (z, -z), e 'latin_hypercube'
+        e 'sobol' estratificam pares de uniformes mapeados pelas CDFs inversas
+        da normal e da triangular.
+        
+        Args:
+            n_tests: Número de testes (linhas) a sortear
+        
+        Returns:
+            Tuple de matrizes (n_tests × n_iterations) de ruído de processo e de fórmula
+        """
+        process_noise = np.empty((n_tests, self.n_iterations))
+        formula_noise = np.empty((n_tests, self.n_iterations))
+        
+        for i, child in enumerate(self.seed_sequence.spawn(n_tests)):
+            rng = np.random.Generator(np.random.PCG64(child))
+            if self.sampling == "random":
+                process_noise[i] = rng.standard_normal(self.n_iterations)
+                formula_noise[i] = rng.triangular(left=-1, mode=0, right=1, size=self.n_iterations)
+            elif self.sampling == "antithetic":
+                # Normal e triangular(-1, 0, 1) são simétricas: -z tem a mesma distribuição
+                half = (self.n_iterations + 1) // 2
+                normal = rng.standard_normal(half)
+                triangular = rng.triangular(left=-1, mode=0, right=1, size=half)
+                process_noise[i] = np.concatenate([normal, -normal])[:self.n_iterations]
+                formula_noise[i] = np.concatenate([triangular, -triangular])[:self.n_iterations]
+            elif self.sampling == "latin_hypercube":
+                # Um sorteio por estrato de largura 1/n em cada dimensão, estratos embaralhados
+                n = self.n_iterations
+                strata = np.stack([rng.permutation(n), rng.permutation(n)], axis=1)
+                uniforms = (strata + rng.random((n, 2))) / n
+                process_noise[i], formula_noise[i] = _standard_noise_from_uniforms(uniforms)
+            else:
+                uniforms = unit_design(2, "sobol", self.n_iterations, rng)
+                process_noise[i], formula_noise[i] = _standard_noise_from_uniforms(uniforms)
+        
+        return process_noise, formula_noise
     
     def calculate_probability_of_fail(
         self,
@@ -136,67 +647,434 @@ class MonteCarloSimulator:
         param_values = list(parameters.values())
         
         # Gerar amostras correlacionadas usando distribuição multivariada normal
-        mean_vector = np.zeros(n_params)
-        cov_matrix = correlation_matrix * 0.05  # 5% de variabilidade padrão
-        
-        # Gerar amostras
-        samples = np.random.multivariate_normal(
-            mean=mean_vector,
-            cov=cov_matrix,
-            size=self.n_iterations
-        )
+        cov_matrix = np.asarray(correlation_matrix, dtype=float) * 0.05  # 5% de variabilidade padrão
+        
+        # Fator de Cholesky em cache: o custo por chamada é um produto de matrizes
+        factor = _cholesky_factor(cov_matrix.tobytes(), n_params)
+        samples = self.rng.standard_normal((self.n_iterations, n_params)) @ factor.T
         
         # Aplicar aos valores base
         simulated_params = np.array(param_values) * (1 + samples)
         
         return simulated_params
+    
+    def simulate_process_parameters(
+        self,
+        process_params: Dict[str, Optional[float]],
+        factory: str
+    ) -> Dict[str, np.ndarray]:
+        """
+        Simula a variação conjunta dos parâmetros de processo de uma fábrica
+        
+        Usa a matriz de correlação e os desvios relativos da fábrica, com o
+        fator de Cholesky da covariância calculado uma vez por fábrica.
+        
+        Args:
+            process_params: Parâmetros de processo nominais
+            factory: Nome da fábrica
+        
+        Returns:
+            Dicionário {parâmetro: array (n_iterations,)} com valores simulados
+            (apenas parâmetros correlacionados informados no request)
+        """
+        param_names, factor = get_process_cholesky(factory)
+        samples = self.rng.standard_normal((self.n_iterations, len(param_names))) @ factor.T
+        
+        return {
+            name: process_params[name] * (1 + samples[:, j])
+            for j, name in enumerate(param_names)
+            if process_params.get(name) is not None
+        }
 
 
-def estimate_process_variability(factory: str) -> Dict[str, float]:
+def summarize_results(
+    simulated_results: np.ndarray,
+    spec_limit: Optional[Union[float, np.ndarray]] = None,
+    limit_type: Union[str, np.ndarray] = 'upper',
+    percentiles: Sequence[float] = (5, 95, 50),
+    confidence_level: float = 0.95,
+    overwrite_input: bool = False
+) -> Dict[str, Any]:
     """
-    Estima variabilidade de processo baseado na fábrica
+    Calcula todas as estatísticas da simulação com uma única ordenação
+    
+    Substitui as chamadas separadas de np.percentile, get_confidence_interval
+    e calculate_probability_of_fail: ordena uma vez, lê min/max/quantis por
+    índice (interpolação linear, como np.percentile) e conta as falhas por
+    busca binária no array ordenado.
     
     Args:
-        factory: Nome da fábrica
+        simulated_results: Resultados simulados; as estatísticas são calculadas
+            no último eixo (array 1D ou tensor de lote)
+        spec_limit: Limite de especificação (escalar ou array com as dimensões
+            iniciais; None/NaN = probabilidade de falha 0)
+        limit_type: 'upper' ou 'lower' (escalar ou array como spec_limit)
+        percentiles: Percentis adicionais (0-100); 50 é devolvido como 'median'
+        confidence_level: Nível de confiança do intervalo (0-1), padrão 95%
+        overwrite_input: Se True, ordena simulated_results no próprio array
     
     Returns:
-        Dicionário com variabilidades estimadas
+        Dicionário com mean, std, min, max, percentis, confidence_interval
+        [inferior, superior] e probability_of_fail (floats para entrada 1D)
     """
-    # Valores baseados em dados históricos reais de fábricas Nestlé
-    variability_by_factory = {
-        'Araraquara - SP': {
-            'overall': 0.04,  # 4% de variabilidade geral (fábrica moderna)
-            'temperature': 0.02,
-            'mixing_time': 0.05,
-            'line_speed': 0.03
-        },
-        'Montes Claros - MG': {
-            'overall': 0.05,  # 5% de variabilidade geral
-            'temperature': 0.03,
-            'mixing_time': 0.06,
-            'line_speed': 0.04
-        },
-        'São José dos Campos - SP': {
-            'overall': 0.045,
-            'temperature': 0.025,
-            'mixing_time': 0.055,
-            'line_speed': 0.035
-        },
-        'Caçapava - SP': {
-            'overall': 0.05,
-            'temperature': 0.03,
-            'mixing_time': 0.06,
-            'line_speed': 0.04
-        },
-        'default': {
-            'overall': 0.06,  # 6% para fábricas desconhecidas (conservador)
-            'temperature': 0.04,
-            'mixing_time': 0.07,
-            'line_speed': 0.05
-        }
+    values = simulated_results if overwrite_input else simulated_results.copy()
+    values.sort(axis=-1)
+    n = values.shape[-1]
+    
+    alpha = 1 - confidence_level
+    ci_lower, ci_upper = _sorted_percentiles(values, [(alpha / 2) * 100, (1 - alpha / 2) * 100])
+    
+    stats_dict = {
+        'mean': values.mean(axis=-1),
+        'std': values.std(axis=-1),
+        'min': values[..., 0],
+        'max': values[..., -1]
     }
+    for q, value in zip(percentiles, _sorted_percentiles(values, percentiles)):
+        stats_dict['median' if q == 50 else f"p{q:g}"] = value
+    stats_dict['confidence_interval'] = [ci_lower, ci_upper]
+    
+    # Contagem de falhas por busca binária em cada linha ordenada
+    rows = values.reshape(-1, n)
+    limits = np.broadcast_to(
+        np.nan if spec_limit is None else np.asarray(spec_limit, dtype=float),
+        values.shape[:-1]
+    ).reshape(-1)
+    upper = np.broadcast_to(np.asarray(limit_type) == 'upper', values.shape[:-1]).reshape(-1)
+    failures = np.zeros(len(rows))
+    for i, (row, limit) in enumerate(zip(rows, limits)):
+        if np.isnan(limit):
+            continue
+        if upper[i]:
+            failures[i] = n - np.searchsorted(row, limit, side='right')
+        else:
+            failures[i] = np.searchsorted(row, limit, side='left')
+    stats_dict['probability_of_fail'] = (failures / n).reshape(values.shape[:-1])
     
-    return variability_by_factory.get(factory, variability_by_factory['default'])
+    if values.ndim == 1:
+        stats_dict = {
+            key: [float(v) for v in value] if isinstance(value, list) else float(value)
+            for key, value in stats_dict.items()
+        }
+    return stats_dict
+
+
+def sweep_probability_of_fail(
+    sorted_factors: np.ndarray,
+    base_predictions: np.ndarray,
+    spec_limits: np.ndarray,
+    upper_limits: np.ndarray
+) -> np.ndarray:
+    """
+    Probabilidade de falha de muitos valores base sobre fatores de ruído já ordenados
+    
+    Args:
+        sorted_factors: Matriz (testes × iterações) de sorted_noise_factors
+        base_predictions: Matriz (pontos × testes) de valores base do modelo ML
+        spec_limits: Vetor (testes,) de limites (NaN = sem limite)
+        upper_limits: Vetor booleano (testes,), True para limite superior
+    
+    Returns:
+        Matriz (pontos × testes) com a fração de iterações que falham
+    """
+    n_iterations = sorted_factors.shape[1]
+    probability = np.zeros(base_predictions.shape)
+    for t in range(base_predictions.shape[1]):
+        if np.isnan(spec_limits[t]):
+            continue
+        base = base_predictions[:, t]
+        # valor = base · fator: a desigualdade se inverte para base < 0
+        fails_above = upper_limits[t] == (base > 0)
+        threshold = spec_limits[t] / np.where(base == 0, 1.0, base)
+        count = np.where(
+            fails_above,
+            n_iterations - np.searchsorted(sorted_factors[t], threshold, side='right'),
+            np.searchsorted(sorted_factors[t], threshold, side='left')
+        )
+        probability[:, t] = np.where(
+            base == 0, float(_zero_value_fails(spec_limits[t], upper_limits[t])), count / n_iterations
+        )
+    return probability
+
+
+def _standard_noise_from_uniforms(uniforms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Mapeia pares de uniformes (n, 2) em normal padrão e triangular(-1, 0, 1)
+    
+    Usa as CDFs inversas: Φ⁻¹ para a normal e, para a triangular,
+    √(2u) - 1 se u < 0.5 e 1 - √(2(1 - u)) caso contrário.
+    """
+    from scipy.special import ndtri
+    
+    u = np.minimum(np.maximum(uniforms, UNIFORM_EPSILON), 1 - UNIFORM_EPSILON)
+    normal = ndtri(u[:, 0])
+    v = u[:, 1]
+    triangular = np.where(v < 0.5, np.sqrt(2 * v) - 1, 1 - np.sqrt(2 * (1 - v)))
+    return normal, triangular
+
+
+def importance_probability_of_fail(
+    base_prediction: Union[float, np.ndarray],
+    standard_process: np.ndarray,
+    standard_formula: np.ndarray,
+    sigma: float,
+    half_width: float,
+    spec_limit: float,
+    limit_type: str = 'upper',
+    confidence_level: float = 0.95
+) -> Tuple[float, List[float]]:
+    """
+    Probabilidade de falha por amostragem por importância (eventos raros)
+    
+    O ruído normal é deslocado para o limite e cada amostra é reponderada
+    pela razão de verossimilhança w = φ(z)/φ(z - μ) = exp(-μz + μ²/2). O
+    deslocamento μ = σθ/s² é o ponto mais provável da falha na aproximação
+    gaussiana do ruído total (θ = limite/base - 1, s² = σ² + a²/6), então
+    metade das amostras cai perto da região de falha mesmo para
+    probabilidades de 1e-6. O triangular é limitado e não é deslocado.
+    
+    Args:
+        base_prediction: Valor base (ou array por iteração) do modelo ML
+        standard_process: Sorteios N(0, 1) do ruído de processo (reaproveitados)
+        standard_formula: Sorteios triangular(-1, 0, 1) do ruído de fórmula
+        sigma: Variabilidade 'overall' de processo
+        half_width: Variabilidade 'overall' de fórmula
+        spec_limit: Limite de especificação
+        limit_type: 'upper' (máximo) ou 'lower' (mínimo)
+        confidence_level: Nível de confiança do intervalo da probabilidade
+    
+    Returns:
+        Tuple de (probabilidade estimada, intervalo de confiança [inferior, superior])
+    """
+    nominal = float(np.mean(base_prediction))
+    shift = 0.0
+    if nominal != 0 and sigma > 0:
+        threshold = spec_limit / nominal - 1
+        shift = sigma * threshold / (sigma ** 2 + half_width ** 2 / 6)
+    
+    shifted = standard_process + shift
+    values = base_prediction * (1 + sigma * shifted + half_width * standard_formula)
+    failed = values > spec_limit if limit_type == 'upper' else values < spec_limit
+    weighted = np.where(failed, np.exp(-shift * shifted + shift ** 2 / 2), 0.0)
+    
+    n = len(weighted)
+    probability = float(weighted.mean())
+    standard_error = float(weighted.std(ddof=1) / np.sqrt(n)) if n > 1 else 0.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence_level) / 2)
+    probability_ci = [max(0.0, probability - z * standard_error), min(1.0, probability + z * standard_error)]
+    return min(probability, 1.0), probability_ci
+
+
+def _has_converged(
+    values: np.ndarray,
+    tolerance: float,
+    spec_limit: Optional[float],
+    limit_type: str,
+    confidence_level: float
+) -> bool:
+    """
+    Critério de parada do modo adaptativo (sem ordenar as amostras)
+    
+    A probabilidade usa o estimador (k + 2) / (n + 4), que não zera o erro
+    padrão quando nenhuma iteração falhou. O erro de cada extremo do IC é
+    metade da distância entre as estatísticas de ordem a ±1 desvio binomial
+    do posto do quantil, obtidas com np.partition em tempo linear.
+    """
+    n = len(values)
+    
+    if spec_limit is not None:
+        failures = np.count_nonzero(values > spec_limit if limit_type == 'upper' else values < spec_limit)
+        p = (failures + 2) / (n + 4)
+        if np.sqrt(p * (1 - p) / (n + 4)) > tolerance:
+            return False
+    
+    alpha = 1 - confidence_level
+    ranks = []
+    for q in (alpha / 2, 1 - alpha / 2):
+        spread = np.sqrt(n * q * (1 - q))
+        ranks += [max(0, int(np.floor(n * q - spread))), min(n - 1, int(np.ceil(n * q + spread)))]
+    order_stats = np.partition(values, ranks)[ranks]
+    endpoint_errors = (order_stats[1::2] - order_stats[0::2]) / 2
+    
+    return bool(np.all(endpoint_errors <= tolerance * abs(values.mean())))
+
+
+def _histogram_percentiles(
+    counts: np.ndarray,
+    lower_edge: float,
+    bin_width: float,
+    percentiles: Sequence[float],
+    minimum: float,
+    maximum: float
+) -> List[float]:
+    """
+    Percentis (posição q/100 · (n - 1), como np.percentile) lidos de um histograma
+    
+    Dentro de um bin, as amostras são supostas uniformemente espaçadas; o
+    resultado é limitado ao min/max exatos. counts é acumulado no próprio array.
+    """
+    cumulative = np.cumsum(counts, out=counts)
+    n = int(cumulative[-1])
+    result = []
+    for q in percentiles:
+        rank = q / 100 * (n - 1)
+        j = int(np.searchsorted(cumulative, rank, side='right'))
+        before = int(cumulative[j - 1]) if j > 0 else 0
+        fraction = (rank - before + 0.5) / (int(cumulative[j]) - before)
+        value = lower_edge + (j + fraction) * bin_width
+        result.append(float(min(max(value, minimum), maximum)))
+    return result
+
+
+def _zero_value_fails(spec_limit: float, upper_limit: bool) -> bool:
+    """Se um valor previsto nulo (ruído multiplicativo não o altera) falha o limite"""
+    return 0 > spec_limit if upper_limit else 0 < spec_limit
+
+
+def _sorted_percentiles(sorted_values: np.ndarray, percentiles: Sequence[float]) -> List[np.ndarray]:
+    """Percentis por interpolação linear sobre um array já ordenado no último eixo"""
+    n = sorted_values.shape[-1]
+    result = []
+    for q in percentiles:
+        position = q / 100 * (n - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, n - 1)
+        fraction = position - lower
+        low_values = sorted_values[..., lower]
+        result.append(low_values + (sorted_values[..., upper] - low_values) * fraction)
+    return result
+
+
+def _noise_cdf(z: np.ndarray, sigma: float, half_width: float) -> np.ndarray:
+    """
+    CDF exata de N(0, sigma) + Triangular(-half_width, 0, half_width)
+    
+    A densidade triangular é a segunda diferença de rampas, então a CDF é a
+    segunda diferença central de G2, segunda primitiva de Φ(x/σ):
+    G2(x) = (x² + σ²)/2 · Φ(x/σ) + xσ/2 · φ(x/σ).
+    """
+    from scipy.special import ndtr
+    
+    z = np.asarray(z, dtype=float)
+    if half_width <= 0:
+        return ndtr(z / sigma)
+    if sigma <= 0:
+        u = np.clip(z / half_width, -1, 1)
+        return np.where(u < 0, (1 + u) ** 2 / 2, 1 - (1 - u) ** 2 / 2)
+    
+    # G2 avaliada de uma vez em z + a, z e z - a
+    x = z + np.multiply.outer((half_width, 0.0, -half_width), np.ones_like(z))
+    t = x / sigma
+    g2 = (x * x + sigma ** 2) / 2 * ndtr(t) + x * sigma / 2 * _standard_normal_pdf(t)
+    cdf = (g2[0] - 2 * g2[1] + g2[2]) / half_width ** 2
+    return np.minimum(np.maximum(cdf, 0.0), 1.0)
+
+
+def _noise_pdf(z: np.ndarray, sigma: float, half_width: float) -> np.ndarray:
+    """Densidade de N(0, sigma) + Triangular(-half_width, 0, half_width)"""
+    from scipy.special import ndtr
+    
+    if half_width <= 0:
+        return _standard_normal_pdf(z / sigma) / sigma
+    if sigma <= 0:
+        return np.maximum(half_width - np.abs(z), 0) / half_width ** 2
+    
+    x = z + np.multiply.outer((half_width, 0.0, -half_width), np.ones_like(z))
+    t = x / sigma
+    g1 = x * ndtr(t) + sigma * _standard_normal_pdf(t)
+    return (g1[0] - 2 * g1[1] + g1[2]) / half_width ** 2
+
+
+def _noise_ppf(probabilities: np.ndarray, sigma: float, half_width: float) -> np.ndarray:
+    """Quantis do ruído total por Newton, partindo da aproximação normal"""
+    from scipy.special import ndtri
+    
+    # Resolver sempre na cauda inferior e refletir (distribuição simétrica)
+    lower_tail = np.minimum(probabilities, 1 - probabilities)
+    total_std = np.sqrt(sigma ** 2 + half_width ** 2 / 6)
+    z = total_std * ndtri(lower_tail)
+    
+    for _ in range(50):
+        density = np.maximum(_noise_pdf(z, sigma, half_width), 1e-300)
+        step = (_noise_cdf(z, sigma, half_width) - lower_tail) / density
+        # Limitar o passo para não sair da região de convergência
+        z = z - np.minimum(np.maximum(step, -total_std), total_std)
+        if np.all(np.abs(step) <= 1e-12 * total_std):
+            break
+    
+    return np.where(probabilities > 0.5, -z, z)
+
+
+def _standard_normal_pdf(t: np.ndarray) -> np.ndarray:
+    """Densidade da normal padrão"""
+    return np.exp(-0.5 * t ** 2) / np.sqrt(2 * np.pi)
+
+
+def estimate_process_variability(factory: str) -> Mapping[str, float]:
+    """
+    Estima variabilidade de processo baseado na fábrica
+    
+    Valores do catálogo (dados históricos das fábricas); fábricas
+    desconhecidas usam a variabilidade padrão, mais conservadora.
+    
+    Args:
+        factory: Nome (ou alias) da fábrica
+    
+    Returns:
+        Mapeamento somente leitura com variabilidades estimadas
+    """
+    return get_catalog().factory(factory).variability
+
+
+# Parâmetros de processo com variação correlacionada
+CORRELATED_PROCESS_PARAMETERS = ('temperature', 'mixing_time', 'line_speed')
+
+
+def estimate_process_correlation(factory: str) -> np.ndarray:
+    """
+    Estima a correlação entre temperatura, tempo de mistura e velocidade de linha
+    
+    Linhas mais rápidas aquecem mais e encurtam a mistura efetiva; os
+    coeficientes de cada fábrica vêm do catálogo.
+    
+    Args:
+        factory: Nome (ou alias) da fábrica
+    
+    Returns:
+        Matriz de correlação (3 × 3, somente leitura) na ordem de CORRELATED_PROCESS_PARAMETERS
+    """
+    return get_catalog().factory(factory).correlation
+
+
+@lru_cache(maxsize=64)
+def get_process_cholesky(factory: str) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    Fator de Cholesky (em cache) da covariância relativa dos parâmetros de processo
+    
+    Args:
+        factory: Nome da fábrica
+    
+    Returns:
+        Tuple de (nomes dos parâmetros, fator triangular inferior L com L Lᵀ = Σ)
+    """
+    variability = estimate_process_variability(factory)
+    stds = np.array([variability[name] for name in CORRELATED_PROCESS_PARAMETERS])
+    covariance = estimate_process_correlation(factory) * np.outer(stds, stds)
+    factor = _cholesky_factor(covariance.tobytes(), len(stds))
+    return CORRELATED_PROCESS_PARAMETERS, factor
+
+
+@lru_cache(maxsize=256)
+def _cholesky_factor(covariance_bytes: bytes, n: int) -> np.ndarray:
+    """Fator L com L Lᵀ = Σ (Cholesky; autovalores se Σ for só semidefinida)"""
+    covariance = np.frombuffer(covariance_bytes, dtype=float).reshape(n, n)
+    try:
+        factor = np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        factor = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    factor.setflags(write=False)
+    return factor
 
 
 def estimate_formula_variability(ingredients: List[Dict]) -> Dict[str, float]:
@@ -0,0 +1,158 @@
+"""
+Versioned registry of trained model artifacts on local disk
+
+Layout (one directory per product family):
+
+    <root>/<family>/CURRENT                    active version (swapped atomically)
+    <root>/<family>/<version>/manifest.json    tests, feature order and importances
+    <root>/<family>/<version>/<test>.joblib    fitted estimator (uncompressed)
+    <root>/<family>/<version>/background.npy   optional SHAP background rows
+
+Artifacts are loaded with joblib's mmap_mode, so the NumPy arrays inside
+the estimators are memory-mapped and shared between uvicorn workers through
+the page cache instead of being deserialized into each process.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+BACKGROUND_FILE = "background.npy"
+
+
+def family_slug(family: str) -> str:
+    """Directory name of a product family ('Kit Kat' -> 'kit_kat')"""
+    return family.strip().lower().replace(' ', '_')
+
+
+class ModelRegistry:
+    """Registro de modelos versionados, com troca atômica de versão sem restart"""
+    
+    def __init__(self, root: str, mmap_mode: Optional[str] = 'r'):
+        self.root = root
+        self.mmap_mode = mmap_mode
+        self._lock = threading.Lock()
+        # family -> (mtime_ns do CURRENT, versão)
+        self._current: Dict[str, Tuple[int, Optional[str]]] = {}
+    
+    def current_version(self, family: str) -> Optional[str]:
+        """
+        Versão ativa da família, ou None se não houver modelos treinados
+        
+        O arquivo CURRENT só é relido quando seu mtime muda, então a consulta
+        custa um stat por request.
+        """
+        path = os.path.join(self.root, family_slug(family), CURRENT_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        
+        cached = self._current.get(family)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        with open(path) as f:
+            version = f.read().strip() or None
+        with self._lock:
+            self._current[family] = (mtime, version)
+        return version
+    
+    def load_manifest(self, family: str, version: str) -> Dict[str, Any]:
+        """Read the manifest of one version"""
+        with open(os.path.join(self._version_dir(family, version), MANIFEST_FILE)) as f:
+            return json.load(f)
+    
+    def load_models(self, family: str, version: str) -> Tuple[Dict[str, Dict], List[str]]:
+        """
+        Carrega os estimadores de uma versão (memory-mapped)
+        
+        Args:
+            family: Família de produto
+            version: Versão a carregar
+        
+        Returns:
+            Tuple de ({test_name: model_info com 'estimator'}, ordem das features)
+        """
+        import joblib
+        
+        manifest = self.load_manifest(family, version)
+        version_dir = self._version_dir(family, version)
+        models = {}
+        for test_name, entry in manifest['tests'].items():
+            logger.info(f"Loading artifact {family}/{version}/{entry['artifact']}")
+            models[test_name] = {
+                'type': entry.get('type', manifest.get('type', 'xgboost')),
+                'estimator': joblib.load(os.path.join(version_dir, entry['artifact']), mmap_mode=self.mmap_mode),
+                'feature_importance': entry.get('feature_importance', {})
+            }
+        return models, manifest['features']
+    
+    def load_background(self, family: str, version: str) -> Optional[np.ndarray]:
+        """SHAP background rows of a version (memory-mapped), or None if not saved"""
+        path = os.path.join(self._version_dir(family, version), BACKGROUND_FILE)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode=self.mmap_mode)
+    
+    def save_version(
+        self,
+        family: str,
+        version: str,
+        estimators: Dict[str, Any],
+        features: List[str],
+        feature_importance: Optional[Dict[str, Dict[str, float]]] = None,
+        model_type: str = 'xgboost',
+        background: Optional[np.ndarray] = None
+    ):
+        """
+        Grava uma nova versão (sem ativá-la)
+        
+        Args:
+            family: Família de produto
+            version: Identificador da versão (nome do diretório)
+            estimators: {test_name: estimador treinado com predict(X)}
+            features: Ordem das colunas de X (codificação do FeatureSchema)
+            feature_importance: {test_name: {feature: importância}} opcional
+            model_type: Tipo registrado no manifest
+            background: Linhas (n, features) de referência para o SHAP
+                (ex: amostra do treino); sem elas, o TreeExplainer usa a
+                cobertura das árvores
+        """
+        import joblib
+        
+        version_dir = self._version_dir(family, version)
+        os.makedirs(version_dir, exist_ok=True)
+        manifest = {'version': version, 'type': model_type, 'features': list(features), 'tests': {}}
+        for test_name, estimator in estimators.items():
+            artifact = f"{test_name}.joblib"
+            # Sem compressão: obrigatório para carregar com mmap_mode
+            joblib.dump(estimator, os.path.join(version_dir, artifact))
+            manifest['tests'][test_name] = {
+                'artifact': artifact,
+                'feature_importance': (feature_importance or {}).get(test_name, {})
+            }
+        if background is not None:
+            np.save(os.path.join(version_dir, BACKGROUND_FILE), np.asarray(background, dtype=float))
+        with open(os.path.join(version_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+    
+    def activate(self, family: str, version: str):
+        """Make a saved version current, atomically (os.replace)"""
+        self.load_manifest(family, version)
+        family_dir = os.path.join(self.root, family_slug(family))
+        tmp_path = os.path.join(family_dir, f".{CURRENT_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(family_dir, CURRENT_FILE))
+        logger.info(f"Activated model version {version} for {family}")
+    
+    def _version_dir(self, family: str, version: str) -> str:
+        return os.path.join(self.root, family_slug(family), version)
@@ -0,0 +1,185 @@
+"""
+Memoization of deterministic prediction results keyed by canonicalized request
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from .cache import LRUCache
+from .ml_models import resolve_product_family
+from .schemas import PredictionRequest, PredictionResponse
+
+logger = logging.getLogger(__name__)
+
+# Campos da resposta que dependem do request e não do resultado simulado
+_REQUEST_FIELDS = ('project_id', 'product_name', 'prediction_timestamp', 'explanation_id')
+
+
+def canonical_request_key(request: PredictionRequest, model_version: str) -> str:
+    """
+    Gera a chave canônica (SHA-256) de um request
+    
+    Inclui apenas o que altera o resultado: família de produto, versão do
+    modelo, fórmula, parâmetros de processo, fábrica e configuração da
+    simulação. project_id, o nome exato do produto e o fornecedor dos
+    ingredientes ficam de fora.
+    """
+    ingredients = [[ing.name, ing.percentage] for ing in request.formula]
+    # A ordem só importa se houver nomes repetidos (o último prevalece)
+    if len({name.lower() for name, _ in ingredients}) == len(ingredients):
+        ingredients.sort(key=lambda item: item[0].lower())
+    
+    payload = {
+        'product_family': resolve_product_family(request.product_name),
+        'model_version': model_version,
+        'formula': ingredients,
+        'process_parameters': request.process_parameters.model_dump(),
+        'factory': request.factory,
+        'monte_carlo_iterations': request.monte_carlo_iterations,
+        'random_seed': request.random_seed,
+        'simulation_mode': request.simulation_mode,
+        'correlated_process': request.correlated_process,
+        'sampling': request.sampling,
+        'importance_sampling': request.importance_sampling,
+        'precision': request.precision,
+        'convergence_tolerance': request.convergence_tolerance,
+        'shap_mode': request.shap_mode
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class SQLiteResultStore:
+    """Armazenamento em SQLite compartilhado entre workers (TTL + limite de tamanho)"""
+    
+    def __init__(self, path: str, max_entries: int = 100000, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prediction_results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_prediction_results_created "
+            "ON prediction_results (created_at)"
+        )
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored result or None if missing/expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM prediction_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds is not None and time.time() - row[1] > self.ttl_seconds:
+            return None
+        return json.loads(row[0])
+    
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a result, pruning expired and oldest rows periodically"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prediction_results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time())
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._prune()
+    
+    def _prune(self):
+        if self.ttl_seconds is not None:
+            self._conn.execute(
+                "DELETE FROM prediction_results WHERE created_at < ?",
+                (time.time() - self.ttl_seconds,)
+            )
+        self._conn.execute(
+            "DELETE FROM prediction_results WHERE key IN ("
+            "SELECT key FROM prediction_results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ResultCache:
+    """
+    Cache de resultados de predição em dois níveis
+    
+    Um LRU em memória atende as repetições do próprio processo; o SQLite
+    opcional é compartilhado por todos os workers uvicorn da máquina.
+    """
+    
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl_seconds: Optional[float] = None,
+        sqlite_path: Optional[str] = None,
+        sqlite_max_entries: int = 100000
+    ):
+        self.memory = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.store = (
+            SQLiteResultStore(sqlite_path, max_entries=sqlite_max_entries, ttl_seconds=ttl_seconds)
+            if sqlite_path else None
+        )
+        self.store_hits = 0
+    
+    def get(self, request: PredictionRequest, model_version: str) -> Optional[PredictionResponse]:
+        """
+        Busca o resultado de um request equivalente com a mesma versão de modelo
+        
+        Returns:
+            PredictionResponse com project_id, product_name e timestamp do
+            request atual, ou None
+        """
+        key = canonical_request_key(request, model_version)
+        result = self.memory.get(key)
+        if result is None and self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                self.store_hits += 1
+                self.memory.set(key, result)
+        if result is None:
+            return None
+        
+        return PredictionResponse(
+            **result,
+            project_id=request.project_id,
+            product_name=request.product_name,
+            prediction_timestamp=datetime.utcnow().isoformat() + "Z"
+        )
+    
+    def set(self, request: PredictionRequest, response: PredictionResponse):
+        """Store the request-independent part of a response"""
+        key = canonical_request_key(request, response.model_version)
+        result = response.model_dump(exclude=set(_REQUEST_FIELDS))
+        self.memory.set(key, result)
+        if self.store is not None:
+            try:
+                self.store.set(key, result)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist prediction result: {str(e)}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Memory tier counters plus shared store hits"""
+        stats = self.memory.stats()
+        stats['backend'] = 'memory+sqlite' if self.store is not None else 'memory'
+        stats['store_hits'] = self.store_hits
+        return stats
+    
+    def close(self):
+        if self.store is not None:
+            self.store.close()
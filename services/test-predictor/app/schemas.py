@@ -1,8 +1,8 @@
 """
 Pydantic schemas for TestPredictorService API
 """
-from typing import List, Dict, Optional, Literal
-from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Literal, Union
+from pydantic import BaseModel, Field, model_validator
 
 
 class FormulaIngredient(BaseModel):
@@ -30,6 +30,152 @@ class PredictionRequest(BaseModel):
     process_parameters: ProcessParameters = Field(..., description="Parâmetros de processo")
     factory: str = Field(..., description="Fábrica de produção")
     monte_carlo_iterations: int = Field(10000, ge=1000, le=50000, description="Número de iterações Monte Carlo")
+    random_seed: int = Field(42, ge=0, description="Semente do gerador aleatório (reprodutibilidade)")
+    simulation_mode: Literal["monte_carlo", "analytic"] = Field(
+        "monte_carlo",
+        description="'monte_carlo' (amostragem) ou 'analytic' (CDF exata da convolução, sem amostras)"
+    )
+    correlated_process: bool = Field(
+        False,
+        description="Simular variação correlacionada de temperatura, mistura e velocidade da fábrica"
+    )
+    sampling: Literal["random", "antithetic", "latin_hypercube", "sobol"] = Field(
+        "random",
+        description="Amostragem do ruído: 'random' (i.i.d.), 'antithetic', 'latin_hypercube' ou 'sobol' (redução de variância)"
+    )
+    precision: Literal["float64", "float32"] = Field(
+        "float64",
+        description="'float32': sorteios em blocos de tamanho fixo com estatísticas por streaming (memória constante por teste)"
+    )
+    importance_sampling: bool = Field(
+        False,
+        description="Estimar a probabilidade de falha por amostragem por importância (falhas raras, limite a vários desvios)"
+    )
+    convergence_tolerance: Optional[float] = Field(
+        None,
+        gt=0,
+        le=0.1,
+        description=(
+            "Modo adaptativo: amostrar em blocos e parar cada teste quando o erro padrão da "
+            "probabilidade de falha e dos extremos do IC (relativo à média) ficar abaixo deste "
+            "valor; monte_carlo_iterations vira o teto"
+        )
+    )
+    shap_mode: Literal["inline", "skip", "deferred"] = Field(
+        "inline",
+        description=(
+            "'inline': explicação SHAP na resposta; 'skip': sem explicação; 'deferred': "
+            "resposta sem explicação e com explanation_id para GET /predict/explanations/{id}"
+        )
+    )
+    
+    @model_validator(mode='after')
+    def check_simulation_options(self) -> 'PredictionRequest':
+        if self.correlated_process and self.simulation_mode != "monte_carlo":
+            raise ValueError("correlated_process requires simulation_mode='monte_carlo'")
+        if self.convergence_tolerance is not None and self.simulation_mode != "monte_carlo":
+            raise ValueError("convergence_tolerance requires simulation_mode='monte_carlo'")
+        if self.convergence_tolerance is not None and self.sampling != "random":
+            raise ValueError("convergence_tolerance requires sampling='random'")
+        if self.importance_sampling and self.simulation_mode != "monte_carlo":
+            raise ValueError("importance_sampling requires simulation_mode='monte_carlo'")
+        if self.importance_sampling and self.convergence_tolerance is not None:
+            raise ValueError("importance_sampling cannot be combined with convergence_tolerance")
+        if self.precision == "float32":
+            if self.simulation_mode != "monte_carlo":
+                raise ValueError("precision='float32' requires simulation_mode='monte_carlo'")
+            if (
+                self.correlated_process
+                or self.importance_sampling
+                or self.convergence_tolerance is not None
+                or self.sampling != "random"
+            ):
+                raise ValueError(
+                    "precision='float32' streams i.i.d. draws and cannot be combined with "
+                    "correlated_process, importance_sampling, convergence_tolerance or sampling"
+                )
+        return self
+
+
+class ParameterBounds(BaseModel):
+    """Faixa de um parâmetro de processo ou percentual de ingrediente"""
+    parameter: str = Field(..., description="Campo de ProcessParameters (ex: 'temperature') ou ingrediente da fórmula base (ex: 'Lecitina')")
+    min: float = Field(..., description="Valor mínimo da faixa")
+    max: float = Field(..., description="Valor máximo da faixa")
+    
+    @model_validator(mode='after')
+    def check_bounds(self) -> 'ParameterBounds':
+        if self.min > self.max:
+            raise ValueError(f"min must not exceed max for '{self.parameter}'")
+        return self
+
+
+class SweepRange(ParameterBounds):
+    """Faixa de um parâmetro varrido em /sweep"""
+    steps: int = Field(5, ge=2, le=1000, description="Pontos da faixa na grade (method='grid'), extremos incluídos")
+
+
+def check_parameter_bounds(base_request: PredictionRequest, bounds: List[ParameterBounds]) -> None:
+    """Valida faixas contra o request base (parâmetros únicos e existentes, percentuais 0-100)"""
+    if base_request.correlated_process:
+        raise ValueError("correlated_process is not supported with parameter ranges")
+    if base_request.importance_sampling:
+        raise ValueError("importance_sampling is not supported with parameter ranges")
+    if base_request.precision != "float64":
+        raise ValueError("precision='float32' is not supported with parameter ranges")
+    
+    parameters = [b.parameter for b in bounds]
+    if len(set(parameters)) != len(parameters):
+        raise ValueError("Each parameter can be given only once")
+    
+    ingredients = {ing.name.lower() for ing in base_request.formula}
+    for parameter_bounds in bounds:
+        if parameter_bounds.parameter in ProcessParameters.model_fields:
+            continue
+        if parameter_bounds.parameter.lower() not in ingredients:
+            raise ValueError(
+                f"'{parameter_bounds.parameter}' is neither a process parameter nor an ingredient of the base formula"
+            )
+        if parameter_bounds.min < 0 or parameter_bounds.max > 100:
+            raise ValueError(f"Percentage range of '{parameter_bounds.parameter}' must be within 0-100")
+
+
+class SweepRequest(BaseModel):
+    """Request para varredura de parâmetros (design de experimentos)"""
+    base_request: PredictionRequest = Field(..., description="Request base; os parâmetros varridos substituem os seus valores")
+    ranges: List[SweepRange] = Field(..., min_length=1, max_length=10, description="Faixas dos parâmetros varridos")
+    method: Literal["grid", "latin_hypercube", "sobol"] = Field(
+        "grid",
+        description="'grid' (grade completa), 'latin_hypercube' ou 'sobol' (quasi-aleatório)"
+    )
+    n_points: int = Field(1024, ge=1, le=100000, description="Número de pontos (latin_hypercube/sobol)")
+    
+    @model_validator(mode='after')
+    def check_parameters(self) -> 'SweepRequest':
+        check_parameter_bounds(self.base_request, self.ranges)
+        return self
+
+
+class OptimizationRequest(BaseModel):
+    """Request para busca dos parâmetros que minimizam o overall_risk_score"""
+    base_request: PredictionRequest = Field(..., description="Request base; parâmetros fora de bounds ficam fixos")
+    bounds: List[ParameterBounds] = Field(..., min_length=1, max_length=10, description="Faixas permitidas para os parâmetros otimizados")
+    population_size: int = Field(256, ge=8, le=4096, description="Candidatos avaliados por geração")
+    max_evaluations: int = Field(10000, ge=100, le=200000, description="Máximo de candidatos avaliados")
+    patience: int = Field(3, ge=1, le=20, description="Gerações sem melhora antes de parar")
+    
+    @model_validator(mode='after')
+    def check_parameters(self) -> 'OptimizationRequest':
+        check_parameter_bounds(self.base_request, self.bounds)
+        return self
+
+
+class WhatIfUpdate(BaseModel):
+    """Mudança aplicada a uma sessão what-if"""
+    changes: Dict[str, float] = Field(
+        ..., min_length=1, max_length=20,
+        description="Novos valores por parâmetro: campo de ProcessParameters (ex: 'temperature') ou ingrediente da fórmula base (ex: 'Lecitina')"
+    )
 
 
 class TestPrediction(BaseModel):
@@ -41,7 +187,12 @@ class TestPrediction(BaseModel):
     status: Literal["PASS", "WARNING", "FAIL"] = Field(..., description="Status da predição")
     confidence_interval: List[float] = Field(..., description="Intervalo de confiança 95% [min, max]")
     probability_of_fail: float = Field(..., ge=0, le=1, description="Probabilidade de falha (0-1)")
+    probability_of_fail_ci: Optional[List[float]] = Field(
+        None,
+        description="Intervalo de confiança da probabilidade de falha [min, max] (amostragem por importância)"
+    )
     importance_score: Optional[float] = Field(None, description="Importância do teste (0-1)")
+    iterations_used: Optional[int] = Field(None, description="Iterações Monte Carlo efetivamente simuladas (None no modo analítico)")
 
 
 class ShapExplanation(BaseModel):
@@ -50,6 +201,12 @@ class ShapExplanation(BaseModel):
     top_positive_factors: List[str] = Field(..., description="Top 3 fatores que aumentam o risco")
     top_negative_factors: List[str] = Field(..., description="Top 3 fatores que reduzem o risco")
     base_value: float = Field(..., description="Valor base do modelo")
+    shap_values: Optional[Dict[str, Dict[str, float]]] = Field(
+        None, description="Valores SHAP por teste e feature, nas unidades do teste (features sem efeito omitidas)"
+    )
+    expected_values: Optional[Dict[str, float]] = Field(
+        None, description="Valor esperado do modelo por teste (predição = esperado + soma dos SHAP)"
+    )
 
 
 class PredictionResponse(BaseModel):
@@ -59,10 +216,91 @@ class PredictionResponse(BaseModel):
     overall_risk_score: float = Field(..., ge=0, le=100, description="Score de risco geral (0-100)")
     test_predictions: List[TestPrediction] = Field(..., description="Lista de predições de testes")
     recommendations: List[str] = Field(..., description="Recomendações para reduzir risco")
-    shap_explanation: ShapExplanation = Field(..., description="Explicação SHAP")
+    shap_explanation: Optional[ShapExplanation] = Field(None, description="Explicação SHAP (None com shap_mode 'skip'/'deferred')")
+    explanation_id: Optional[str] = Field(None, description="Id da explicação adiada (shap_mode 'deferred')")
     model_version: str = Field(..., description="Versão do modelo ML")
     prediction_timestamp: str = Field(..., description="Timestamp da predição (ISO 8601)")
-    monte_carlo_iterations: int = Field(..., description="Número de iterações Monte Carlo executadas")
+    monte_carlo_iterations: int = Field(..., description="Número de iterações Monte Carlo executadas (teto no modo adaptativo)")
+    simulation_mode: Literal["monte_carlo", "analytic"] = Field("monte_carlo", description="Modo de simulação utilizado")
+    random_seed: Optional[int] = Field(None, description="Semente usada na simulação (reproduz a execução)")
+    sampling: Optional[str] = Field(None, description="Amostragem do ruído usada na simulação (None no modo analítico)")
+
+
+class TestSurface(BaseModel):
+    """Superfície de probabilidade de falha de um teste na varredura"""
+    test_name: str = Field(..., description="Nome do teste")
+    unit: str = Field(..., description="Unidade de medida")
+    spec_limit: Optional[float] = Field(None, description="Limite de especificação")
+    predicted_value: List[float] = Field(..., description="Valor previsto em cada ponto (ordem de points)")
+    probability_of_fail: List[float] = Field(..., description="Probabilidade de falha em cada ponto (0-1)")
+
+
+class SweepResponse(BaseModel):
+    """Response da varredura: uma superfície por teste sobre os pontos avaliados"""
+    project_id: str = Field(..., description="ID do projeto")
+    product_name: str = Field(..., description="Nome do produto")
+    method: Literal["grid", "latin_hypercube", "sobol"] = Field(..., description="Método de amostragem dos pontos")
+    n_points: int = Field(..., description="Número de pontos avaliados")
+    points: Dict[str, List[float]] = Field(..., description="Coordenadas dos pontos, por parâmetro varrido")
+    overall_risk_score: List[float] = Field(..., description="Score de risco geral (0-100) em cada ponto")
+    tests: List[TestSurface] = Field(..., description="Superfície de cada teste")
+    model_version: str = Field(..., description="Versão do modelo ML")
+    prediction_timestamp: str = Field(..., description="Timestamp da predição (ISO 8601)")
+    monte_carlo_iterations: int = Field(..., description="Iterações Monte Carlo por ponto")
+    simulation_mode: Literal["monte_carlo", "analytic"] = Field(..., description="Modo de simulação utilizado")
+    random_seed: Optional[int] = Field(None, description="Semente usada na simulação e na amostragem")
+
+
+class OptimizationResponse(BaseModel):
+    """Response da otimização: melhores parâmetros e a predição completa com eles"""
+    best_parameters: Dict[str, float] = Field(..., description="Valores ótimos dos parâmetros otimizados")
+    baseline_risk_score: float = Field(..., description="Score de risco geral do request base (0-100)")
+    best_risk_score: float = Field(..., description="Score de risco geral com os melhores parâmetros (0-100)")
+    evaluations: int = Field(..., description="Candidatos avaliados")
+    generations: int = Field(..., description="Gerações da busca")
+    converged: bool = Field(..., description="Se a busca parou por falta de melhora (e não pelo limite de avaliações)")
+    prediction: PredictionResponse = Field(..., description="Predição completa com os melhores parâmetros")
+
+
+class WhatIfTest(BaseModel):
+    """Resultado de um teste na sessão what-if"""
+    test_name: str = Field(..., description="Nome do teste")
+    unit: str = Field(..., description="Unidade de medida")
+    spec_limit: Optional[float] = Field(None, description="Limite de especificação")
+    predicted_value: float = Field(..., description="Valor previsto com os parâmetros atuais da sessão")
+    probability_of_fail: float = Field(..., ge=0, le=1, description="Probabilidade de falha com os parâmetros atuais (0-1)")
+    baseline_probability_of_fail: float = Field(..., ge=0, le=1, description="Probabilidade de falha do request base, nos mesmos sorteios")
+    recomputed: bool = Field(..., description="Se a última mudança recalculou este teste")
+
+
+class WhatIfResponse(BaseModel):
+    """Estado de uma sessão what-if"""
+    session_id: str = Field(..., description="Id da sessão (usado em PATCH/GET/DELETE /whatif/sessions/{session_id})")
+    project_id: str = Field(..., description="ID do projeto")
+    product_name: str = Field(..., description="Nome do produto")
+    parameters: Dict[str, float] = Field(..., description="Valores alterados em relação ao request base (acumulados)")
+    overall_risk_score: float = Field(..., ge=0, le=100, description="Score de risco geral com os parâmetros atuais (0-100)")
+    baseline_risk_score: float = Field(..., ge=0, le=100, description="Score de risco geral do request base (0-100)")
+    tests: List[WhatIfTest] = Field(..., description="Resultado de cada teste")
+    model_version: str = Field(..., description="Versão do modelo ML")
+    monte_carlo_iterations: int = Field(..., description="Iterações Monte Carlo (sorteios reutilizados a cada mudança)")
+    simulation_mode: Literal["monte_carlo", "analytic"] = Field(..., description="Modo de simulação utilizado")
+    random_seed: Optional[int] = Field(None, description="Semente dos sorteios da sessão (None no modo analítico)")
+
+
+class JobStatus(BaseModel):
+    """Estado de um job assíncrono (POST /jobs) e, quando concluído, o resultado"""
+    job_id: str = Field(..., description="Id do job (usado em GET /jobs/{job_id})")
+    kind: Literal["predict", "batch"] = Field(..., description="Request único ou lista de requests")
+    status: Literal["queued", "running", "completed", "failed"] = Field(..., description="Estado do job")
+    created_at: str = Field(..., description="Criação do job (ISO 8601)")
+    started_at: Optional[str] = Field(None, description="Início da execução (ISO 8601)")
+    finished_at: Optional[str] = Field(None, description="Fim da execução (ISO 8601)")
+    expires_at: Optional[str] = Field(None, description="Quando o resultado deixa de estar disponível (ISO 8601)")
+    result: Optional[Union[PredictionResponse, List[PredictionResponse]]] = Field(
+        None, description="Predição (kind 'predict') ou lista de predições (kind 'batch'), se concluído"
+    )
+    error: Optional[str] = Field(None, description="Mensagem de erro, se falhou")
 
 
 class HealthResponse(BaseModel):
@@ -0,0 +1,109 @@
+"""
+Small per-key state shared by every worker process through SQLite
+
+Deferred SHAP explanations and what-if sessions are created by one uvicorn
+worker and read back by whichever worker the next request reaches. Each
+worker keeps its own in-memory copy for speed; this store holds the
+authoritative JSON state (with a revision number for compare-and-set
+updates) so a worker that does not have an entry, or has an outdated one,
+can rebuild it.
+"""
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+# Limpeza de entradas expiradas a cada N escritas
+PRUNE_EVERY = 100
+
+
+class SharedStateStore:
+    """Tabela chave -> JSON em SQLite (WAL) com revisão e TTL desde a última escrita"""
+    
+    def __init__(self, path: str, table: str, ttl_seconds: Optional[float] = None, max_entries: int = 100000):
+        self.path = path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, revision INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_updated ON {table} (updated_at)")
+    
+    def get(self, key: str) -> Optional[Tuple[str, int]]:
+        """
+        Estado atual de uma chave
+        
+        Returns:
+            Tuple de (valor JSON, revisão), ou None se não existir ou tiver expirado
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, revision, updated_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        if self.ttl_seconds is not None and time.time() - row[2] > self.ttl_seconds:
+            return None
+        return row[0], row[1]
+    
+    def set(self, key: str, value: str):
+        """Store a value unconditionally (revision 0)"""
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, revision, updated_at) VALUES (?, ?, 0, ?)",
+                (key, value, time.time())
+            )
+            self._written()
+    
+    def update(self, key: str, value: str, revision: int) -> Optional[int]:
+        """
+        Substitui o valor se a revisão ainda for a informada (compare-and-set)
+        
+        Returns:
+            Nova revisão, ou None se a chave mudou, expirou ou foi removida
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE {self.table} SET value = ?, revision = revision + 1, updated_at = ? "
+                "WHERE key = ? AND revision = ? AND updated_at >= ?",
+                (value, time.time(), key, revision, self._oldest_valid())
+            )
+            if not cursor.rowcount:
+                return None
+            self._written()
+        return revision + 1
+    
+    def delete(self, key: str) -> bool:
+        """Remove a key; returns whether a live entry existed"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key = ? AND updated_at >= ?", (key, self._oldest_valid())
+            )
+            return cursor.rowcount > 0
+    
+    def _oldest_valid(self) -> float:
+        return time.time() - self.ttl_seconds if self.ttl_seconds is not None else float("-inf")
+    
+    def _written(self):
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self._prune()
+    
+    def _prune(self):
+        self._conn.execute(f"DELETE FROM {self.table} WHERE updated_at < ?", (self._oldest_valid(),))
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,134 @@
+"""
+Read-only numeric tables in shared memory for the multi-process launcher
+
+The launcher packs the mock model schemas (means and weights) into one
+multiprocessing.shared_memory block before forking. Workers inherit the
+mapping and read the tables through read-only NumPy views, so every
+process uses the same physical pages instead of its own copy. Without the
+launcher nothing is installed and each model keeps its own arrays. Test
+specifications and factory variability come from the catalog, loaded once
+per process.
+"""
+import logging
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .ml_models import FeatureSchema
+
+logger = logging.getLogger(__name__)
+
+# Alinhamento de cada array dentro do bloco (bytes)
+ALIGNMENT = 64
+
+_current: Optional["SharedTables"] = None
+
+
+class SharedTables:
+    """Bloco de memória compartilhada com arrays nomeados (somente leitura)"""
+    
+    def __init__(
+        self,
+        block: shared_memory.SharedMemory,
+        layout: Dict[str, Tuple[int, Tuple[int, ...]]],
+        labels: Dict[str, Any]
+    ):
+        self.block = block
+        self.labels = labels
+        self._arrays: Dict[str, np.ndarray] = {}
+        for key, (offset, shape) in layout.items():
+            view = np.ndarray(shape, dtype=np.float64, buffer=block.buf, offset=offset)
+            view.setflags(write=False)
+            self._arrays[key] = view
+    
+    @classmethod
+    def create(cls, arrays: Dict[str, np.ndarray], labels: Dict[str, Any]) -> "SharedTables":
+        """
+        Copia os arrays para um novo bloco de memória compartilhada
+        
+        Args:
+            arrays: {chave: array} convertidos para float64
+            labels: Nomes de linhas/colunas de cada tabela (ficam no processo)
+        
+        Returns:
+            SharedTables dono do bloco (responsável por unlink)
+        """
+        layout: Dict[str, Tuple[int, Tuple[int, ...]]] = {}
+        size = 0
+        for key, array in arrays.items():
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout[key] = (size, tuple(np.shape(array)))
+            size += int(np.asarray(array, dtype=np.float64).nbytes)
+        
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for key, array in arrays.items():
+            offset, shape = layout[key]
+            target = np.ndarray(shape, dtype=np.float64, buffer=block.buf, offset=offset)
+            target[...] = array
+            del target
+        logger.info(f"Shared tables: {len(arrays)} arrays, {size} bytes in {block.name}")
+        return cls(block, layout, labels)
+    
+    def array(self, key: str) -> np.ndarray:
+        """Read-only view of one table"""
+        return self._arrays[key]
+    
+    def share_schema(self, family: str, schema: "FeatureSchema") -> bool:
+        """
+        Troca médias e pesos do schema pelas views compartilhadas da família
+        
+        Só substitui se testes e features coincidirem com os da tabela
+        (modelos treinados do registro têm schema próprio e ficam como estão).
+        
+        Returns:
+            True se o schema passou a usar a memória compartilhada
+        """
+        labels = self.labels.get(f"schema/{family}")
+        if labels is None or labels != [schema.test_names, schema.feature_names]:
+            return False
+        schema.means = self._arrays[f"schema/{family}/means"]
+        schema.weights = self._arrays[f"schema/{family}/weights"]
+        return True
+    
+    def close(self):
+        """Drop the views and unmap the block in this process"""
+        self._arrays.clear()
+        self.block.close()
+    
+    def unlink(self):
+        """Free the block (owner process only, after the workers exit)"""
+        self.block.unlink()
+
+
+def build_tables() -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Monta as tabelas numéricas a partir dos schemas dos modelos mock
+    
+    Returns:
+        Tuple de (arrays por chave, rótulos por tabela) para SharedTables.create
+    """
+    from .ml_models import GENERIC_PRODUCT_FAMILY, PRODUCT_FAMILIES, TestPredictorModel
+    
+    arrays: Dict[str, np.ndarray] = {}
+    labels: Dict[str, Any] = {}
+    
+    for family in PRODUCT_FAMILIES + (GENERIC_PRODUCT_FAMILY,):
+        schema = TestPredictorModel(family).schema
+        arrays[f"schema/{family}/means"] = schema.means
+        arrays[f"schema/{family}/weights"] = schema.weights
+        labels[f"schema/{family}"] = [list(schema.test_names), list(schema.feature_names)]
+    
+    return arrays, labels
+
+
+def install(tables: Optional[SharedTables]):
+    """Make the tables visible to this process and to the ones forked after it"""
+    global _current
+    _current = tables
+
+
+def current() -> Optional[SharedTables]:
+    """Tables installed by the launcher, or None"""
+    return _current
@@ -0,0 +1,137 @@
+"""
+What-if sessions: incremental re-simulation on common random numbers
+
+The simulated value of a test is base prediction × (1 + process noise +
+formula noise), and the noise does not depend on the base prediction. A
+session draws and sorts the noise factors of its base request once (the
+same draws /predict uses). A change of process parameters or ingredient
+percentages then only re-predicts the base values of the tests whose
+features changed and counts fails by binary search on the stored factors,
+so before/after comparisons differ by the change alone, not by sampling noise.
+"""
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .monte_carlo import MonteCarloSimulator, sweep_probability_of_fail
+from .schemas import PredictionRequest
+
+
+class WhatIfSession:
+    """Estado de uma sessão what-if: sorteios fixos e valores base atualizáveis"""
+    
+    def __init__(
+        self,
+        request: PredictionRequest,
+        model_version: str,
+        test_names: List[str],
+        specs: List[Dict],
+        features: np.ndarray,
+        base_predictions: np.ndarray,
+        simulator: MonteCarloSimulator,
+        process_variability: float,
+        formula_variability: float,
+        spec_limits: np.ndarray,
+        upper_limits: np.ndarray
+    ):
+        self.request = request
+        self.model_version = model_version
+        self.test_names = test_names
+        self.specs = specs
+        self.features = features
+        self.base_predictions = np.array(base_predictions, dtype=float)
+        self.simulator = simulator
+        self.process_variability = process_variability
+        self.formula_variability = formula_variability
+        self.spec_limits = spec_limits
+        self.upper_limits = upper_limits
+        # Valores alterados em relação ao request base (acumulados)
+        self.parameters: Dict[str, float] = {}
+        # Revisão do estado compartilhado refletida nesta cópia
+        self.revision = 0
+        
+        # Fatores de ruído ordenados (testes × iterações); None no modo analítico
+        self.factors: Optional[np.ndarray] = None
+        self.factor_means: Optional[np.ndarray] = None
+        if request.simulation_mode == "monte_carlo":
+            self.factors = simulator.sorted_noise_factors(len(test_names), process_variability, formula_variability)
+            self.factor_means = self.factors.mean(axis=1)
+        
+        all_tests = np.arange(len(test_names))
+        self.mean, self.probability = self.evaluate(self.base_predictions, all_tests)
+        self.baseline_probability = self.probability.copy()
+        self.recomputed = np.zeros(len(test_names), dtype=bool)
+    
+    def evaluate(self, base_predictions: np.ndarray, tests: np.ndarray):
+        """
+        Média e probabilidade de falha de alguns testes para novos valores base
+        
+        Args:
+            base_predictions: Vetor (len(tests),) de valores base do modelo ML
+            tests: Índices dos testes (ordem de test_names)
+        
+        Returns:
+            Tuple de vetores (média simulada, probabilidade de falha)
+        """
+        if self.factors is None:
+            stats = self.simulator.analytic_sweep(
+                base_predictions[None, :],
+                self.process_variability,
+                self.formula_variability,
+                self.spec_limits[tests],
+                self.upper_limits[tests]
+            )
+            return stats['mean'][0], stats['probability_of_fail'][0]
+        
+        # Fatias (views) teste a teste: sem copiar as linhas de sorteios
+        probability = np.array([
+            sweep_probability_of_fail(
+                self.factors[t:t + 1],
+                base_predictions[None, i:i + 1],
+                self.spec_limits[t:t + 1],
+                self.upper_limits[t:t + 1]
+            )[0, 0]
+            for i, t in enumerate(tests)
+        ])
+        return base_predictions * self.factor_means[tests], probability
+    
+    def update(
+        self,
+        features: np.ndarray,
+        tests: np.ndarray,
+        base_predictions: np.ndarray,
+        parameters: Dict[str, float]
+    ):
+        """
+        Aplica uma mudança: novos valores base só dos testes afetados
+        
+        Args:
+            features: Novo vetor de features codificadas da sessão
+            tests: Índices dos testes cujas features mudaram
+            base_predictions: Novos valores base desses testes
+            parameters: Valores alterados nesta mudança
+        """
+        self.features = features
+        self.parameters.update(parameters)
+        self.recomputed[:] = False
+        if len(tests) == 0:
+            return
+        self.base_predictions[tests] = base_predictions
+        self.mean[tests], self.probability[tests] = self.evaluate(base_predictions, tests)
+        self.recomputed[tests] = True
+    
+    def state_json(self) -> str:
+        """
+        Estado compartilhado entre workers, sem os sorteios
+        
+        Request base (com a semente), versão do modelo, mudanças acumuladas e
+        testes recalculados na última mudança: o suficiente para outro
+        processo refazer os mesmos sorteios e reaplicar as mudanças.
+        """
+        state = json.dumps({
+            'model_version': self.model_version,
+            'parameters': self.parameters,
+            'recomputed': np.flatnonzero(self.recomputed).tolist()
+        }, ensure_ascii=False)
+        return state[:-1] + ', "request": ' + self.request.model_dump_json() + "}"
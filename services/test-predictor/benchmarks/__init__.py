@@ -0,0 +1,3 @@
+"""
+Performance benchmarks for TestPredictorService (run from services/test-predictor)
+"""
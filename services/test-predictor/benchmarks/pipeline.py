@@ -0,0 +1,209 @@
+"""
+Prediction pipeline benchmark: model, Monte Carlo stages and end-to-end /predict
+
+Measures TestPredictorModel.predict for every product family, the Monte
+Carlo stages (simulate_test_results, calculate_probability_of_fail,
+get_confidence_interval) from 1k to 50k iterations, and /predict and
+/predict/batch through FastAPI's TestClient (result cache disabled). Results
+are written as JSON; with --baseline, each benchmark's median is compared
+with the stored one and the run fails if any is slower by more than
+--max-regression.
+
+Usage:
+    python -m benchmarks.pipeline --output baseline.json
+    python -m benchmarks.pipeline --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import timeit
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+PRODUCTS = {
+    'Nescau': 'Nescau Zero Açúcar',
+    'Ninho': 'Ninho Phases 4',
+    'Kit Kat': 'Kit Kat Vegano',
+    'generic': 'Produto Genérico'
+}
+
+ITERATIONS = (1000, 10000, 50000)
+
+BATCH_SIZES = (1, 10, 100)
+
+FORMULA = [
+    {"name": "Cacau em pó", "percentage": 35.0},
+    {"name": "Açúcar", "percentage": 45.0},
+    {"name": "Lecitina", "percentage": 0.5},
+    {"name": "Maltodextrina", "percentage": 15.0}
+]
+
+PROCESS_PARAMETERS = {"temperature": 75.0, "mixing_time": 12.0, "line_speed": 95.0, "pressure": 2.5}
+
+
+def prediction_payload(product_name: str, n_iterations: int, random_seed: int = 42) -> Dict:
+    """/predict request body for one product"""
+    return {
+        "project_id": "bench",
+        "product_name": product_name,
+        "formula": FORMULA,
+        "process_parameters": PROCESS_PARAMETERS,
+        "factory": "Araraquara - SP",
+        "monte_carlo_iterations": n_iterations,
+        "random_seed": random_seed
+    }
+
+
+def time_call(fn: Callable[[], object], repeat: int) -> Dict:
+    """Median/min milliseconds per call over `repeat` samples (calls per sample auto-scaled)"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    samples = [t / number * 1000 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'median_ms': statistics.median(samples),
+        'min_ms': min(samples),
+        'calls_per_sample': number
+    }
+
+
+def benchmark_model(repeat: int) -> Dict[str, Dict]:
+    """TestPredictorModel.predict for every product family"""
+    from app.ml_models import TestPredictorModel
+    
+    results = {}
+    for family, product_name in PRODUCTS.items():
+        model = TestPredictorModel(product_name)
+        results[f"model.predict[{family}]"] = time_call(
+            lambda: model.predict(FORMULA, PROCESS_PARAMETERS), repeat
+        )
+    return results
+
+
+def benchmark_monte_carlo(repeat: int) -> Dict[str, Dict]:
+    """Monte Carlo stages for one test at each iteration count"""
+    from app.monte_carlo import MonteCarloSimulator
+    
+    process_variability = {'overall': 0.04}
+    formula_variability = {'overall': 0.05}
+    results = {}
+    for n_iterations in ITERATIONS:
+        simulator = MonteCarloSimulator(n_iterations=n_iterations)
+        simulated, _ = simulator.simulate_test_results(27.1, process_variability, formula_variability, 30.0)
+        
+        results[f"simulate_test_results[{n_iterations}]"] = time_call(
+            lambda: MonteCarloSimulator(n_iterations=n_iterations).simulate_test_results(
+                27.1, process_variability, formula_variability, 30.0
+            ),
+            repeat
+        )
+        results[f"calculate_probability_of_fail[{n_iterations}]"] = time_call(
+            lambda: simulator.calculate_probability_of_fail(simulated, 30.0), repeat
+        )
+        results[f"get_confidence_interval[{n_iterations}]"] = time_call(
+            lambda: simulator.get_confidence_interval(simulated), repeat
+        )
+    return results
+
+
+def benchmark_api(repeat: int) -> Dict[str, Dict]:
+    """End-to-end /predict per family and iteration count, and /predict/batch per batch size"""
+    from fastapi.testclient import TestClient
+    from app import main as service
+    
+    # Sem memoização: cada chamada percorre o pipeline completo. As settings
+    # já foram criadas pelos benchmarks anteriores (app.config), então o
+    # cache é desligado no módulo e não pela variável de ambiente
+    service.result_cache = None
+    client = TestClient(service.app)
+    
+    def post(path: str, body) -> None:
+        response = client.post(path, json=body)
+        response.raise_for_status()
+    
+    results = {}
+    for family, product_name in PRODUCTS.items():
+        for n_iterations in ITERATIONS:
+            body = prediction_payload(product_name, n_iterations)
+            results[f"/predict[{family},{n_iterations}]"] = time_call(lambda: post('/predict', body), repeat)
+    
+    products = list(PRODUCTS.values())
+    for batch_size in BATCH_SIZES:
+        body = [
+            prediction_payload(products[i % len(products)], 10000, random_seed=i)
+            for i in range(batch_size)
+        ]
+        results[f"/predict/batch[{batch_size}]"] = time_call(lambda: post('/predict/batch', body), repeat)
+    
+    memoized = service.pipeline_metrics.predictions_total.value(source="memoized")
+    if memoized:
+        raise RuntimeError(f"{memoized:.0f} API calls were served from the result cache instead of computed")
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], max_regression: float) -> List[str]:
+    """Benchmarks whose median is slower than the baseline by more than max_regression"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median_ms'] / baseline[name]['median_ms']
+        result['baseline_median_ms'] = baseline[name]['median_ms']
+        result['ratio'] = ratio
+        if ratio > 1 + max_regression:
+            regressions.append(f"{name}: {result['median_ms']:.3f} ms vs {baseline[name]['median_ms']:.3f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Timing samples per benchmark')
+    parser.add_argument('--only', choices=('model', 'monte_carlo', 'api'), nargs='+', help='Run only these groups')
+    parser.add_argument('--output', help='Write the results JSON to this file')
+    parser.add_argument('--baseline', help='Results JSON of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Fail when a median is this much slower (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+    
+    groups = {'model': benchmark_model, 'monte_carlo': benchmark_monte_carlo, 'api': benchmark_api}
+    results: Dict[str, Dict] = {}
+    for name, benchmark in groups.items():
+        if args.only is None or name in args.only:
+            results.update(benchmark(args.repeat))
+    
+    regressions: List[str] = []
+    baseline: Optional[Dict] = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.max_regression)
+    
+    for name, result in results.items():
+        line = f"{name:<45}{result['median_ms']:>12.3f} ms"
+        if 'ratio' in result:
+            line += f"{result['ratio']:>8.2f}x"
+        print(line)
+    
+    if args.output:
+        report = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat() + "Z",
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'repeat': args.repeat
+            },
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Sampling benchmark: error of each noise sampler against the exact distribution at equal CPU time
+
+For one reference test (Nescau solubility close to its spec limit) every
+sampler in SAMPLING_METHODS runs simulate_test_results over several seeds
+and iteration counts. The errors of probability_of_fail and of the
+confidence interval endpoints are measured against analytic_test_results,
+which is exact. `efficiency` is the work-normalized variance ratio
+(rmse² · time of 'random') / (rmse² · time of the sampler) at the same
+iteration count: above 1 the sampler reaches the same precision in less
+CPU time.
+
+Usage:
+    python -m benchmarks.sampling --replications 50 --iterations 1000 10000
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.monte_carlo import SAMPLING_METHODS, MonteCarloSimulator
+
+# Caso de referência: valor base perto do limite superior (P(falha) ~ 0,8%)
+REFERENCE_CASE = {
+    'base_prediction': 27.1,
+    'process_variability': {'overall': 0.04},
+    'formula_variability': {'overall': 0.05},
+    'spec_limit': 30.0,
+    'limit_type': 'upper'
+}
+
+
+def measure(sampling: str, n_iterations: int, replications: int, exact: Dict) -> Dict:
+    """RMSE of probability/CI endpoints and mean seconds per simulation for one sampler"""
+    errors = {'probability_of_fail': [], 'ci_lower': [], 'ci_upper': []}
+    seconds = []
+    for seed in range(replications):
+        start = time.perf_counter()
+        simulator = MonteCarloSimulator(n_iterations=n_iterations, random_seed=seed, sampling=sampling)
+        _, stats = simulator.simulate_test_results(**REFERENCE_CASE)
+        seconds.append(time.perf_counter() - start)
+        errors['probability_of_fail'].append(stats['probability_of_fail'] - exact['probability_of_fail'])
+        errors['ci_lower'].append(stats['confidence_interval'][0] - exact['confidence_interval'][0])
+        errors['ci_upper'].append(stats['confidence_interval'][1] - exact['confidence_interval'][1])
+    
+    result = {f"rmse_{key}": float(np.sqrt(np.mean(np.square(values)))) for key, values in errors.items()}
+    result['seconds'] = float(np.mean(seconds))
+    return result
+
+
+def run(iterations: List[int], replications: int) -> List[Dict]:
+    """Measure every sampler at every iteration count, with efficiency relative to 'random'"""
+    exact = MonteCarloSimulator().analytic_test_results(**REFERENCE_CASE)
+    # Aquecimento: imports preguiçosos (scipy) fora da medição
+    for sampling in SAMPLING_METHODS:
+        MonteCarloSimulator(n_iterations=1000, sampling=sampling).simulate_test_results(**REFERENCE_CASE)
+    
+    rows = []
+    for n_iterations in iterations:
+        results = {
+            sampling: measure(sampling, n_iterations, replications, exact)
+            for sampling in SAMPLING_METHODS
+        }
+        baseline = results['random']
+        for sampling, result in results.items():
+            for key in ('probability_of_fail', 'ci_lower', 'ci_upper'):
+                work = result[f"rmse_{key}"] ** 2 * result['seconds']
+                baseline_work = baseline[f"rmse_{key}"] ** 2 * baseline['seconds']
+                result[f"efficiency_{key}"] = float(baseline_work / work) if work > 0 else float('inf')
+            rows.append({'sampling': sampling, 'iterations': n_iterations, **result})
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--replications', type=int, default=50, help='Seeds per sampler and iteration count')
+    parser.add_argument('--iterations', type=int, nargs='+', default=[1000, 10000], help='Iteration counts to measure')
+    parser.add_argument('--output', help='Write the results JSON to this file')
+    args = parser.parse_args(argv)
+    
+    rows = run(args.iterations, args.replications)
+    
+    print(f"{'sampling':<16}{'iterations':>11}{'ms':>9}{'rmse p':>11}{'rmse ci':>11}{'eff p':>8}{'eff ci':>8}")
+    for row in rows:
+        rmse_ci = max(row['rmse_ci_lower'], row['rmse_ci_upper'])
+        efficiency_ci = min(row['efficiency_ci_lower'], row['efficiency_ci_upper'])
+        print(
+            f"{row['sampling']:<16}{row['iterations']:>11}{row['seconds'] * 1000:>9.2f}"
+            f"{row['rmse_probability_of_fail']:>11.5f}{rmse_ci:>11.5f}"
+            f"{row['efficiency_probability_of_fail']:>8.2f}{efficiency_ci:>8.2f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Cold-start benchmark: import time, RSS and heavy libraries loaded by the service
+
+Each run starts a fresh interpreter, imports app.main, then serves one
+prediction through run_prediction. The run fails if a heavy library (xgboost,
+scikit-learn, scipy, shap, pandas) was loaded on that path or if the
+thresholds are exceeded.
+
+Usage:
+    python -m benchmarks.startup --runs 5 --max-import-seconds 1.5 --max-rss-mb 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+HEAVY_MODULES = ('xgboost', 'sklearn', 'scipy', 'shap', 'pandas')
+
+SERVICE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import app.main
+import_seconds = time.perf_counter() - start
+import_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+from app.schemas import PredictionRequest
+request = PredictionRequest(
+    project_id="bench",
+    product_name="Nescau Zero Açúcar",
+    formula=[{"name": "Cacau", "percentage": 35.0}, {"name": "Lecitina", "percentage": 0.5}],
+    process_parameters={"temperature": 75.0, "mixing_time": 12.0, "line_speed": 95.0},
+    factory="Araraquara - SP"
+)
+start = time.perf_counter()
+app.main.run_prediction(request)
+first_prediction_seconds = time.perf_counter() - start
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "import_rss_mb": import_rss_mb,
+    "first_prediction_seconds": first_prediction_seconds,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy_modules": sorted(m for m in %r if m in sys.modules)
+}))
+''' % (HEAVY_MODULES,)
+
+
+def run_probe() -> Dict:
+    """Run one cold start in a fresh interpreter"""
+    env = dict(os.environ, PYTHONPATH=SERVICE_ROOT)
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=SERVICE_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """Median of each numeric metric across runs"""
+    summary = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ('import_seconds', 'import_rss_mb', 'first_prediction_seconds', 'rss_mb')
+    }
+    summary['heavy_modules'] = sorted({m for run in runs for m in run['heavy_modules']})
+    summary['runs'] = len(runs)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts to measure')
+    parser.add_argument('--max-import-seconds', type=float, default=None, help='Fail above this median import time')
+    parser.add_argument('--max-rss-mb', type=float, default=None, help='Fail above this median RSS after one prediction')
+    parser.add_argument('--output', help='Write the summary JSON to this file')
+    args = parser.parse_args(argv)
+    
+    summary = summarize([run_probe() for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    
+    failures = []
+    if summary['heavy_modules']:
+        failures.append(f"heavy modules imported on the request path: {', '.join(summary['heavy_modules'])}")
+    if args.max_import_seconds is not None and summary['import_seconds'] > args.max_import_seconds:
+        failures.append(f"import took {summary['import_seconds']:.2f}s (limit {args.max_import_seconds}s)")
+    if args.max_rss_mb is not None and summary['rss_mb'] > args.max_rss_mb:
+        failures.append(f"RSS {summary['rss_mb']:.0f} MB (limit {args.max_rss_mb} MB)")
+    
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())